@@ -3,7 +3,6 @@
 import os
 import sys
 from datetime import datetime
-import pandas as pd
 
 # get absolute path to project's root directory
 project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
@@ -12,54 +11,175 @@ project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
 sys.path.insert(0, project_root)
 
 from functions.get_bearer_access_token import (
-    get_bearer_access_token,
+    BearerTokenProvider,
     encode_api_credentials,
 )
-from functions.retrieve_data_from_idealista import (
-    url_encode_request_data,
-    retrieve_data_from_idealista,
-)
+from functions.idealista_client import IdealistaClient, IDEALISTA_API_URL
+from functions.request_scheduler import RequestScheduler, TokenBucketRateLimiter
+from functions.run_query_jobs import load_query_jobs, run_query_jobs
+from functions.listing_key_index import load_listing_key_index
+from functions.schema_registry import SchemaRegistry
+from functions.flatten_listings import QueryMetadataTable
+from functions.response_cache import ResponseCache
 
 from functions.save_data_to_csv import (
     backup_idealista_data,
-    append_idealista_data,
-    remove_duplicates_from_csv,
+    persist_idealista_data,
+    append_idealista_parquet,
+    iter_idealista_data,
 )
 
 from functions.write_data_to_nosql import DynamoDB_Helper
+from functions.listing_snapshot import ListingSnapshot
+from functions.write_data_to_sqlite import SQLiteListingStore
 
-dynamodb_helper = DynamoDB_Helper()
+from global_variables import DATA_DIRECTORY, QUERY_JOBS_FILE
 
 # API key and secret are saved as environment variables
 secret = os.getenv("IDEALISTA_SECRET")
 api_key = os.getenv("IDEALISTA_API_KEY")
 
-# get bearer access token
+# one client with pooled keep-alive connections for all requests to the API,
+# rate limited to our API quota and retrying throttled (429) or failed (5xx) requests;
+# IDEALISTA_API_URL can point to a local stand-in (tests/idealista_stand_in_server.py)
+max_workers = 4
+scheduler = RequestScheduler(rate_limiter=TokenBucketRateLimiter(rate=1, capacity=2))
+client = IdealistaClient(
+    base_url=os.getenv("IDEALISTA_API_URL", IDEALISTA_API_URL),
+    pool_size=max_workers,
+    scheduler=scheduler,
+)
+
+# bearer access token is cached on disk and refreshed shortly before it expires
 base64_authorization_string = encode_api_credentials(api_key=api_key, secret=secret)
-BAT = get_bearer_access_token(base64_authorization_string=base64_authorization_string)
-
-# retrieve data from last week from idealista
-df_all = pd.DataFrame()
-for furnished in ["furnishedKitchen", "furnished"]:
-    totalPages = 20
-    actualPage = 1
-
-    while actualPage <= totalPages:
-        request_data = url_encode_request_data(furnished=furnished, numPage=actualPage)
-        df, totalPages, actualPage = retrieve_data_from_idealista(
-            request_data=request_data, access_token=BAT
-        )
-        df["furnished"] = furnished
-        df["insert_date"] = datetime.today().strftime("%Y-%m-%d")
-
-        actualPage += 1
-        df_all = pd.concat([df_all, df], ignore_index=True)
-
-# write data to csv for analysis
-backup_idealista_data(file_name="idealista_data.csv")
-append_idealista_data(file_name="idealista_data.csv", df_new_data=df_all)
-remove_duplicates_from_csv(file_name="idealista_data.csv")
-
-# write data to NoSQL database
-dynamodb_helper.create_table_NoSQL()
-dynamodb_helper.write_data_to_NoSQL(df_all)
+token_provider = BearerTokenProvider(
+    base64_authorization_string=base64_authorization_string, client=client
+)
+
+# responses are cached on disk, so a re-run does not request the same pages again;
+# set IDEALISTA_REPLAY_ONLY=True to only use cached responses (e.g. while developing).
+# Entries are keyed by the API host, so a stand-in never serves its responses as real ones
+cache = ResponseCache(
+    replay_only=os.getenv("IDEALISTA_REPLAY_ONLY") == "True", base_url=client.base_url
+)
+
+# keys (propertyCode, price, size) of all listings that are already stored; an empty index
+# is rebuilt from the listing history first (e.g. on the first run after an upgrade)
+key_index = load_listing_key_index()
+
+# queries are defined in a job spec (query_jobs.yaml or the file in IDEALISTA_QUERY_JOBS)
+queries = load_query_jobs(os.getenv("IDEALISTA_QUERY_JOBS", QUERY_JOBS_FILE))
+insert_date = datetime.today().strftime("%Y-%m-%d")
+
+# summary, total and totalPages of every query, referenced by the query_id of the listings
+query_metadata = QueryMetadataTable()
+
+# all queries and pages are retrieved concurrently within one rate limit;
+# queries with more pages than we page through are split into price and area shards.
+# With IDEALISTA_INCREMENTAL=True the newest listings are retrieved first and
+# pagination stops at the first page without new listings
+df_all = run_query_jobs(
+    queries=queries,
+    token_provider=token_provider,
+    extra_columns={"insert_date": insert_date},
+    key_index=(
+        key_index
+        if os.getenv("IDEALISTA_INCREMENTAL") == "True" and len(key_index) > 0
+        else None
+    ),
+    max_workers=max_workers,
+    client=client,
+    cache=cache,
+    query_metadata=query_metadata,
+)
+client.close()
+
+# listings that are already stored are not written again; if the key index gets out of
+# sync with the files, rebuild it with: python -m functions.listing_key_index --rebuild
+df_new = key_index.drop_known(df_all)
+
+# columns and dtypes of the csv files of the history; batches with new columns are
+# written to a new file, read_idealista_data reads all files into one dataframe
+schema_registry = SchemaRegistry()
+schema_registry.discover(file_name="idealista_data.csv")
+
+# persist stage: the file the new listings belong to is backed up (compressed, as delta
+# against the last full backup) and appended to in one pass, and is never left half-written;
+# old backups are deleted after a while.
+# Restore with: python -m functions.save_data_to_csv --restore [YYYY-MM-DD] [--file-name ...]
+partition = persist_idealista_data(
+    df_new_data=df_new, file_name="idealista_data.csv", schema_registry=schema_registry
+)
+# the listings are stored now, so the next run does not retrieve or write them again
+key_index.add_dataframe(df_new)
+
+# the other files of the history do not change, they only need a backup once
+for other_partition in schema_registry.partitions:
+    if other_partition != partition:
+        backup_idealista_data(file_name=other_partition)
+
+# write query metadata (one row per query and day) to its own csv; queries that were already
+# written today (a rerun on the same day) are not written again
+query_metadata_registry = SchemaRegistry(
+    os.path.join(DATA_DIRECTORY, "idealista_query_metadata_schema.json")
+)
+query_metadata_registry.discover(file_name="idealista_query_metadata.csv")
+known_query_ids = {
+    query_id
+    for df_chunk in iter_idealista_data(
+        usecols=["query_id", "insert_date"],
+        dtype={"query_id": object, "insert_date": object},
+        schema_registry=query_metadata_registry,
+    )
+    for query_id in df_chunk.loc[df_chunk["insert_date"] == insert_date, "query_id"]
+}
+df_query_metadata = query_metadata.to_dataframe()
+if len(df_query_metadata) > 0:
+    df_query_metadata = df_query_metadata[
+        ~df_query_metadata["query_id"].isin(known_query_ids)
+    ].assign(insert_date=insert_date)
+if len(df_query_metadata) > 0:
+    persist_idealista_data(
+        df_new_data=df_query_metadata,
+        file_name="idealista_query_metadata.csv",
+        schema_registry=query_metadata_registry,
+    )
+
+# write data to parquet dataset (partitioned by insert_date and furnished), which is
+# faster to read than the csv: read_idealista_parquet(columns=[...], filters=[...])
+append_idealista_parquet(df_new_data=df_new, schema_registry=schema_registry)
+
+# optionally upsert the listings into a local SQLite database with indexes for ad-hoc queries,
+# e.g. SQLiteListingStore().price_history(propertyCode) or .cheap_listings(district, max_price_by_area);
+# fill it from the csv history with: python -m functions.write_data_to_sqlite --load
+if os.getenv("IDEALISTA_SQLITE") == "True":
+    sqlite_store = SQLiteListingStore()
+    sqlite_store.upsert(df_new)
+    sqlite_store.close()
+
+# write data to NoSQL database, unless IDEALISTA_NOSQL=False (e.g. in runs against the API stand-in)
+if os.getenv("IDEALISTA_NOSQL", "True") == "True":
+    # key design of the NoSQL table: "run" (insert_date and row number, the design of the
+    # existing table, default) or "listing" (propertyCode and insert_date, for a new table
+    # set in IDEALISTA_NOSQL_TABLE); writing to an existing table with another key design
+    # fails before anything is written
+    dynamodb_helper = DynamoDB_Helper(
+        key_schema=os.getenv("IDEALISTA_NOSQL_KEY_SCHEMA", "run")
+    )
+    nosql_table_name = os.getenv("IDEALISTA_NOSQL_TABLE", "IdealistaDataMadrid")
+
+    # new NoSQL tables use on-demand capacity unless IDEALISTA_NOSQL_BILLING_MODE=PROVISIONED
+    dynamodb_helper.create_table_NoSQL(
+        table_name=nosql_table_name,
+        billing_mode=os.getenv("IDEALISTA_NOSQL_BILLING_MODE", "PAY_PER_REQUEST"),
+    )
+
+    # write data to NoSQL database; with IDEALISTA_NOSQL_INCREMENTAL=True only listings that
+    # are new or changed since they were last written (content hash per propertyCode) are written
+    dynamodb_helper.write_data_to_NoSQL(
+        df_all,
+        snapshot=(
+            ListingSnapshot() if os.getenv("IDEALISTA_NOSQL_INCREMENTAL") == "True" else None
+        ),
+        table_name=nosql_table_name,
+    )
@@ -0,0 +1,58 @@
+import pandas as pd
+
+
+class ListingBatchBuilder:
+    """
+    Collects listings from many pages in one list per column and builds a single
+    dataframe at the end. Adding a page only appends to the column lists, so the total
+    work grows linearly with the number of listings (instead of copying all previous
+    rows again with every pd.concat).
+    """
+
+    def __init__(self):
+        self.columns = {}
+        self.num_rows = 0
+
+    def add_records(self, records: list, **constant_columns) -> None:
+        """
+        Function that appends records (e.g. the elementList of one page) to the column lists.
+        Columns that are missing in a record are filled with None.
+
+        Args:
+            records (list): List of dicts with one listing each.
+            **constant_columns: Columns with the same value for all records, e.g. furnished="furnished".
+
+        Raises:
+            ValueError: If a record contains one of the constant columns.
+        """
+        overlap = {column for record in records for column in record if column in constant_columns}
+        if overlap:
+            raise ValueError(f"Columns {sorted(overlap)} are passed both in the records and as constant columns.")
+
+        for record in records:
+            for column, value in record.items():
+                if column not in self.columns:
+                    # new column: fill the rows that were added before
+                    self.columns[column] = [None] * self.num_rows
+                self.columns[column].append(value)
+            self.num_rows += 1
+            for column, values in self.columns.items():
+                if len(values) < self.num_rows and column not in constant_columns:
+                    values.append(None)
+
+        for column, value in constant_columns.items():
+            if column not in self.columns:
+                self.columns[column] = [None] * (self.num_rows - len(records))
+            self.columns[column].extend([value] * len(records))
+
+    def __len__(self) -> int:
+        return self.num_rows
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """
+        Function that builds one dataframe from all records that were added.
+
+        Returns:
+            pd.DataFrame: Dataframe with one row per record.
+        """
+        return pd.DataFrame(self.columns)
@@ -0,0 +1,114 @@
+import hashlib
+import json
+import threading
+import urllib.parse
+import pandas as pd
+
+# fields of a listing that have a dict (or a list of dicts) as value
+NESTED_FIELDS = ["detailedType", "suggestedTexts", "parkingSpace", "labels", "highlight"]
+# separator of the values of several labels, e.g. labelName "apartamentoType|luxuryType"
+LABEL_SEPARATOR = "|"
+
+
+def flatten_listing(record: dict) -> dict:
+    """
+    Function that replaces the nested fields of a listing by scalar fields, e.g.
+    {"detailedType": {"typology": "flat"}} by {"typology": "flat"}. The names are the keys of
+    the nested dict (prefixed with the field name if the listing already has a field with that
+    name). The values of all labels are joined with LABEL_SEPARATOR, e.g. labelName and labelText
+    (an empty value where a label has no such key, so the positions match).
+
+    Args:
+        record (dict): Listing as returned by the API.
+
+    Returns:
+        dict: Listing with scalar values, the fields keep their order.
+    """
+    flat_record = {}
+    for field, value in record.items():
+        if field not in NESTED_FIELDS:
+            flat_record[field] = value
+            continue
+        if isinstance(value, list):
+            keys = list(dict.fromkeys(key for label in value for key in label))
+            value = {
+                "label" + key[:1].upper() + key[1:]: LABEL_SEPARATOR.join(
+                    str(label.get(key, "")) for label in value
+                )
+                for key in keys
+            }
+        if not isinstance(value, dict):
+            continue
+        for key, nested_value in value.items():
+            if key in record:
+                key = field + key[:1].upper() + key[1:]
+            flat_record[key] = nested_value
+    return flat_record
+
+
+def make_query_id(request_data: str) -> str:
+    """
+    Function that builds the id of a query from its request data. All pages of a query
+    have the same id.
+
+    Args:
+        request_data (str): Url encoded request data (with or without numPage).
+
+    Returns:
+        str: First 16 characters of the SHA-256 hash of the request data without numPage.
+    """
+    parameters = [
+        (key, value)
+        for key, value in urllib.parse.parse_qsl(request_data)
+        if key != "numPage"
+    ]
+    return hashlib.sha256(urllib.parse.urlencode(parameters).encode("utf-8")).hexdigest()[:16]
+
+
+class QueryMetadataTable:
+    """
+    Collects one row per query with the data that the API returns for the whole query
+    (summary of the filters, total number of listings and pages), so that it is not repeated
+    on every listing. The listings reference the row by their query_id column.
+    """
+
+    def __init__(self):
+        self.rows = {}
+        self._lock = threading.Lock()
+
+    def add(self, request_data: str, data: dict) -> str:
+        """
+        Function that adds the metadata of a page (only the first page of a query is kept).
+
+        Args:
+            request_data (str): Url encoded request data of the page.
+            data (dict): Parsed page.
+
+        Returns:
+            str: query_id of the page.
+        """
+        query_id = make_query_id(request_data)
+        with self._lock:
+            if query_id not in self.rows:
+                self.rows[query_id] = {
+                    "query_id": query_id,
+                    "request_data": "&".join(
+                        part for part in request_data.split("&") if not part.startswith("numPage=")
+                    ),
+                    "summary": json.dumps(data.get("summary", []), ensure_ascii=False),
+                    "total": data.get("total"),
+                    "totalPages": data.get("totalPages"),
+                }
+        return query_id
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """
+        Function that builds the query metadata table.
+
+        Returns:
+            pd.DataFrame: One row per query.
+        """
+        return pd.DataFrame(list(self.rows.values()))
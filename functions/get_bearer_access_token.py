@@ -1,45 +1,84 @@
 import pybase64
-from requests.structures import CaseInsensitiveDict
 import requests
 import ast
+import hashlib
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
 from datetime import timedelta
 
+from global_variables import DATA_DIRECTORY
 
-def get_bearer_access_token(
+from functions.idealista_client import (
+    IdealistaClient,
+    IDEALISTA_API_URL,
+    TOKEN_PATH,
+    build_token_headers,
+)
+from functions.request_scheduler import IdealistaAPIError
+
+
+def request_bearer_access_token(
     base64_authorization_string: str,
-) -> str:
+    client: IdealistaClient = None,
+) -> dict:
     """
-    Function that retrieves the current bearer access token using
-    the idealista API key and secret.
-    This is needed to retrieve any information from the API.
+    Function that requests a new bearer access token from the oauth endpoint.
 
     :param base64_authorization_string: encoded authorization header
+    :param client: shared IdealistaClient with pooled connections (optional).
 
-    :return: Bearer access token.
+    :return: Token response with the keys access_token and expires_in (seconds).
     """
-    url = "https://api.idealista.com/oauth/token"
-
-    headers = CaseInsensitiveDict()
-    headers["Authorization"] = base64_authorization_string
-    headers["Content-Type"] = "application/x-www-form-urlencoded"
-    headers["Accept"] = "application/json"
+    headers = build_token_headers(base64_authorization_string)
     data = "grant_type=client_credentials"
 
     # retrieve bearer access token
-    response = requests.post(url, headers=headers, data=data, timeout=5)
-    assert (
-        response.status_code == 200
-    ), """get_bearer_access_token: API Call failed with status code {status_code}
+    if client is None:
+        response = requests.post(
+            IDEALISTA_API_URL + TOKEN_PATH, headers=headers, data=data, timeout=5
+        )
+    else:
+        response = client.post(TOKEN_PATH, headers=headers, data=data)
+    if response.status_code != 200:
+        raise IdealistaAPIError(
+            """get_bearer_access_token: API Call failed with status code {status_code}
             and message {text}.
             No bearer access token was retrieved.""".format(
-        status_code=response.status_code, text=response.text
-    )
+                status_code=response.status_code, text=response.text
+            ),
+            status_code=response.status_code,
+        )
 
     dict_resp = ast.literal_eval(response.text)
+    if len(dict_resp["access_token"]) == 0:
+        raise IdealistaAPIError(
+            "get_bearer_access_token: No bearer access token was retrieved."
+        )
+
+    return dict_resp
+
+
+def get_bearer_access_token(
+    base64_authorization_string: str,
+    client: IdealistaClient = None,
+) -> str:
+    """
+    Function that retrieves the current bearer access token using
+    the idealista API key and secret.
+    This is needed to retrieve any information from the API.
+
+    :param base64_authorization_string: encoded authorization header
+    :param client: shared IdealistaClient with pooled connections (optional).
+
+    :return: Bearer access token.
+    """
+    dict_resp = request_bearer_access_token(
+        base64_authorization_string=base64_authorization_string, client=client
+    )
     access_token = dict_resp["access_token"]
-    assert (
-        len(access_token) > 0
-    ), "get_bearer_access_token: No bearer access token was retrieved."
 
     expiration_secs = dict_resp["expires_in"]
     print(
@@ -75,3 +114,143 @@ def encode_api_credentials(
     base64_authorization_string = "Basic " + str(base64_authorization_string)[2:-1]
 
     return base64_authorization_string
+
+
+@contextmanager
+def _file_lock(lock_file: str, timeout: float = 30, stale_after: float = 60):
+    """
+    Context manager for a lock that is shared between processes. The lock is a file
+    that is created exclusively, which works on Windows and Linux alike.
+
+    :param lock_file: path of the lock file.
+    :param timeout: seconds to wait for the lock before giving up.
+    :param stale_after: seconds after which a lock of a crashed process is removed.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            file_descriptor = os.open(lock_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError as error:
+            try:
+                if time.time() - os.path.getmtime(lock_file) > stale_after:
+                    os.remove(lock_file)
+                    continue
+            except FileNotFoundError:
+                continue
+            if time.monotonic() > deadline:
+                raise TimeoutError("Could not acquire lock " + lock_file) from error
+            time.sleep(0.05)
+    try:
+        yield
+    finally:
+        os.close(file_descriptor)
+        os.remove(lock_file)
+
+
+class BearerTokenProvider:
+    """
+    Provides a bearer access token that is cached in memory and on disk, so that
+    short jobs and parallel workers reuse one token instead of requesting a new one each.
+    The token is refreshed shortly before it expires.
+    """
+
+    def __init__(
+        self,
+        base64_authorization_string: str,
+        client: IdealistaClient = None,
+        cache_file: str = os.path.join(DATA_DIRECTORY, ".idealista_token.json"),
+        refresh_margin: float = 300,
+    ):
+        """
+        :param base64_authorization_string: encoded authorization header
+        :param client: shared IdealistaClient with pooled connections (optional).
+        :param cache_file: file in which the token and its expiry are stored.
+        :param refresh_margin: seconds before expiry at which the token is refreshed.
+        """
+        self.base64_authorization_string = base64_authorization_string
+        self.client = client
+        self.cache_file = cache_file
+        self.refresh_margin = refresh_margin
+        # the cache is only valid for the credentials it was created with
+        self.credentials_hash = hashlib.sha256(
+            base64_authorization_string.encode("utf-8")
+        ).hexdigest()
+        self._token = None
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(cache_file)), exist_ok=True)
+
+    def _is_valid(self, token: dict) -> bool:
+        return (
+            token is not None
+            and token.get("credentials_hash") == self.credentials_hash
+            and token["expires_at"] - self.refresh_margin > time.time()
+        )
+
+    def _read_cache_file(self) -> dict:
+        try:
+            with open(self.cache_file, "r", encoding="utf-8") as file:
+                token = json.load(file)
+        except (FileNotFoundError, ValueError, KeyError):
+            return None
+        # a cache file of an older version or edited by hand is ignored, a new token is requested
+        if not isinstance(token, dict) or not {"access_token", "expires_at"} <= set(token):
+            return None
+        return token
+
+    def _write_cache_file(self, token: dict) -> None:
+        # write to a temporary file first so that other processes never read half a file
+        tmp_file = self.cache_file + ".tmp"
+        file_descriptor = os.open(tmp_file, os.O_CREAT | os.O_TRUNC | os.O_WRONLY, 0o600)
+        with os.fdopen(file_descriptor, "w", encoding="utf-8") as file:
+            json.dump(token, file)
+        os.replace(tmp_file, self.cache_file)
+
+    def get_token(self) -> str:
+        """
+        Function that returns a valid bearer access token, from memory, from the cache file
+        or, if both are missing or about to expire, from the API.
+
+        :return: Bearer access token.
+        """
+        with self._lock:
+            if self._is_valid(self._token):
+                return self._token["access_token"]
+
+            with _file_lock(self.cache_file + ".lock"):
+                token = self._read_cache_file()
+                if not self._is_valid(token):
+                    dict_resp = request_bearer_access_token(
+                        base64_authorization_string=self.base64_authorization_string,
+                        client=self.client,
+                    )
+                    token = {
+                        "access_token": dict_resp["access_token"],
+                        "expires_at": time.time() + dict_resp["expires_in"],
+                        "credentials_hash": self.credentials_hash,
+                    }
+                    self._write_cache_file(token)
+                    print(
+                        "New bearer access token expires in:",
+                        timedelta(seconds=dict_resp["expires_in"]),
+                        "(hh:mm:ss)",
+                    )
+                self._token = token
+
+            return self._token["access_token"]
+
+    def invalidate(self, access_token: str) -> None:
+        """
+        Function that discards a token that was rejected by the API (status code 401).
+        Only the given token is discarded, so a token that another thread or process
+        has already refreshed is kept.
+
+        :param access_token: bearer access token that was rejected.
+        """
+        with self._lock:
+            if self._token is not None and self._token["access_token"] == access_token:
+                self._token = None
+            with _file_lock(self.cache_file + ".lock"):
+                token = self._read_cache_file()
+                if token is not None and token["access_token"] == access_token:
+                    os.remove(self.cache_file)
@@ -0,0 +1,119 @@
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+from functions.request_scheduler import RequestScheduler
+
+IDEALISTA_API_URL = "https://api.idealista.com"
+TOKEN_PATH = "/oauth/token"
+SEARCH_PATH = "/3.5/es/search?"
+
+
+def build_token_headers(base64_authorization_string: str) -> CaseInsensitiveDict:
+    """
+    Function that builds the headers for a request to the oauth token endpoint.
+
+    Args:
+        base64_authorization_string (str): Encoded authorization header.
+
+    Returns:
+        CaseInsensitiveDict: Headers for the token request.
+    """
+    headers = CaseInsensitiveDict()
+    headers["Authorization"] = base64_authorization_string
+    headers["Content-Type"] = "application/x-www-form-urlencoded"
+    headers["Accept"] = "application/json"
+    return headers
+
+
+def build_search_headers(access_token: str) -> CaseInsensitiveDict:
+    """
+    Function that builds the headers for a request to the search endpoint.
+
+    Args:
+        access_token (str): Bearer access token for idealista API.
+
+    Returns:
+        CaseInsensitiveDict: Headers for the search request.
+    """
+    headers = CaseInsensitiveDict()
+    headers["Authorization"] = "Bearer " + access_token
+    return headers
+
+
+class IdealistaClient:
+    """HTTP client for the idealista API that keeps connections to the API alive.
+
+    All requests go through one requests.Session, so the TCP and TLS handshake is
+    only paid once per pooled connection instead of once per page. One client can
+    be shared by get_bearer_access_token, retrieve_data_from_idealista and all
+    threads of retrieve_all_pages_from_idealista.
+    If a RequestScheduler is passed, all requests are rate limited and retried by it.
+    """
+
+    def __init__(
+        self,
+        base_url: str = IDEALISTA_API_URL,
+        pool_size: int = 10,
+        timeout: tuple = (5, 30),
+        headers: dict = None,
+        scheduler: RequestScheduler = None,
+    ):
+        """
+        Args:
+            base_url (str, optional): Scheme and host of the API. Defaults to IDEALISTA_API_URL.
+            pool_size (int, optional): Maximum number of connections kept alive. Should be at least
+                the number of threads that use the client. Defaults to 10.
+            timeout (tuple, optional): Connect and read timeout in seconds for each request. Defaults to (5, 30).
+            headers (dict, optional): Default headers sent with every request. Defaults to None.
+            scheduler (RequestScheduler, optional): Rate limiter and retry policy. Defaults to None
+                (each request is sent once).
+        """
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.scheduler = scheduler
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self.session.headers.update({"Accept": "application/json"})
+        if headers is not None:
+            self.session.headers.update(headers)
+
+    def post(
+        self,
+        path: str,
+        headers: CaseInsensitiveDict = None,
+        data: str = None,
+    ) -> requests.Response:
+        """Function that sends a POST request over a pooled connection.
+
+        Args:
+            path (str): Path of the endpoint including the query string, e.g. SEARCH_PATH + request_data.
+            headers (CaseInsensitiveDict, optional): Headers that are added to the default headers.
+            data (str, optional): Body of the request.
+
+        Returns:
+            requests.Response: Response of the API.
+        """
+
+        def send_request():
+            return self.session.post(
+                self.base_url + path, headers=headers, data=data, timeout=self.timeout
+            )
+
+        if self.scheduler is None:
+            return send_request()
+        return self.scheduler.send(send_request)
+
+    def close(self) -> None:
+        """Function that closes all pooled connections."""
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,79 @@
+import pandas as pd
+
+# compact dtypes for the columns of the listings: few distinct values -> category,
+# flags -> nullable boolean, counts -> Int16, coordinates and ratios -> float32
+LISTING_DTYPE_PROFILE = {
+    **{
+        column: "category"
+        for column in [
+            "propertyType",
+            "operation",
+            "province",
+            "municipality",
+            "district",
+            "country",
+            "neighborhood",
+            "status",
+            "floor",
+            "furnished",
+            "insert_date",
+            "typology",
+            "subTypology",
+            "labelName",
+            "labelText",
+            "groupDescription",
+        ]
+    },
+    **{
+        column: "boolean"
+        for column in [
+            "exterior",
+            "showAddress",
+            "hasVideo",
+            "newDevelopment",
+            "hasLift",
+            "hasPlan",
+            "has3DTour",
+            "has360",
+            "hasStaging",
+            "topNewDevelopment",
+            "superTopHighlight",
+            "hasParkingSpace",
+            "isParkingSpaceIncludedInPrice",
+        ]
+    },
+    **{column: "Int16" for column in ["numPhotos", "rooms", "bathrooms"]},
+    **{column: "float32" for column in ["latitude", "longitude", "priceByArea"]},
+}
+
+# flags read from csv without registry are strings
+BOOLEAN_VALUES = {True: True, False: False, "True": True, "False": False, "true": True, "false": False}
+
+
+def apply_dtype_profile(
+    df: pd.DataFrame,
+    profile: dict = LISTING_DTYPE_PROFILE,
+    downcast_floats: bool = True,
+) -> pd.DataFrame:
+    """
+    Function that converts the columns of a listing dataframe to the compact dtypes of a profile,
+    column by column. Columns that are not in the dataframe are skipped.
+
+    Args:
+        df (pd.DataFrame): Listings, e.g. as returned by the API or read from csv.
+        profile (dict, optional): dtype per column. Defaults to LISTING_DTYPE_PROFILE.
+        downcast_floats (bool, optional): Convert float64 columns of the profile to float32, which
+            rounds coordinates to about 1 m. Set to False before the data is stored. Defaults to True.
+
+    Returns:
+        pd.DataFrame: Dataframe with converted columns (a copy).
+    """
+    dtypes = {}
+    df = df.copy()
+    for column, dtype in profile.items():
+        if column not in df.columns or (dtype == "float32" and not downcast_floats):
+            continue
+        if dtype == "boolean" and df[column].dtype == object:
+            df[column] = df[column].map(BOOLEAN_VALUES)
+        dtypes[column] = dtype
+    return df.astype(dtypes)
@@ -0,0 +1,252 @@
+from global_variables import DATA_DIRECTORY
+
+import argparse
+import glob
+import math
+import os
+import tempfile
+import threading
+import pandas as pd
+
+from functions.save_data_to_csv import (
+    iter_idealista_data,
+    read_idealista_parquet,
+    PARQUET_DATASET_NAME,
+)
+
+# a listing is a duplicate if propertyCode, price and size are the same
+KEY_COLUMNS = ["propertyCode", "price", "size"]
+
+
+def make_listing_key(propertyCode, price, size) -> str:
+    """
+    Function that builds the key of a listing. Prices and sizes are normalized to floats,
+    so that 1500, 1500.0 and "1500.0" (e.g. read from csv) give the same key.
+
+    Args:
+        propertyCode: Code of the listing.
+        price: Rent of the listing.
+        size: Size of the listing in m2.
+
+    Returns:
+        str: Key "propertyCode|price|size".
+    """
+
+    def normalize(value) -> str:
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            return str(value)
+        return "" if math.isnan(value) else repr(value)
+
+    return "|".join([str(propertyCode), normalize(price), normalize(size)])
+
+
+class ListingKeyIndex:
+    """
+    Persistent set of the keys (propertyCode, price, size) of all listings that are already
+    stored. The keys are kept in memory and appended to a text file with one key per line,
+    so checking a listing does not require reading the listing history.
+    """
+
+    def __init__(
+        self,
+        index_file: str = os.path.join(DATA_DIRECTORY, "idealista_data_keys.txt"),
+    ):
+        """
+        Args:
+            index_file (str, optional): File with one key per line. Defaults to DATA_DIRECTORY/idealista_data_keys.txt.
+        """
+        self.index_file = index_file
+        self.keys = set()
+        self._lock = threading.Lock()
+        try:
+            with open(index_file, "r", encoding="utf-8") as file:
+                self.keys = set(file.read().splitlines())
+        except FileNotFoundError:
+            pass
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def __contains__(self, record: dict) -> bool:
+        return (
+            make_listing_key(*(record.get(column) for column in KEY_COLUMNS)) in self.keys
+        )
+
+    def contains_all(self, records: list) -> bool:
+        """
+        Function that checks if all records (e.g. the elementList of one page) are already known.
+
+        Args:
+            records (list): List of dicts with one listing each.
+
+        Returns:
+            bool: True if every record is in the index.
+        """
+        return all(record in self for record in records)
+
+    @staticmethod
+    def dataframe_keys(df: pd.DataFrame) -> pd.Series:
+        """
+        Function that builds the keys of all rows of a dataframe.
+
+        Args:
+            df (pd.DataFrame): Listings with the columns propertyCode, price and size.
+
+        Returns:
+            pd.Series: Key of every row.
+        """
+        return pd.Series(
+            [
+                make_listing_key(code, price, size)
+                for code, price, size in zip(
+                    df["propertyCode"], df["price"], df["size"]
+                )
+            ],
+            index=df.index,
+            dtype=object,
+        )
+
+    def drop_known(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Function that removes the rows of a dataframe that are already in the index
+        and duplicate rows within the dataframe (the last one is kept).
+
+        Args:
+            df (pd.DataFrame): Listings with the columns propertyCode, price and size.
+
+        Returns:
+            pd.DataFrame: Rows that are new.
+        """
+        if len(df) == 0:
+            return df
+        keys = self.dataframe_keys(df)
+        df_new = df[~keys.isin(self.keys) & ~keys.duplicated(keep="last")]
+        if len(df_new) < len(df):
+            print(len(df) - len(df_new), "duplicate(s) were not written")
+        return df_new
+
+    def add_dataframe(self, df: pd.DataFrame) -> int:
+        """
+        Function that adds the keys of all rows of a dataframe and appends the new keys to the index file.
+
+        Args:
+            df (pd.DataFrame): Listings with the columns propertyCode, price and size.
+
+        Returns:
+            int: Number of keys that were new.
+        """
+        if len(df) == 0:
+            return 0
+        with self._lock:
+            new_keys = [
+                key for key in dict.fromkeys(self.dataframe_keys(df)) if key not in self.keys
+            ]
+            os.makedirs(os.path.dirname(os.path.abspath(self.index_file)), exist_ok=True)
+            with open(self.index_file, "a", encoding="utf-8") as file:
+                file.writelines(key + "\n" for key in new_keys)
+            self.keys.update(new_keys)
+        return len(new_keys)
+
+
+def rebuild_listing_key_index(
+    file_names: list = None,
+    data_dir: str = DATA_DIRECTORY,
+    index_file: str = os.path.join(DATA_DIRECTORY, "idealista_data_keys.txt"),
+    include_parquet: bool = True,
+    chunksize: int = 100000,
+) -> ListingKeyIndex:
+    """
+    Function that regenerates the key index from the stored listings, e.g. if the index file
+    was lost or files were changed by hand. The files are read in chunks and only the key
+    columns are parsed; the new index replaces the old index file at once.
+
+    Args:
+        file_names (list, optional): Csv files with listings. Defaults to None
+            (idealista_data.csv and the dated idealista_data_*.csv files in data_dir).
+        data_dir (str, optional): Directory of the files. Defaults to DATA_DIRECTORY.
+        index_file (str, optional): Index file that is replaced. Defaults to DATA_DIRECTORY/idealista_data_keys.txt.
+        include_parquet (bool, optional): Also read the parquet dataset in data_dir. Defaults to True.
+        chunksize (int, optional): Number of rows that are read at once. Defaults to 100000.
+
+    Returns:
+        ListingKeyIndex: The rebuilt index.
+    """
+    if file_names is None:
+        file_names = [
+            os.path.basename(file_path)
+            for file_path in sorted(glob.glob(os.path.join(data_dir, "idealista_data*.csv")))
+        ]
+
+    keys = set()
+    for file_name in file_names:
+        for df_chunk in iter_idealista_data(
+            chunksize=chunksize, usecols=KEY_COLUMNS, file_name=file_name, data_dir=data_dir
+        ):
+            keys.update(ListingKeyIndex.dataframe_keys(df_chunk))
+    if include_parquet:
+        keys.update(
+            ListingKeyIndex.dataframe_keys(
+                read_idealista_parquet(columns=KEY_COLUMNS, data_dir=data_dir)
+            )
+        )
+
+    # write to a temporary file first, so the old index stays complete if this fails
+    index_dir = os.path.dirname(os.path.abspath(index_file))
+    os.makedirs(index_dir, exist_ok=True)
+    file_descriptor, tmp_path = tempfile.mkstemp(dir=index_dir, suffix=".tmp")
+    with os.fdopen(file_descriptor, "w", encoding="utf-8") as file:
+        file.writelines(key + "\n" for key in sorted(keys))
+    os.replace(tmp_path, index_file)
+    print(len(keys), "keys from", len(file_names), "file(s) written to", index_file)
+
+    return ListingKeyIndex(index_file)
+
+
+def load_listing_key_index(
+    data_dir: str = DATA_DIRECTORY,
+    index_file: str = os.path.join(DATA_DIRECTORY, "idealista_data_keys.txt"),
+) -> ListingKeyIndex:
+    """
+    Function that loads the key index. If the index is empty but listings are already stored
+    (e.g. the first run after an upgrade from a version without index), the index is rebuilt
+    from the stored listings first, so that they are not written again.
+
+    Args:
+        data_dir (str, optional): Directory of the listing history. Defaults to DATA_DIRECTORY.
+        index_file (str, optional): Index file. Defaults to DATA_DIRECTORY/idealista_data_keys.txt.
+
+    Returns:
+        ListingKeyIndex: The index with the keys of all stored listings.
+    """
+    key_index = ListingKeyIndex(index_file)
+    if len(key_index) == 0 and (
+        glob.glob(os.path.join(data_dir, "idealista_data*.csv"))
+        or os.path.isdir(os.path.join(data_dir, PARQUET_DATASET_NAME))
+    ):
+        print("Key index", index_file, "is empty, it is rebuilt from the stored listings")
+        key_index = rebuild_listing_key_index(data_dir=data_dir, index_file=index_file)
+    return key_index
+
+
+def main() -> None:
+    """Function that rebuilds the key index or prints its size."""
+    # python -m functions.listing_key_index --rebuild
+    parser = argparse.ArgumentParser(description="Listing key index used for deduplication.")
+    parser.add_argument("--rebuild", action="store_true", help="regenerate the index from the data files")
+    parser.add_argument("--data-dir", default=DATA_DIRECTORY)
+    args = parser.parse_args()
+
+    if args.rebuild:
+        rebuild_listing_key_index(
+            data_dir=args.data_dir,
+            index_file=os.path.join(args.data_dir, "idealista_data_keys.txt"),
+        )
+    else:
+        key_index = ListingKeyIndex(os.path.join(args.data_dir, "idealista_data_keys.txt"))
+        print(len(key_index), "keys in", key_index.index_file)
+
+
+if __name__ == "__main__":
+    main()
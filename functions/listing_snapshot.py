@@ -0,0 +1,86 @@
+from global_variables import DATA_DIRECTORY
+
+import hashlib
+import json
+import os
+import threading
+
+# attributes that change with every run or query, not with the listing
+VOLATILE_ATTRIBUTES = ["index", "run", "insert_date", "query_id", "content_hash"]
+
+
+def item_content_hash(item: dict) -> str:
+    """
+    Function that builds the hash of the content of a DynamoDB item, i.e. of all attributes
+    except VOLATILE_ATTRIBUTES. Items are marshalled column by column, so the same listing
+    gets the same hash whatever dtypes its dataframe had.
+
+    Args:
+        item (dict): Item in DynamoDB JSON, e.g. {"price": {"N": "1500.0"}, ...}.
+
+    Returns:
+        str: First 16 characters of the SHA-256 hash.
+    """
+    content = {key: value for key, value in item.items() if key not in VOLATILE_ATTRIBUTES}
+    return hashlib.sha256(
+        json.dumps(content, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    ).hexdigest()[:16]
+
+
+class ListingSnapshot:
+    """
+    Content hash of the last version of every listing (by propertyCode) that was written to
+    the NoSQL table, stored as json file. Comparing a new batch with the snapshot tells which
+    listings are new or changed without reading the table.
+    """
+
+    def __init__(
+        self,
+        snapshot_file: str = os.path.join(DATA_DIRECTORY, "idealista_nosql_snapshot.json"),
+    ):
+        """
+        Args:
+            snapshot_file (str, optional): Json file of the snapshot. Defaults to DATA_DIRECTORY/idealista_nosql_snapshot.json.
+        """
+        self.snapshot_file = snapshot_file
+        self.hashes = {}
+        self._lock = threading.Lock()
+        try:
+            with open(snapshot_file, "r", encoding="utf-8") as file:
+                self.hashes = json.load(file)
+        except FileNotFoundError:
+            pass
+
+    def __len__(self) -> int:
+        return len(self.hashes)
+
+    def is_changed(self, property_code: str, content_hash: str) -> bool:
+        """
+        Function that checks if a listing is new or has changed since it was written.
+
+        Args:
+            property_code (str): Code of the listing.
+            content_hash (str): Hash of its item (see item_content_hash).
+
+        Returns:
+            bool: True if the snapshot has no or another hash for the listing.
+        """
+        return self.hashes.get(str(property_code)) != content_hash
+
+    def update(self, content_hashes: dict) -> None:
+        """
+        Function that sets the hashes of written listings and saves the snapshot.
+
+        Args:
+            content_hashes (dict): Content hash per propertyCode.
+        """
+        if not content_hashes:
+            return
+        with self._lock:
+            self.hashes.update(
+                {str(property_code): value for property_code, value in content_hashes.items()}
+            )
+            os.makedirs(os.path.dirname(os.path.abspath(self.snapshot_file)), exist_ok=True)
+            with open(self.snapshot_file + ".tmp", "w", encoding="utf-8") as file:
+                json.dump(self.hashes, file)
+            os.replace(self.snapshot_file + ".tmp", self.snapshot_file)
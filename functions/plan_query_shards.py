@@ -0,0 +1,334 @@
+import math
+import numpy as np
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from functions.idealista_client import IdealistaClient
+from functions.get_bearer_access_token import BearerTokenProvider
+from functions.response_cache import ResponseCache
+from functions.retrieve_data_from_idealista import (
+    RETRIEVAL_ERRORS,
+    retrieve_query_page,
+    retrieve_all_pages_from_idealista,
+    add_pages_to_batch,
+)
+from functions.build_listing_batch import ListingBatchBuilder
+from functions.flatten_listings import QueryMetadataTable
+from functions.listing_dtypes import apply_dtype_profile
+
+# number of pages we page through per query, queries with more pages are split into shards
+MAX_PAGES_PER_QUERY = 20
+DEFAULT_CENTER = "40.416944,-3.703333"
+DEFAULT_DISTANCE = "5000"
+DEFAULT_MIN_PRICE = "200"
+# open price bands above this minimum price are not split any further
+MAX_MIN_PRICE = 100000
+EARTH_RADIUS = 6371000
+METERS_PER_DEGREE_LATITUDE = EARTH_RADIUS * math.pi / 180
+
+
+def split_price_band(
+    parameters: dict,
+    min_price_band: int = 50,
+) -> list:
+    """
+    Function that splits a query into two price bands (minPrice/maxPrice).
+    A band without maxPrice is split at twice its minPrice, a closed band in the middle.
+
+    Args:
+        parameters (dict): Keyword arguments for url_encode_request_data.
+        min_price_band (int, optional): Bands narrower than this are not split. Defaults to 50.
+
+    Returns:
+        list: Two parameter dicts or an empty list if the band cannot be split.
+    """
+    min_price = int(float(parameters.get("minPrice", DEFAULT_MIN_PRICE)))
+    max_price = parameters.get("maxPrice")
+    if max_price is None:
+        if min_price >= MAX_MIN_PRICE:
+            return []
+        split_price = max(2 * min_price, min_price + min_price_band)
+    else:
+        max_price = int(float(max_price))
+        if max_price - min_price < 2 * min_price_band:
+            return []
+        split_price = (min_price + max_price) // 2
+
+    # both bands include the split price, the listings at this price are deduplicated later
+    lower_band = {**parameters, "minPrice": str(min_price), "maxPrice": str(split_price)}
+    upper_band = {**parameters, "minPrice": str(split_price)}
+    if max_price is not None:
+        upper_band["maxPrice"] = str(max_price)
+    return [lower_band, upper_band]
+
+
+def split_circle(
+    parameters: dict,
+    min_distance: int = 500,
+) -> list:
+    """
+    Function that splits the circle (center/distance) of a query into seven circles with half
+    the radius: one at the same center and six around it at a distance of radius * sqrt(3) / 2.
+    Together they cover the original circle, but also some area outside of it.
+
+    Args:
+        parameters (dict): Keyword arguments for url_encode_request_data.
+        min_distance (int, optional): Circles with a smaller radius (m) are not split. Defaults to 500.
+
+    Returns:
+        list: Seven parameter dicts or an empty list if the circle cannot be split.
+    """
+    # queries by locationId have no circle
+    if parameters.get("locationId") is not None:
+        return []
+    distance = float(parameters.get("distance", DEFAULT_DISTANCE))
+    if distance / 2 < min_distance:
+        return []
+    latitude, longitude = (
+        float(x) for x in parameters.get("center", DEFAULT_CENTER).split(",")
+    )
+
+    offset = distance * math.sqrt(3) / 2
+    centers = [(latitude, longitude)]
+    for angle in range(0, 360, 60):
+        centers.append(
+            (
+                latitude
+                + offset * math.cos(math.radians(angle)) / METERS_PER_DEGREE_LATITUDE,
+                longitude
+                + offset
+                * math.sin(math.radians(angle))
+                / (METERS_PER_DEGREE_LATITUDE * math.cos(math.radians(latitude))),
+            )
+        )
+
+    return [
+        {
+            **parameters,
+            "center": "{lat:.6f},{lon:.6f}".format(lat=lat, lon=lon),
+            "distance": str(int(distance / 2)),
+        }
+        for lat, lon in centers
+    ]
+
+
+def haversine_distance(
+    latitude: pd.Series,
+    longitude: pd.Series,
+    center: str,
+) -> pd.Series:
+    """
+    Function that computes the distance in meters between listings and a center.
+
+    Args:
+        latitude (pd.Series): Latitude of the listings.
+        longitude (pd.Series): Longitude of the listings.
+        center (str): Center as "latitude,longitude".
+
+    Returns:
+        pd.Series: Distance in meters.
+    """
+    center_latitude, center_longitude = (math.radians(float(x)) for x in center.split(","))
+    latitude = np.radians(latitude.astype(float))
+    longitude = np.radians(longitude.astype(float))
+    a = (
+        np.sin((latitude - center_latitude) / 2) ** 2
+        + math.cos(center_latitude)
+        * np.cos(latitude)
+        * np.sin((longitude - center_longitude) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(a))
+
+
+def plan_query_shards(
+    query_parameters: list,
+    access_token: str = None,
+    max_pages: int = MAX_PAGES_PER_QUERY,
+    min_price_band: int = 50,
+    min_distance: int = 500,
+    max_workers: int = 4,
+    client: IdealistaClient = None,
+    token_provider: BearerTokenProvider = None,
+    cache: ResponseCache = None,
+) -> list:
+    """
+    Function that splits queries into shards that each fit within max_pages pages.
+    Page 1 of every candidate shard is requested (in parallel) to read its totalPages.
+    Shards with too many pages are split by price band first and by area once the
+    price band is too narrow. Page 1 of the final shards is kept, so it is not requested twice.
+
+    Args:
+        query_parameters (list): Dicts with keyword arguments for url_encode_request_data.
+        access_token (str, optional): Bearer access token for idealista API.
+        max_pages (int, optional): Page limit per shard. Defaults to MAX_PAGES_PER_QUERY.
+        min_price_band (int, optional): Price bands narrower than this are not split. Defaults to 50.
+        min_distance (int, optional): Circles with a smaller radius (m) are not split. Defaults to 500.
+        max_workers (int, optional): Maximum number of requests sent at the same time. Defaults to 4.
+        client (IdealistaClient, optional): Shared client with pooled connections.
+        token_provider (BearerTokenProvider, optional): Used instead of access_token.
+        cache (ResponseCache, optional): Pages that are cached are not requested again.
+
+    Returns:
+        list: One dict per shard with the keys query_index, parameters and first_page (parsed page 1).
+    """
+
+    def retrieve_first_page(parameters: dict):
+        return retrieve_query_page(
+            parameters,
+            1,
+            access_token=access_token,
+            client=client,
+            token_provider=token_provider,
+            cache=cache,
+        )
+
+    shards = []
+    candidates = [(query_index, dict(p)) for query_index, p in enumerate(query_parameters)]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while candidates:
+            futures = {
+                executor.submit(retrieve_first_page, parameters): (query_index, parameters)
+                for query_index, parameters in candidates
+            }
+            candidates = []
+            for future in as_completed(futures):
+                query_index, parameters = futures[future]
+                try:
+                    first_page = future.result()
+                except RETRIEVAL_ERRORS as e:
+                    print("Shard", parameters, "could not be retrieved:", e)
+                    continue
+
+                totalPages = first_page["totalPages"]
+                if totalPages > max_pages:
+                    sub_shards = split_price_band(parameters, min_price_band)
+                    if not sub_shards:
+                        sub_shards = split_circle(parameters, min_distance)
+                    if sub_shards:
+                        candidates.extend((query_index, p) for p in sub_shards)
+                        continue
+                    print(
+                        "Shard",
+                        parameters,
+                        "cannot be split further, only",
+                        max_pages,
+                        "out of",
+                        totalPages,
+                        "pages are retrieved.",
+                    )
+
+                shards.append(
+                    {
+                        "query_index": query_index,
+                        "parameters": parameters,
+                        "first_page": first_page,
+                    }
+                )
+
+    return shards
+
+
+def retrieve_sharded_data_from_idealista(
+    query_parameters: list,
+    access_token: str = None,
+    query_columns: list = None,
+    max_pages: int = MAX_PAGES_PER_QUERY,
+    max_workers: int = 4,
+    client: IdealistaClient = None,
+    token_provider: BearerTokenProvider = None,
+    cache: ResponseCache = None,
+    query_metadata: QueryMetadataTable = None,
+) -> pd.DataFrame:
+    """
+    Function that retrieves all listings of one or more queries, also if a query matches
+    more listings than fit within max_pages pages. The queries are split into shards with
+    plan_query_shards, all pages of all shards are retrieved in parallel, collected in one
+    ListingBatchBuilder (with flattened nested fields and the query_id of the shard)
+    and deduplicated on propertyCode within each query.
+
+    Args:
+        query_parameters (list): Dicts with keyword arguments for url_encode_request_data.
+        access_token (str, optional): Bearer access token for idealista API.
+        query_columns (list, optional): One dict per query with columns that are added to all
+            of its listings, e.g. {"furnished": "furnished"}. Defaults to None.
+        max_pages (int, optional): Page limit per shard. Defaults to MAX_PAGES_PER_QUERY.
+        max_workers (int, optional): Maximum number of requests sent at the same time. Defaults to 4.
+        client (IdealistaClient, optional): Shared client with pooled connections.
+        token_provider (BearerTokenProvider, optional): Used instead of access_token.
+        cache (ResponseCache, optional): Pages that are cached are not requested again.
+        query_metadata (QueryMetadataTable, optional): Collects the summary, total and totalPages
+            of every shard. Defaults to None.
+
+    Returns:
+        pd.DataFrame: Deduplicated listings of all queries with the compact dtypes of
+            LISTING_DTYPE_PROFILE (without float32).
+    """
+    if query_columns is None:
+        query_columns = [{} for _ in query_parameters]
+
+    shards = plan_query_shards(
+        query_parameters=query_parameters,
+        access_token=access_token,
+        max_pages=max_pages,
+        max_workers=max_workers,
+        client=client,
+        token_provider=token_provider,
+        cache=cache,
+    )
+    print(len(shards), "shard(s) for", len(query_parameters), "query/queries")
+
+    pages = retrieve_all_pages_from_idealista(
+        access_token=access_token,
+        query_parameters=[shard["parameters"] for shard in shards],
+        max_workers=max_workers,
+        client=client,
+        token_provider=token_provider,
+        cache=cache,
+        first_pages={
+            shard_index: shard["first_page"] for shard_index, shard in enumerate(shards)
+        },
+        max_pages=max_pages,
+    )
+
+    # collect all pages column by column and build one dataframe at the end
+    builder = ListingBatchBuilder()
+    for shard, shard_pages in zip(shards, pages):
+        add_pages_to_batch(
+            builder,
+            shard["parameters"],
+            shard_pages,
+            query_metadata=query_metadata,
+            **query_columns[shard["query_index"]],
+            query_index=shard["query_index"],
+        )
+    df = builder.to_dataframe()
+    if len(df) == 0:
+        return df
+
+    # smaller circles also cover some area outside of the original circle
+    keep = pd.Series(True, index=df.index)
+    for query_index, parameters in enumerate(query_parameters):
+        center = parameters.get("center", DEFAULT_CENTER)
+        if any(
+            shard["parameters"].get("center", DEFAULT_CENTER) != center
+            for shard in shards
+            if shard["query_index"] == query_index
+        ):
+            rows = df["query_index"] == query_index
+            distance = haversine_distance(
+                df.loc[rows, "latitude"], df.loc[rows, "longitude"], center
+            )
+            df.loc[rows, "distance"] = distance.round().astype(int).astype(str)
+            keep[rows] = distance <= float(parameters.get("distance", DEFAULT_DISTANCE))
+    df = df[keep]
+
+    len_original = len(df)
+    df = (
+        df.drop_duplicates(subset=["query_index", "propertyCode"])
+        .drop(columns="query_index")
+        .reset_index(drop=True)
+    )
+    print(len_original - len(df), "duplicate(s) from overlapping shards were removed")
+
+    # compact dtypes (categories, nullable booleans, Int16), coordinates stay float64
+    return apply_dtype_profile(df, downcast_floats=False)
@@ -0,0 +1,243 @@
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+
+import requests
+
+
+class IdealistaAPIError(Exception):
+    """Raised when a request to the idealista API did not succeed."""
+
+    def __init__(self, message: str, status_code: int = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class CircuitOpenError(IdealistaAPIError):
+    """Raised when requests are not sent because the API failed repeatedly."""
+
+
+class TokenBucketRateLimiter:  # pylint: disable=too-few-public-methods
+    """Thread-safe token bucket that limits how many requests are sent per second."""
+
+    def __init__(self, rate: float = 1.0, capacity: int = 1):
+        """
+        Args:
+            rate (float, optional): Tokens added per second, i.e. the sustained request rate. Defaults to 1.0.
+            capacity (int, optional): Maximum number of tokens, i.e. the allowed burst. Defaults to 1.
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.last_refill = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """Function that blocks until a token is available and takes it."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.last_refill) * self.rate
+                )
+                self.last_refill = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class CircuitBreaker:
+    """Stops sending requests after repeated failures and tries again after a cool-down."""
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 60):
+        """
+        Args:
+            failure_threshold (int, optional): Consecutive failures after which the circuit opens. Defaults to 5.
+            reset_timeout (float, optional): Seconds after which one trial request is let through. Defaults to 60.
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failure_count = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def seconds_until_closed(self) -> float:
+        """
+        Function that returns how long requests have to wait until the circuit lets them through
+        again: 0 while it is closed, otherwise the rest of reset_timeout. Once reset_timeout has
+        passed, the circuit is half open: requests are sent and the next failure opens it again.
+
+        Returns:
+            float: Seconds to wait.
+        """
+        with self._lock:
+            if self.opened_at is None:
+                return 0.0
+            remaining = self.reset_timeout - (time.monotonic() - self.opened_at)
+            if remaining > 0:
+                return remaining
+            self.opened_at = None
+            self.failure_count = self.failure_threshold - 1
+            return 0.0
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failure_count = 0
+            self.opened_at = None
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failure_count += 1
+            if self.failure_count >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+def parse_retry_after(retry_after: str) -> float:
+    """
+    Function that converts a Retry-After header to seconds.
+
+    Args:
+        retry_after (str): Header value, either seconds or an HTTP date.
+
+    Returns:
+        float: Seconds to wait or None if the header cannot be parsed.
+    """
+    if retry_after is None:
+        return None
+    try:
+        return max(0.0, float(retry_after))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(retry_after)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+class RequestScheduler:
+    """
+    Sends requests within the API quota and retries throttled or failed requests
+    with jittered exponential backoff, so that a single 429 or 5xx does not end the run.
+    After repeated server or connection errors, requests wait until the circuit breaker
+    lets them through again, and fail with CircuitOpenError once they waited max_circuit_wait seconds.
+    One scheduler can be shared by all threads and queries to share one rate budget.
+    """
+
+    def __init__(
+        self,
+        rate_limiter: TokenBucketRateLimiter = None,
+        circuit_breaker: CircuitBreaker = None,
+        max_retries: int = 5,
+        backoff_base: float = 1,
+        backoff_max: float = 60,
+        retry_status_codes: tuple = (429, 500, 502, 503, 504),
+        max_circuit_wait: float = 600,
+    ):
+        """
+        Args:
+            rate_limiter (TokenBucketRateLimiter, optional): Defaults to one request per second.
+            circuit_breaker (CircuitBreaker, optional): Defaults to CircuitBreaker().
+            max_retries (int, optional): Retries per request. Defaults to 5.
+            backoff_base (float, optional): Seconds of the first backoff. Defaults to 1.
+            backoff_max (float, optional): Maximum seconds between two attempts. Defaults to 60.
+            retry_status_codes (tuple, optional): Status codes that are retried. Defaults to 429 and 5xx.
+            max_circuit_wait (float, optional): Maximum seconds a request waits for the open circuit
+                in total. Defaults to 600.
+        """
+        self.rate_limiter = (
+            rate_limiter if rate_limiter is not None else TokenBucketRateLimiter()
+        )
+        self.circuit_breaker = (
+            circuit_breaker if circuit_breaker is not None else CircuitBreaker()
+        )
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.retry_status_codes = retry_status_codes
+        self.max_circuit_wait = max_circuit_wait
+
+    def backoff(self, attempt: int, retry_after: str = None) -> float:
+        """
+        Function that returns the seconds to wait before the next attempt.
+        Retry-After is honored, otherwise "full jitter" exponential backoff is used.
+
+        Args:
+            attempt (int): Number of the failed attempt, starting at 0.
+            retry_after (str, optional): Retry-After header of the response.
+
+        Returns:
+            float: Seconds to wait.
+        """
+        delay = parse_retry_after(retry_after)
+        if delay is not None:
+            return min(delay, self.backoff_max)
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2**attempt))
+
+    def send(self, request_function) -> requests.Response:
+        """
+        Function that sends a request and retries it if it was throttled or failed.
+
+        Args:
+            request_function (callable): Function without arguments that sends the request.
+
+        Returns:
+            requests.Response: First successful response, or the last response once all retries
+                are used up.
+
+        Raises:
+            CircuitOpenError: If the circuit stays open longer than max_circuit_wait seconds.
+        """
+        attempt = 0
+        circuit_wait = 0.0
+        while True:
+            # while the API is failing, requests wait for the circuit instead of being lost,
+            # but not for longer than max_circuit_wait
+            delay = self.circuit_breaker.seconds_until_closed()
+            if delay > 0:
+                if circuit_wait + delay > self.max_circuit_wait:
+                    raise CircuitOpenError(
+                        "Circuit is still open after {count} consecutive failures and "
+                        "{seconds} seconds of waiting.".format(
+                            count=self.circuit_breaker.failure_count, seconds=round(circuit_wait)
+                        )
+                    )
+                time.sleep(delay)
+                circuit_wait += delay
+                continue
+            self.rate_limiter.acquire()
+            try:
+                response = request_function()
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self.circuit_breaker.record_failure()
+                if attempt >= self.max_retries:
+                    raise
+                print("Request failed (", e, "), retrying.")
+                time.sleep(self.backoff(attempt))
+                attempt += 1
+                continue
+
+            if response.status_code not in self.retry_status_codes:
+                self.circuit_breaker.record_success()
+                return response
+
+            # throttling (429) means the API is up and is handled by the backoff,
+            # only server errors count as failures of the API
+            if response.status_code >= 500:
+                self.circuit_breaker.record_failure()
+            if attempt >= self.max_retries:
+                return response
+            delay = self.backoff(attempt, response.headers.get("Retry-After"))
+            print(
+                "Request failed with status code",
+                response.status_code,
+                ", retrying in",
+                round(delay, 1),
+                "seconds.",
+            )
+            time.sleep(delay)
+            attempt += 1
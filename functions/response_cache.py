@@ -0,0 +1,153 @@
+from global_variables import DATA_DIRECTORY
+from functions.idealista_client import IDEALISTA_API_URL
+
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+
+class ResponseCacheMissError(LookupError):
+    """Raised in replay-only mode if a response is not in the cache."""
+
+
+class ResponseCache:
+    """
+    On-disk cache for responses of the idealista search endpoint.
+    Each response body is stored gzip-compressed in a file named after the SHA-256 hash of
+    the API base url and the url encoded request data, so re-running the pipeline does not
+    request pages again and responses of a local stand-in never replace those of the real API.
+    Entries expire after ttl seconds; if the cache grows above max_bytes, the least recently
+    used entries are removed. The size of the cache is tracked in memory, the cache directory
+    is only scanned at startup and when the cache is full.
+    """
+
+    def __init__(
+        self,
+        cache_dir: str = os.path.join(DATA_DIRECTORY, "idealista_response_cache/"),
+        ttl: float = 6 * 60 * 60,
+        max_bytes: int = 500 * 1024 * 1024,
+        replay_only: bool = False,
+        base_url: str = IDEALISTA_API_URL,
+    ):
+        """
+        Args:
+            cache_dir (str, optional): Directory of the cache files.
+                Defaults to DATA_DIRECTORY/idealista_response_cache/.
+            ttl (float, optional): Seconds after which an entry expires. Defaults to 6 hours.
+            max_bytes (int, optional): Maximum size of all cache files. Defaults to 500 MB.
+            replay_only (bool, optional): Never request the API, raise ResponseCacheMissError on a miss
+                (expired entries are still used). Defaults to False.
+            base_url (str, optional): Scheme and host of the API the responses come from.
+                Defaults to IDEALISTA_API_URL.
+        """
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.replay_only = replay_only
+        self.base_url = base_url.rstrip("/")
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self._total_bytes = sum(size for _, size, _ in self._scan())
+        if self._total_bytes > self.max_bytes:
+            self.evict()
+
+    def key(self, request_data: str) -> str:
+        return hashlib.sha256(
+            (self.base_url + "\n" + request_data).encode("utf-8")
+        ).hexdigest()
+
+    def _path(self, request_data: str) -> str:
+        return os.path.join(self.cache_dir, self.key(request_data) + ".json.gz")
+
+    def get(self, request_data: str) -> str:
+        """
+        Function that returns the cached response body for a request.
+
+        Args:
+            request_data (str): Url encoded request data.
+
+        Returns:
+            str: Response body or None if there is no valid entry.
+        """
+        path = self._path(request_data)
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as file:
+                entry = json.load(file)
+        except (FileNotFoundError, OSError, ValueError):
+            entry = None
+
+        if entry is None or (
+            not self.replay_only and time.time() - entry["created_at"] > self.ttl
+        ):
+            if self.replay_only:
+                raise ResponseCacheMissError(
+                    "No cached response for request " + request_data
+                )
+            return None
+
+        # the modification time marks the last use for the LRU eviction
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return entry["body"]
+
+    def put(self, request_data: str, body: str) -> None:
+        """
+        Function that stores a response body and evicts old entries if the cache is full.
+
+        Args:
+            request_data (str): Url encoded request data.
+            body (str): Response body.
+        """
+        entry = {"created_at": time.time(), "request_data": request_data, "body": body}
+        # write to a temporary file first so that no thread reads a half written entry
+        file_descriptor, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        with os.fdopen(file_descriptor, "wb") as raw_file:
+            with gzip.GzipFile(fileobj=raw_file, mode="wb") as file:
+                file.write(json.dumps(entry).encode("utf-8"))
+        path = self._path(request_data)
+        with self._lock:
+            try:
+                replaced_bytes = os.path.getsize(path)
+            except FileNotFoundError:
+                replaced_bytes = 0
+            os.replace(tmp_path, path)
+            self._total_bytes += os.path.getsize(path) - replaced_bytes
+            is_full = self._total_bytes > self.max_bytes
+        if is_full:
+            self.evict()
+
+    def _scan(self) -> list:
+        """Function that returns (last use, size, path) of all cache files."""
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(".json.gz"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def evict(self) -> None:
+        """
+        Function that scans the cache directory and removes expired entries and the least
+        recently used entries above max_bytes.
+        """
+        with self._lock:
+            entries = self._scan()
+            total_bytes = sum(size for _, size, _ in entries)
+            now = time.time()
+            for last_used, size, path in sorted(entries):
+                if total_bytes <= self.max_bytes and now - last_used <= self.ttl:
+                    break
+                if self.replay_only and total_bytes <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total_bytes -= size
+            self._total_bytes = total_bytes
@@ -1,68 +1,251 @@
 import pandas as pd
 import requests
-from requests.structures import CaseInsensitiveDict
 import urllib
 import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
+from functions.idealista_client import (
+    IdealistaClient,
+    IDEALISTA_API_URL,
+    SEARCH_PATH,
+    build_search_headers,
+)
+from functions.get_bearer_access_token import BearerTokenProvider
+from functions.request_scheduler import IdealistaAPIError
+from functions.response_cache import ResponseCache, ResponseCacheMissError
+from functions.flatten_listings import QueryMetadataTable, flatten_listing, make_query_id
+from functions.build_listing_batch import ListingBatchBuilder
 
-def retrieve_data_from_idealista(
+# errors after which a page is left out, so that the pages that were retrieved are not lost
+RETRIEVAL_ERRORS = (IdealistaAPIError, ResponseCacheMissError, requests.RequestException)
+
+
+def post_search_request(
     request_data: str,
     access_token: str,
-) -> pd.DataFrame:
+    client: IdealistaClient = None,
+) -> requests.Response:
     """
-    Function that retrieves data from idealista API.
-    Each call returns one page with a maximum of 50 listings per page.
-    For example, if there were 150 listings that match our filters, we would have to
-    make three requests for pages 1, 2, 3 with listings 1-50, 51-100 and 101-150, respectively.
+    Function that sends one request to the search endpoint of the idealista API.
 
     :param request_data: data that is passed to the POST request.
-    :para access_token: bearer access token for idealista API.
+    :param access_token: bearer access token for idealista API.
+    :param client: shared IdealistaClient with pooled connections (optional).
 
-    :return df: dataframe with the requested data from idealista.
-    :return totalPages: total number of pages for the specified query parameters.
-    :return actualPage: page number from which we requested the listings.
+    :return: response of the API.
+    """
+    headers = build_search_headers(access_token)
+
+    if client is None:
+        return requests.post(
+            IDEALISTA_API_URL + SEARCH_PATH + request_data, headers=headers, timeout=5
+        )
+    return client.post(SEARCH_PATH + request_data, headers=headers)
+
+
+def request_search_page(
+    request_data: str,
+    access_token: str = None,
+    client: IdealistaClient = None,
+    token_provider: BearerTokenProvider = None,
+    cache: ResponseCache = None,
+) -> str:
+    """
+    Function that returns the response body for one page of the search endpoint,
+    from the response cache if possible.
+
+    :param request_data: data that is passed to the POST request.
+    :param access_token: bearer access token for idealista API.
+    :param client: shared IdealistaClient with pooled connections (optional).
+    :param token_provider: BearerTokenProvider that is used instead of access_token (optional).
+                           If the API rejects the token with status code 401, a new token is
+                           requested once and the request is repeated.
+    :param cache: ResponseCache for the response bodies (optional).
+
+    :return: response body (json).
     """
-    # build the complete request
-    headers = CaseInsensitiveDict()
-    headers["Authorization"] = "Bearer " + access_token
-    url_properties = "https://api.idealista.com/3.5/es/search?"
+    if cache is not None:
+        body = cache.get(request_data)
+        if body is not None:
+            return body
 
-    response = requests.post(url_properties + request_data, headers=headers, timeout=5)
+    if token_provider is not None:
+        access_token = token_provider.get_token()
 
-    assert (
-        response.status_code == 200
-    ), """retrieve_data_from_idealista: API Call failed with status code {status_code}
+    response = post_search_request(
+        request_data=request_data, access_token=access_token, client=client
+    )
+
+    if response.status_code == 401 and token_provider is not None:
+        # token expired during the run: re-authenticate once and repeat the request
+        token_provider.invalidate(access_token)
+        response = post_search_request(
+            request_data=request_data,
+            access_token=token_provider.get_token(),
+            client=client,
+        )
+
+    if response.status_code != 200:
+        raise IdealistaAPIError(
+            """retrieve_data_from_idealista: API Call failed with status code {status_code}
             and message {text}
             No data was retrieved.
         """.format(
-        status_code=response.status_code, text=response.text
-    )
-    # print(response.text)
-    data = json.loads(response.text)
-    df = pd.DataFrame.from_dict(data["elementList"])
-    df["filters"] = str(data["summary"])
+                status_code=response.status_code, text=response.text
+            ),
+            status_code=response.status_code,
+        )
+
+    if cache is not None:
+        cache.put(request_data, response.text)
+
+    return response.text
+
+
+def retrieve_page_from_idealista(
+    request_data: str,
+    access_token: str = None,
+    client: IdealistaClient = None,
+    token_provider: BearerTokenProvider = None,
+    cache: ResponseCache = None,
+) -> dict:
+    """
+    Function that retrieves one page from idealista API without building a dataframe,
+    so that the listings of many pages can be collected with a ListingBatchBuilder.
 
-    total = data["total"]
-    totalPages = data["totalPages"]
-    actualPage = data["actualPage"]
+    :param request_data: data that is passed to the POST request.
+    :param access_token: bearer access token for idealista API.
+    :param client: shared IdealistaClient with pooled connections (optional).
+    :param token_provider: BearerTokenProvider that is used instead of access_token (optional).
+    :param cache: ResponseCache, pages that are cached are not requested again (optional).
+
+    :return: parsed response with the keys elementList, summary, total, totalPages and actualPage.
+    """
+    body = request_search_page(
+        request_data=request_data,
+        access_token=access_token,
+        client=client,
+        token_provider=token_provider,
+        cache=cache,
+    )
+    data = json.loads(body)
 
     print(
-        total,
+        data["total"],
         "listings on idealista match the query parameters (page",
-        actualPage,
+        data["actualPage"],
         "out of",
-        totalPages,
+        data["totalPages"],
         ")",
     )
 
-    return df, totalPages, actualPage
+    return data
+
+
+def retrieve_query_page(
+    parameters: dict,
+    numPage: int,
+    access_token: str = None,
+    client: IdealistaClient = None,
+    token_provider: BearerTokenProvider = None,
+    cache: ResponseCache = None,
+) -> dict:
+    """
+    Function that retrieves one page of a query (see retrieve_page_from_idealista).
+
+    :param parameters: keyword arguments for url_encode_request_data (without numPage).
+    :param numPage: number of the page.
+    :param access_token: bearer access token for idealista API.
+    :param client: shared IdealistaClient with pooled connections (optional).
+    :param token_provider: BearerTokenProvider that is used instead of access_token (optional).
+    :param cache: ResponseCache, pages that are cached are not requested again (optional).
+
+    :return: parsed response with the keys elementList, summary, total, totalPages and actualPage.
+    """
+    return retrieve_page_from_idealista(
+        request_data=url_encode_request_data(**parameters, numPage=numPage),
+        access_token=access_token,
+        client=client,
+        token_provider=token_provider,
+        cache=cache,
+    )
+
+
+def add_pages_to_batch(
+    builder: ListingBatchBuilder,
+    parameters: dict,
+    pages: list,
+    query_metadata: QueryMetadataTable = None,
+    **constant_columns,
+) -> None:
+    """
+    Function that adds the flattened listings of the pages of one query to a batch.
+
+    :param builder: ListingBatchBuilder that collects the listings.
+    :param parameters: keyword arguments for url_encode_request_data of the query (without numPage).
+    :param pages: parsed pages of the query (see retrieve_page_from_idealista).
+    :param query_metadata: QueryMetadataTable that collects the summary of the query (optional).
+    :param constant_columns: columns with the same value for all listings of the query.
+    """
+    request_data = url_encode_request_data(**parameters)
+    query_id = make_query_id(request_data)
+    for data in pages:
+        if query_metadata is not None:
+            query_metadata.add(request_data, data)
+        builder.add_records(
+            [flatten_listing(record) for record in data["elementList"]],
+            query_id=query_id,
+            **constant_columns,
+        )
+
+
+def retrieve_data_from_idealista(
+    request_data: str,
+    access_token: str = None,
+    client: IdealistaClient = None,
+    token_provider: BearerTokenProvider = None,
+    cache: ResponseCache = None,
+    query_metadata: QueryMetadataTable = None,
+) -> pd.DataFrame:
+    """
+    Function that retrieves data from idealista API.
+    Each call returns one page with a maximum of 50 listings per page.
+    For example, if there were 150 listings that match our filters, we would have to
+    make three requests for pages 1, 2, 3 with listings 1-50, 51-100 and 101-150, respectively.
+
+    :param request_data: data that is passed to the POST request.
+    :para access_token: bearer access token for idealista API.
+    :param client: shared IdealistaClient with pooled connections (optional).
+    :param token_provider: BearerTokenProvider that is used instead of access_token (optional).
+                           If the API rejects the token with status code 401, a new token is
+                           requested once and the request is repeated.
+    :param cache: ResponseCache, pages that are cached are not requested again (optional).
+    :param query_metadata: QueryMetadataTable that collects the summary of the query (optional).
+
+    :return df: dataframe with the requested data from idealista, nested fields are flattened
+                and the query_id column references the query metadata.
+    :return totalPages: total number of pages for the specified query parameters.
+    :return actualPage: page number from which we requested the listings.
+    """
+    data = retrieve_page_from_idealista(
+        request_data=request_data,
+        access_token=access_token,
+        client=client,
+        token_provider=token_provider,
+        cache=cache,
+    )
+    df = pd.DataFrame([flatten_listing(record) for record in data["elementList"]])
+    df["query_id"] = make_query_id(request_data)
+    if query_metadata is not None:
+        query_metadata.add(request_data, data)
+
+    return df, data["totalPages"], data["actualPage"]
 
 
 def url_encode_request_data(
     locale: str = "es",
     operation: str = "rent",
     propertyType: str = "homes",
-    # locationId: str = "0-EU-ES-28",
     center: str = "40.416944,-3.703333",
     distance: str = "5000",
     hasMultimedia: str = "True",
@@ -77,6 +260,8 @@ def url_encode_request_data(
     furnished: str = None,
     airConditioning: str = None,
     numPage: str = None,
+    maxPrice: str = None,
+    locationId: str = None,
 ) -> str:
     """
     Function which takes the query parameters for our API request and formats them as url string
@@ -85,7 +270,6 @@ def url_encode_request_data(
     :param country: "es" for Spain.
     :param operation: "rent" meaning we look for rental.
     :param propertyType: "homes" meaning flats or houses.
-    :param locationId: "0-EU-ES-28" for Madrid, Spain (can be used instead of center and distance).
     :param center: "40.416944,-3.703333" for Madrid city center.
     :param distance: "5000" for 5 km radius around the center.
     :param hasMultimedia: "True" (meaning property has pictures, a video or a virtual tour).
@@ -102,6 +286,8 @@ def url_encode_request_data(
     :param furnished: "furnished" or "furnishedKitchen" if unfurnished except for the kitchen.
     :param airConditioning: "True" means that the flat has air conditioning.
     :param numPage: page number, we iterate through the pages.
+    :param maxPrice: maximum rent.
+    :param locationId: e.g. "0-EU-ES-28" for Madrid, Spain (used instead of center and distance if set).
 
     :return: url encoded string with query parameters.
     """
@@ -110,13 +296,14 @@ def url_encode_request_data(
         "locale": locale,
         "operation": operation,
         "propertyType": propertyType,
-        # "locationId": locationId,
+        "locationId": locationId,
         "center": center,
         "distance": distance,
         "hasMultimedia": hasMultimedia,
         "preservation": preservation,
         "maxItems": maxItems,
         "minPrice": minPrice,
+        "maxPrice": maxPrice,
         "minSize": minSize,
         "sinceDate": sinceDate,
         "order": order,
@@ -128,11 +315,117 @@ def url_encode_request_data(
     }
 
     # remove parameters without value
-    for parameter in ["bedrooms", "furnished", "airConditioning", "numPage"]:
+    for parameter in [
+        "locationId",
+        "maxPrice",
+        "bedrooms",
+        "furnished",
+        "airConditioning",
+        "numPage",
+    ]:
         if data_dict[parameter] is None:
             data_dict.pop(parameter)
 
+    # a location is searched by its id or by a circle, not both
+    if locationId is not None:
+        data_dict.pop("center")
+        data_dict.pop("distance")
+
     # url encode parameters
     data = urllib.parse.urlencode(data_dict)
 
     return data
+
+
+def retrieve_all_pages_from_idealista(
+    access_token: str = None,
+    query_parameters: list = None,
+    max_workers: int = 4,
+    client: IdealistaClient = None,
+    token_provider: BearerTokenProvider = None,
+    cache: ResponseCache = None,
+    first_pages: dict = None,
+    max_pages: int = None,
+) -> list:
+    """
+    Function that retrieves all pages for one or more queries concurrently.
+    For each query, page 1 is requested first to learn totalPages; the remaining pages
+    are then requested in parallel. All queries share one bounded thread pool, so
+    e.g. the "furnished" and "furnishedKitchen" queries run at the same time.
+
+    :param access_token: bearer access token for idealista API.
+    :param query_parameters: list of dicts with keyword arguments for url_encode_request_data
+                             (one dict per query, without numPage). Defaults to one query
+                             with the default parameters.
+    :param max_workers: maximum number of requests that are sent at the same time.
+    :param client: shared IdealistaClient, its pool_size should be at least max_workers (optional).
+    :param token_provider: BearerTokenProvider that is used instead of access_token (optional).
+    :param cache: ResponseCache, pages that are cached are not requested again (optional).
+    :param first_pages: page 1 of queries that were already retrieved, as dict
+                        {query index: parsed page}, so that it is not requested again (optional).
+    :param max_pages: maximum number of pages that are retrieved per query (optional).
+
+    :return: list with one entry per query, each a list of parsed pages (see
+             retrieve_page_from_idealista) in page order.
+             Pages that still fail after all retries are left out, so that the pages that
+             were retrieved are not lost.
+    """
+
+    def retrieve_page(parameters: dict, numPage: int):
+        return retrieve_query_page(
+            parameters,
+            numPage,
+            access_token=access_token,
+            client=client,
+            token_provider=token_provider,
+            cache=cache,
+        )
+
+    if query_parameters is None:
+        query_parameters = [{}]
+    if first_pages is None:
+        first_pages = {}
+
+    def submit_remaining_pages(query_index: int, totalPages: int):
+        if max_pages is not None:
+            totalPages = min(totalPages, max_pages)
+        for next_page in range(2, totalPages + 1):
+            next_future = executor.submit(
+                retrieve_page, query_parameters[query_index], next_page
+            )
+            remaining_futures[next_future] = (query_index, next_page)
+
+    pages = [{} for _ in query_parameters]
+    remaining_futures = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for query_index, data in first_pages.items():
+            pages[query_index][1] = data
+            submit_remaining_pages(query_index, data["totalPages"])
+
+        # request the first page of every other query to find out how many pages there are
+        futures = {
+            executor.submit(retrieve_page, parameters, 1): (query_index, 1)
+            for query_index, parameters in enumerate(query_parameters)
+            if query_index not in first_pages
+        }
+        for future in as_completed(futures):
+            query_index, numPage = futures[future]
+            try:
+                data = future.result()
+            except RETRIEVAL_ERRORS as e:
+                print("Query", query_index, "could not be retrieved:", e)
+                continue
+            pages[query_index][numPage] = data
+            submit_remaining_pages(query_index, data["totalPages"])
+
+        for future in as_completed(list(remaining_futures)):
+            query_index, numPage = remaining_futures[future]
+            try:
+                data = future.result()
+            except RETRIEVAL_ERRORS as e:
+                print("Page", numPage, "of query", query_index, "could not be retrieved:", e)
+                continue
+            pages[query_index][numPage] = data
+
+    # keep the results in page order
+    return [[query_pages[page] for page in sorted(query_pages)] for query_pages in pages]
@@ -0,0 +1,142 @@
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+
+from functions.idealista_client import IdealistaClient
+from functions.get_bearer_access_token import BearerTokenProvider
+from functions.response_cache import ResponseCache
+from functions.retrieve_data_from_idealista import (
+    RETRIEVAL_ERRORS,
+    retrieve_query_page,
+    add_pages_to_batch,
+)
+from functions.listing_key_index import ListingKeyIndex
+from functions.build_listing_batch import ListingBatchBuilder
+from functions.flatten_listings import QueryMetadataTable
+from functions.listing_dtypes import apply_dtype_profile
+
+
+def retrieve_new_pages_from_idealista(
+    parameters: dict,
+    key_index: ListingKeyIndex,
+    access_token: str = None,
+    order: str = "modificationDate",
+    client: IdealistaClient = None,
+    token_provider: BearerTokenProvider = None,
+    cache: ResponseCache = None,
+) -> list:
+    """
+    Function that retrieves the pages of a query, newest listings first, until it reaches a page
+    on which every listing (propertyCode, price, size) is already in the key index.
+    Listings on later pages are older, so they are already stored as well.
+
+    Args:
+        parameters (dict): Keyword arguments for url_encode_request_data (without order, sort and numPage).
+        key_index (ListingKeyIndex): Keys of the listings that are already stored.
+        access_token (str, optional): Bearer access token for idealista API.
+        order (str, optional): "modificationDate" or "publicationDate". Defaults to "modificationDate".
+        client (IdealistaClient, optional): Shared client with pooled connections.
+        token_provider (BearerTokenProvider, optional): Used instead of access_token.
+        cache (ResponseCache, optional): Pages that are cached are not requested again.
+
+    Returns:
+        list: Parsed pages (see retrieve_page_from_idealista) that contain at least one new listing.
+    """
+    pages = []
+    numPage, totalPages = 1, 1
+    while numPage <= totalPages:
+        try:
+            data = retrieve_query_page(
+                {**parameters, "order": order, "sort": "desc"},
+                numPage,
+                access_token=access_token,
+                client=client,
+                token_provider=token_provider,
+                cache=cache,
+            )
+        except RETRIEVAL_ERRORS as e:
+            print("Page", numPage, "of query", parameters, "could not be retrieved:", e)
+            break
+
+        if key_index.contains_all(data["elementList"]):
+            print(
+                "Page",
+                numPage,
+                "only contains known listings,",
+                data["totalPages"] - numPage,
+                "page(s) were skipped.",
+            )
+            break
+
+        pages.append(data)
+        totalPages = data["totalPages"]
+        numPage += 1
+
+    return pages
+
+
+def retrieve_new_data_from_idealista(
+    query_parameters: list,
+    key_index: ListingKeyIndex,
+    access_token: str = None,
+    query_columns: list = None,
+    order: str = "modificationDate",
+    max_workers: int = 4,
+    client: IdealistaClient = None,
+    token_provider: BearerTokenProvider = None,
+    cache: ResponseCache = None,
+    query_metadata: QueryMetadataTable = None,
+) -> pd.DataFrame:
+    """
+    Function that retrieves the new or changed listings of one or more queries. The pages of
+    each query are retrieved one after another until a page only contains known listings;
+    the queries run in parallel.
+
+    Args:
+        query_parameters (list): Dicts with keyword arguments for url_encode_request_data.
+        key_index (ListingKeyIndex): Keys of the listings that are already stored.
+        access_token (str, optional): Bearer access token for idealista API.
+        query_columns (list, optional): One dict per query with columns that are added to all
+            of its listings, e.g. {"furnished": "furnished"}. Defaults to None.
+        order (str, optional): "modificationDate" or "publicationDate". Defaults to "modificationDate".
+        max_workers (int, optional): Maximum number of queries that run at the same time. Defaults to 4.
+        client (IdealistaClient, optional): Shared client with pooled connections.
+        token_provider (BearerTokenProvider, optional): Used instead of access_token.
+        cache (ResponseCache, optional): Pages that are cached are not requested again.
+        query_metadata (QueryMetadataTable, optional): Collects the summary, total and totalPages
+            of every query. Defaults to None.
+
+    Returns:
+        pd.DataFrame: Listings (with flattened nested fields, query_id and the compact dtypes of
+            LISTING_DTYPE_PROFILE without float32) from all pages with at least one new listing.
+    """
+    if query_columns is None:
+        query_columns = [{} for _ in query_parameters]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pages = list(
+            executor.map(
+                lambda parameters: retrieve_new_pages_from_idealista(
+                    parameters=parameters,
+                    key_index=key_index,
+                    access_token=access_token,
+                    order=order,
+                    client=client,
+                    token_provider=token_provider,
+                    cache=cache,
+                ),
+                query_parameters,
+            )
+        )
+
+    builder = ListingBatchBuilder()
+    for parameters, columns, query_pages in zip(query_parameters, query_columns, pages):
+        add_pages_to_batch(
+            builder,
+            {**parameters, "order": order, "sort": "desc"},
+            query_pages,
+            query_metadata=query_metadata,
+            **columns,
+        )
+
+    # compact dtypes (categories, nullable booleans, Int16), coordinates stay float64
+    return apply_dtype_profile(builder.to_dataframe(), downcast_floats=False)
@@ -0,0 +1,162 @@
+import collections
+import inspect
+import itertools
+import yaml
+import pandas as pd
+
+from functions.idealista_client import IdealistaClient
+from functions.get_bearer_access_token import BearerTokenProvider
+from functions.response_cache import ResponseCache
+from functions.retrieve_data_from_idealista import url_encode_request_data
+from functions.plan_query_shards import retrieve_sharded_data_from_idealista
+from functions.retrieve_new_listings import retrieve_new_data_from_idealista
+from functions.listing_key_index import ListingKeyIndex, KEY_COLUMNS
+from functions.flatten_listings import QueryMetadataTable
+
+# parameters that are set per page by the retrieval functions, not per query
+RESERVED_PARAMETERS = ["numPage"]
+
+
+def expand_query_job(job: dict, defaults: dict = None) -> list:
+    """
+    Function that expands one job of a job spec into its queries. Every combination of the
+    values in the job's matrix becomes one query. String values in columns are formatted with
+    the query parameters, so {"furnished": "{furnished}"} adds the furnished value of each query
+    (or an empty string if the query has no furnished parameter).
+
+    Args:
+        job (dict): Job with the keys name, parameters (optional), matrix (optional) and columns (optional).
+        defaults (dict, optional): Parameters and columns that apply to every job. Defaults to None.
+
+    Returns:
+        list: One dict per query with the keys name, parameters and columns.
+    """
+    defaults = defaults or {}
+    name = job.get("name")
+    if not name:
+        raise ValueError("Every query job needs a name: " + str(job))
+
+    matrix = job.get("matrix") or {}
+    known_parameters = inspect.signature(url_encode_request_data).parameters
+    parameters = {**(defaults.get("parameters") or {}), **(job.get("parameters") or {})}
+    for parameter in list(parameters) + list(matrix):
+        if parameter not in known_parameters or parameter in RESERVED_PARAMETERS:
+            raise ValueError(
+                "Unknown query parameter {} in query job {}".format(parameter, name)
+            )
+
+    queries = []
+    for values in itertools.product(*(matrix[key] for key in matrix)):
+        query_parameters = {
+            key: str(value)
+            for key, value in {**parameters, **dict(zip(matrix, values))}.items()
+            if value is not None
+        }
+        placeholders = collections.defaultdict(str, query_parameters)
+        columns = {
+            key: value.format_map(placeholders) if isinstance(value, str) else value
+            for key, value in {
+                **(defaults.get("columns") or {}),
+                **(job.get("columns") or {}),
+            }.items()
+        }
+        queries.append({"name": name, "parameters": query_parameters, "columns": columns})
+
+    return queries
+
+
+def load_query_jobs(spec_file: str) -> list:
+    """
+    Function that reads a YAML job spec and expands it into queries, e.g.
+
+        defaults:
+          columns: {furnished: "{furnished}"}
+        jobs:
+          - name: madrid
+            matrix:
+              furnished: [furnishedKitchen, furnished]
+
+    Args:
+        spec_file (str): Path of the YAML file.
+
+    Returns:
+        list: One dict per query with the keys name, parameters and columns (see expand_query_job).
+    """
+    with open(spec_file, "r", encoding="utf-8") as file:
+        spec = yaml.safe_load(file) or {}
+
+    queries = []
+    for job in spec.get("jobs") or []:
+        queries.extend(expand_query_job(job, spec.get("defaults")))
+    print(len(queries), "query/queries in", len(spec.get("jobs") or []), "job(s) from", spec_file)
+
+    return queries
+
+
+def run_query_jobs(
+    queries: list,
+    access_token: str = None,
+    extra_columns: dict = None,
+    key_index: ListingKeyIndex = None,
+    max_workers: int = 4,
+    client: IdealistaClient = None,
+    token_provider: BearerTokenProvider = None,
+    cache: ResponseCache = None,
+    query_metadata: QueryMetadataTable = None,
+) -> pd.DataFrame:
+    """
+    Function that runs all queries of a job spec at the same time and merges their listings.
+    All queries share one pool of max_workers threads and the client (with its rate limiter),
+    so more queries do not mean more requests per second. Listings that several queries
+    return are removed in one pass at the end; the first query in the spec keeps its row.
+
+    Args:
+        queries (list): Queries from load_query_jobs.
+        access_token (str, optional): Bearer access token for idealista API.
+        extra_columns (dict, optional): Columns added to all listings, e.g. {"insert_date": "2024-01-01"}.
+        key_index (ListingKeyIndex, optional): If set, only new listings are retrieved
+            (see retrieve_new_data_from_idealista). Defaults to None.
+        max_workers (int, optional): Maximum number of requests sent at the same time. Defaults to 4.
+        client (IdealistaClient, optional): Shared client with pooled connections.
+        token_provider (BearerTokenProvider, optional): Used instead of access_token.
+        cache (ResponseCache, optional): Pages that are cached are not requested again.
+        query_metadata (QueryMetadataTable, optional): Collects the summary, total and totalPages
+            of every query. Defaults to None.
+
+    Returns:
+        pd.DataFrame: Deduplicated listings of all queries.
+    """
+    query_parameters = [query["parameters"] for query in queries]
+    query_columns = [{**query["columns"], **(extra_columns or {})} for query in queries]
+
+    if key_index is not None:
+        df = retrieve_new_data_from_idealista(
+            query_parameters=query_parameters,
+            key_index=key_index,
+            access_token=access_token,
+            query_columns=query_columns,
+            max_workers=max_workers,
+            client=client,
+            token_provider=token_provider,
+            cache=cache,
+            query_metadata=query_metadata,
+        )
+    else:
+        df = retrieve_sharded_data_from_idealista(
+            query_parameters=query_parameters,
+            access_token=access_token,
+            query_columns=query_columns,
+            max_workers=max_workers,
+            client=client,
+            token_provider=token_provider,
+            cache=cache,
+            query_metadata=query_metadata,
+        )
+    if len(df) == 0:
+        return df
+
+    len_original = len(df)
+    df = df.drop_duplicates(subset=KEY_COLUMNS).reset_index(drop=True)
+    print(len_original - len(df), "duplicate(s) returned by more than one query were removed")
+
+    return df
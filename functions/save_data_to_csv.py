@@ -1,9 +1,31 @@
 from global_variables import DATA_DIRECTORY
 
+import argparse
+import gzip
+import hashlib
+import json
 import shutil
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
 import os
-from datetime import datetime
+from datetime import datetime, timedelta
+
+from functions.schema_registry import (
+    SchemaRegistry,
+    STRING_COLUMNS,
+    READ_DTYPES,
+    storage_dtype,
+)
+from functions.listing_dtypes import apply_dtype_profile
+
+# listing history as parquet dataset, one directory per insert_date and furnished
+PARQUET_DATASET_NAME = "idealista_data_parquet/"
+PARTITION_COLUMNS = ["insert_date", "furnished"]
+# arrow types of the read dtypes of the schema registry, all other columns are stored as strings
+PARQUET_TYPES = {"boolean": pa.bool_(), "Int64": pa.int64(), "float64": pa.float64()}
 
 
 def initialize_csv(
@@ -34,41 +56,464 @@ def initialize_csv(
     return df_existing_data
 
 
+BACKUP_DIRECTORY_NAME = "idealista_data_backups/"
+
+
+def _backup_manifest_path(file_name: str, backup_dir: str) -> str:
+    return os.path.join(
+        backup_dir, os.path.splitext(file_name)[0] + "_backup_manifest.json"
+    )
+
+
+def read_backup_manifest(
+    file_name: str = "idealista_data.csv",
+    data_dir: str = DATA_DIRECTORY,
+) -> list:
+    """
+    Function that reads the list of backups of a file.
+
+    Args:
+        file_name (str, optional): File that was backed up. Defaults to "idealista_data.csv".
+        data_dir (str, optional): Directory to the original file. Defaults to DATA_DIRECTORY.
+
+    Returns:
+        list: One dict per backup (oldest first) with the keys file, type ("full" or "delta"),
+            created_at, base (full backup a delta belongs to), offset, size and tail_sha256.
+    """
+    backup_dir = os.path.join(data_dir, BACKUP_DIRECTORY_NAME)
+    try:
+        with open(_backup_manifest_path(file_name, backup_dir), "r", encoding="utf-8") as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return []
+
+
+def _write_backup_manifest(file_name: str, backup_dir: str, entries: list) -> None:
+    manifest_path = _backup_manifest_path(file_name, backup_dir)
+    with open(manifest_path + ".tmp", "w", encoding="utf-8") as file:
+        json.dump(entries, file, indent=2)
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+
+def _tail_sha256(file_path: str, size: int, tail_bytes: int = 1024 * 1024) -> str:
+    """Hash of the last tail_bytes before size, used to check that a file was only appended to."""
+    with open(file_path, "rb") as file:
+        file.seek(max(size - tail_bytes, 0))
+        return hashlib.sha256(file.read(min(size, tail_bytes))).hexdigest()
+
+
+def _plan_backup(file_name: str, data_dir: str, full_backup_days: int, now: datetime) -> dict:
+    """
+    Function that decides which backup of a file is needed: None if the file does not exist or
+    has not changed since the last backup, otherwise a dict with the manifest entries, the
+    last full backup (full), whether a delta backup suffices (is_delta), the offset from
+    which the file is backed up and the size of the file.
+    """
+    file_src = os.path.join(data_dir, file_name)
+    if not os.path.exists(file_src):
+        return None
+    entries = read_backup_manifest(file_name, data_dir)
+    size = os.path.getsize(file_src)
+
+    if entries and entries[-1]["size"] == size and (
+        entries[-1]["tail_sha256"] == _tail_sha256(file_src, size)
+    ):
+        print("File", file_name, "has not changed since the last backup", entries[-1]["file"])
+        return None
+
+    # deltas are always taken against the last full backup, so any of them can be deleted
+    full = next((entry for entry in reversed(entries) if entry["type"] == "full"), None)
+    is_delta = (
+        full is not None
+        and now - datetime.fromisoformat(full["created_at"]) < timedelta(days=full_backup_days)
+        and size >= full["size"]
+        and full["tail_sha256"] == _tail_sha256(file_src, full["size"])
+    )
+    return {
+        "entries": entries,
+        "full": full,
+        "is_delta": is_delta,
+        "offset": full["size"] if is_delta else 0,
+        "size": size,
+    }
+
+
+def _backup_file_name(file_name: str, now: datetime, is_delta: bool) -> str:
+    return (
+        os.path.splitext(file_name)[0]
+        + "_backup_"
+        + now.strftime("%Y-%m-%dT%H%M%S%f")
+        + (".delta.csv.gz" if is_delta else ".csv.gz")
+    )
+
+
+def _record_backup(
+    file_name: str,
+    data_dir: str,
+    plan: dict,
+    backup_file_name: str,
+    now: datetime,
+    tail_sha256: str,
+) -> None:
+    """Function that adds a backup that was written according to plan to the manifest."""
+    backup_dir = os.path.join(data_dir, BACKUP_DIRECTORY_NAME)
+    plan["entries"].append(
+        {
+            "file": backup_file_name,
+            "type": "delta" if plan["is_delta"] else "full",
+            "created_at": now.isoformat(timespec="seconds"),
+            "base": plan["full"]["file"] if plan["is_delta"] else None,
+            "offset": plan["offset"],
+            "size": plan["size"],
+            "tail_sha256": tail_sha256,
+        }
+    )
+    _write_backup_manifest(file_name, backup_dir, plan["entries"])
+    print(
+        "Backup for file ",
+        file_name,
+        "created as",
+        os.path.join(backup_dir, backup_file_name),
+        "(delta of {} bytes)".format(plan["size"] - plan["offset"])
+        if plan["is_delta"]
+        else "(full)",
+    )
+
+
 def backup_idealista_data(
     file_name: str,
     backup_file_name: str = None,
     data_dir: str = DATA_DIRECTORY,
+    full_backup_days: int = 7,
 ) -> None:
     """
-    Function that writes dataframe with data that was extracted from the idealista API
-    to a csv file.
+    Function that creates a gzip compressed backup of a file in idealista_data_backups/.
+    The history is only appended to, so usually only the rows that were added since the last
+    full backup are stored (delta backup). A full backup is created if there is none within the
+    last full_backup_days days or if the file was changed other than by appending rows.
 
     Args:
         file_name (str): File that will be backed up.
-        backup_file_name (str, optional): Name of the backup file. Defaults to filename_backup_todays_date.csv.
+        backup_file_name (str, optional): Name of the backup file.
+            Defaults to filename_backup_<timestamp>.csv.gz (.delta.csv.gz for delta backups).
         data_dir (str, optional): Directory to the original file. Defaults to DATA_DIRECTORY.
+        full_backup_days (int, optional): Days after which a new full backup is created. Defaults to 7.
     """
     file_src = os.path.join(data_dir, file_name)
-    if backup_file_name is None:
-        backup_file_name = (
-            file_name.strip(".csv")
-            + "_backup_"
-            + datetime.today().strftime("%Y-%m-%d")
-            + ".csv"
-        )
-    backup_dir = os.path.join(data_dir, "idealista_data_backups/")
-    file_dest = os.path.join(backup_dir, backup_file_name)
-    try:
-        shutil.copy(file_src, file_dest)
-    except IOError:
+    if not os.path.exists(file_src):
+        print("File", file_name, "does not exist yet, no backup was created.")
+        return
+    backup_dir = os.path.join(data_dir, BACKUP_DIRECTORY_NAME)
+    if not os.path.isdir(backup_dir):
         print(
             "No existing backup folder idealista_data_backups/ found. Folder will be created."
         )
-        # create parent directory
-        os.makedirs(os.path.dirname(backup_dir))
-        shutil.copy(file_src, file_dest)
-    print("Backup for file ", file_name, "created as", file_dest)
-        
+        os.makedirs(backup_dir)
+
+    now = datetime.now()
+    plan = _plan_backup(file_name, data_dir, full_backup_days, now)
+    if plan is None:
+        return
+    if backup_file_name is None:
+        backup_file_name = _backup_file_name(file_name, now, plan["is_delta"])
+    file_dest = os.path.join(backup_dir, backup_file_name)
+
+    with open(file_src, "rb") as source:
+        source.seek(plan["offset"])
+        with gzip.open(file_dest + ".tmp", "wb", compresslevel=6) as destination:
+            shutil.copyfileobj(source, destination, length=1024 * 1024)
+    os.replace(file_dest + ".tmp", file_dest)
+
+    _record_backup(
+        file_name, data_dir, plan, backup_file_name, now, _tail_sha256(file_src, plan["size"])
+    )
+
+
+def restore_idealista_data(
+    file_name: str = "idealista_data.csv",
+    date: str = None,
+    data_dir: str = DATA_DIRECTORY,
+    target_path: str = None,
+) -> str:
+    """
+    Function that restores a file from its backups: the full backup is decompressed and
+    the delta backup (if any) is written after it. The restored file replaces the target at once.
+
+    Args:
+        file_name (str, optional): File that was backed up. Defaults to "idealista_data.csv".
+        date (str, optional): Restore the last backup created on or before this date ("YYYY-MM-DD").
+            Defaults to None (last backup).
+        data_dir (str, optional): Directory to the original file. Defaults to DATA_DIRECTORY.
+        target_path (str, optional): Path of the restored file. Defaults to the original file.
+
+    Returns:
+        str: Path of the restored file.
+    """
+    backup_dir = os.path.join(data_dir, BACKUP_DIRECTORY_NAME)
+    entries = [
+        entry
+        for entry in read_backup_manifest(file_name, data_dir)
+        if date is None or entry["created_at"][:10] <= date
+    ]
+    if not entries:
+        raise FileNotFoundError(
+            "No backup of {} found (date: {})".format(file_name, date)
+        )
+    entry = entries[-1]
+    parts = [entry["file"]] if entry["type"] == "full" else [entry["base"], entry["file"]]
+
+    if target_path is None:
+        target_path = os.path.join(data_dir, file_name)
+    with open(target_path + ".tmp", "wb") as destination:
+        for part in parts:
+            with gzip.open(os.path.join(backup_dir, part), "rb") as source:
+                shutil.copyfileobj(source, destination, length=1024 * 1024)
+        restored_size = destination.tell()
+    if restored_size != entry["size"]:
+        os.remove(target_path + ".tmp")
+        raise ValueError(
+            "Backup {} is incomplete: {} instead of {} bytes".format(
+                entry["file"], restored_size, entry["size"]
+            )
+        )
+    os.replace(target_path + ".tmp", target_path)
+    print("File", file_name, "restored from backup", entry["file"], "to", target_path)
+
+    return target_path
+
+
+def prune_idealista_backups(
+    file_name: str = "idealista_data.csv",
+    data_dir: str = DATA_DIRECTORY,
+    keep_daily: int = 7,
+    keep_weekly: int = 4,
+    keep_monthly: int = 12,
+) -> list:
+    """
+    Function that deletes old backups. The last backup of each of the last keep_daily days,
+    keep_weekly weeks and keep_monthly months is kept, as well as the full backups that
+    the kept delta backups belong to and the last full backup.
+
+    Args:
+        file_name (str, optional): File that was backed up. Defaults to "idealista_data.csv".
+        data_dir (str, optional): Directory to the original file. Defaults to DATA_DIRECTORY.
+        keep_daily (int, optional): Number of days with a backup to keep. Defaults to 7.
+        keep_weekly (int, optional): Number of weeks with a backup to keep. Defaults to 4.
+        keep_monthly (int, optional): Number of months with a backup to keep. Defaults to 12.
+
+    Returns:
+        list: Names of the deleted backup files.
+    """
+    backup_dir = os.path.join(data_dir, BACKUP_DIRECTORY_NAME)
+    entries = read_backup_manifest(file_name, data_dir)
+
+    keep = set()
+    for number, period in [
+        (keep_daily, lambda created_at: created_at.date()),
+        (keep_weekly, lambda created_at: created_at.isocalendar()[:2]),
+        (keep_monthly, lambda created_at: (created_at.year, created_at.month)),
+    ]:
+        last_per_period = {}
+        for entry in entries:
+            last_per_period[period(datetime.fromisoformat(entry["created_at"]))] = entry["file"]
+        if number > 0:
+            keep.update(last_per_period[key] for key in sorted(last_per_period)[-number:])
+    # the next delta backups are taken against the last full backup
+    keep.update(
+        [entry["file"] for entry in entries if entry["type"] == "full"][-1:]
+    )
+    keep.update(entry["base"] for entry in entries if entry["file"] in keep and entry["base"])
+
+    deleted = [entry["file"] for entry in entries if entry["file"] not in keep]
+    for backup_file_name in deleted:
+        try:
+            os.remove(os.path.join(backup_dir, backup_file_name))
+        except FileNotFoundError:
+            pass
+    if deleted:
+        _write_backup_manifest(
+            file_name, backup_dir, [entry for entry in entries if entry["file"] in keep]
+        )
+        print(len(deleted), "old backup(s) of", file_name, "were deleted")
+
+    return deleted
+
+
+def read_csv_header(file_path: str) -> list:
+    """
+    Function that reads only the header of a csv file.
+
+    Args:
+        file_path (str): Path of the csv file.
+
+    Returns:
+        list: Column names or None if the file does not exist or is empty.
+    """
+    try:
+        return list(pd.read_csv(file_path, nrows=0).columns)
+    except (FileNotFoundError, pd.errors.EmptyDataError):
+        return None
+
+
+def read_line_terminator(file_path: str, default: str = "\n") -> str:
+    """
+    Function that reads the line end of the first line of a file, so that appended rows use the
+    same line end as the existing rows (e.g. "\r\n" for files written on Windows).
+
+    Args:
+        file_path (str): Path of the file.
+        default (str, optional): Line end if the file does not exist or has no line end. Defaults to "\n".
+
+    Returns:
+        str: "\r\n" or "\n".
+    """
+    try:
+        with open(file_path, "rb") as file:
+            first_line = file.readline()
+    except FileNotFoundError:
+        return default
+    if first_line.endswith(b"\r\n"):
+        return "\r\n"
+    if first_line.endswith(b"\n"):
+        return "\n"
+    return default
+
+
+def _append_journal_path(file_path: str) -> str:
+    return file_path + ".append_journal.json"
+
+
+def recover_interrupted_append(file_path: str) -> None:
+    """
+    Function that undoes an append to a csv file that did not finish, e.g. because the process
+    was killed or the power failed: if the file has an append journal, it is cut back to the
+    size recorded in the journal (and to the last line end before it). Without journal, a last
+    line without line end is a complete row, so the line end is added.
+
+    Args:
+        file_path (str): Path of the csv file.
+    """
+    journal_path = _append_journal_path(file_path)
+    journal_exists = os.path.exists(journal_path)
+    try:
+        with open(journal_path, "r", encoding="utf-8") as file:
+            size = json.load(file)["size"]
+    except (FileNotFoundError, ValueError, KeyError):
+        size = None
+    if not os.path.exists(file_path):
+        if journal_exists:
+            os.remove(journal_path)
+        return
+
+    with open(file_path, "rb+") as file:
+        end = file.seek(0, os.SEEK_END)
+        if not journal_exists:
+            if end > 0:
+                file.seek(end - 1)
+                if file.read(1) != b"\n":
+                    file.write(read_line_terminator(file_path).encode("utf-8"))
+                    file.flush()
+                    os.fsync(file.fileno())
+                    print("Line end added to the last line of", file_path)
+            return
+        if size is not None and size < end:
+            end = size
+        # the last complete row ends with the last line end
+        position = end
+        while position > 0:
+            start = max(position - 1024 * 1024, 0)
+            file.seek(start)
+            line_end = file.read(position - start).rfind(b"\n")
+            if line_end >= 0:
+                position = start + line_end + 1
+                break
+            position = start
+        if position < file.seek(0, os.SEEK_END):
+            file.truncate(position)
+            file.flush()
+            os.fsync(file.fileno())
+            print(
+                "Interrupted append to",
+                file_path,
+                "was undone, file cut back to",
+                position,
+                "bytes",
+            )
+    os.remove(journal_path)
+
+
+def _append_in_place(file_path: str, rows: bytes) -> None:
+    """
+    Function that writes rows (complete lines) to the end of a file. The size before the
+    append is recorded in a journal first, so that an append that does not finish is undone,
+    either right away or by recover_interrupted_append the next time the file is opened.
+    """
+    size = os.path.getsize(file_path)
+    journal_path = _append_journal_path(file_path)
+    with open(journal_path + ".tmp", "w", encoding="utf-8") as journal:
+        json.dump({"size": size}, journal)
+        journal.flush()
+        os.fsync(journal.fileno())
+    os.replace(journal_path + ".tmp", journal_path)
+
+    with open(file_path, "rb+") as destination:
+        destination.seek(size)
+        try:
+            destination.write(rows)
+            destination.flush()
+            os.fsync(destination.fileno())
+        except BaseException:
+            destination.truncate(size)
+            raise
+    os.remove(journal_path)
+
+
+def _append_rows(file_path: str, df: pd.DataFrame, columns: list) -> None:
+    """Function that writes rows to the end of a csv file in the given column order."""
+    recover_interrupted_append(file_path)
+    _append_in_place(
+        file_path,
+        df.reindex(columns=columns)
+        .to_csv(index=False, header=False, lineterminator=read_line_terminator(file_path))
+        .encode("utf-8"),
+    )
+
+
+def _print_column_changes(existing_columns: list, new_data_columns: list) -> None:
+    missing_columns = set(existing_columns) - set(new_data_columns)
+    # less columns in new dataframe
+    if len(missing_columns) >= 1:
+        print(len(missing_columns), "column(s) were not returned:")
+        print(list(missing_columns))
+
+    new_columns = set(new_data_columns) - set(existing_columns)
+    # additional columns in new dataframe
+    if len(new_columns) >= 1:
+        print(len(new_columns), "new column(s) were returned:\n", new_columns)
+
+
+def _select_partition(
+    df_new_data: pd.DataFrame,
+    schema_registry: SchemaRegistry,
+    file_name: str,
+    data_dir: str,
+) -> str:
+    """
+    Function that returns the partition the rows are written to: the last partition that has
+    all their columns, file_name if there is no partition yet, or a new dated partition.
+    """
+    schema_registry.discover(file_name, data_dir)
+    partition = schema_registry.find_partition(df_new_data.columns)
+    if partition is None and schema_registry.partitions:
+        _print_column_changes(schema_registry.columns, df_new_data.columns)
+        stem = os.path.splitext(file_name)[0] + "_" + datetime.today().strftime("%Y-%m-%d")
+        partition, number = stem + ".csv", 1
+        while os.path.exists(os.path.join(data_dir, partition)):
+            number += 1
+            partition = "{stem}_{number}.csv".format(stem=stem, number=number)
+    elif partition is None:
+        partition = file_name
+    return partition
 
 
 def append_idealista_data(
@@ -76,40 +521,58 @@ def append_idealista_data(
     data_dir: str = DATA_DIRECTORY,
     file_name: str = "idealista_data.csv",
     df_existing_data: pd.DataFrame = None,
+    schema_registry: SchemaRegistry = None,
 ) -> None:
     """
     Function that appends rows to idealista data csv or creates a new csv
     if existing data cannot be appended.
+    Only the header of the existing file is read and the new rows are written to the end
+    of the file, so the time needed does not grow with the size of the history.
+    With a schema registry, rows with fewer columns are appended with blanks and rows with new
+    columns are written to a new partition (file) that is registered, see read_idealista_data.
 
     Args:
         df_new_data (pd.DataFrame): Dataframe with new idealista data.
         data_dir (str, optional): File location.  Defaults to DATA_DIRECTORY.
         file_name (str): File that will be appended. Defaults to "idealista_data.csv".
-        df_existing_data (pd.DataFrame, optional): Dataframe with existing idealista data. Defaults to None.
+        df_existing_data (pd.DataFrame, optional): Dataframe with existing idealista data,
+            only its columns are used. Defaults to None (columns are read from the file header).
+        schema_registry (SchemaRegistry, optional): Registry of the partitions of the history. Defaults to None.
     """
     file_history = os.path.join(data_dir, file_name)
-    # get df with existing data
-    if df_existing_data is None:
-        df_existing_data = initialize_csv()
+
+    if schema_registry is not None:
+        partition = _select_partition(df_new_data, schema_registry, file_name, data_dir)
+        file_dest = os.path.join(data_dir, partition)
+        partition_columns = read_csv_header(file_dest)
+        if partition_columns is None:
+            os.makedirs(os.path.dirname(os.path.abspath(file_dest)), exist_ok=True)
+            df_new_data.to_csv(file_dest, index=False)
+        else:
+            _append_rows(file_dest, df_new_data, partition_columns)
+        schema_registry.register(partition, df_new_data)
+        print(len(df_new_data), "lines written to", file_dest)
+        return
+
+    # get columns of existing data
+    existing_columns = read_csv_header(file_history)
+    if df_existing_data is not None and existing_columns is not None:
+        existing_columns = list(df_existing_data.columns)
+
+    if existing_columns is None:
+        # no history yet, create csv with header
+        os.makedirs(os.path.dirname(os.path.abspath(file_history)), exist_ok=True)
+        df_new_data.to_csv(file_history, index=False)
+        print(len(df_new_data), "lines written to new file", file_history)
 
     # check if columns are identical
-    if set(df_new_data.columns) == set(df_existing_data.columns):
-        # append csv
-        df_combined_data = pd.concat([df_existing_data, df_new_data])
-        df_combined_data.to_csv(file_history, index=False)
+    elif set(df_new_data.columns) == set(existing_columns):
+        # append rows in the column order of the file
+        _append_rows(file_history, df_new_data, existing_columns)
         print(len(df_new_data), "lines written to", file_history)
 
     else:
-        missing_columns = set(df_existing_data.columns) - set(df_new_data.columns)
-        # less columns in new dataframe
-        if len(missing_columns) >= 1:
-            print(len(missing_columns), "column(s) were not returned:")
-            print(list(missing_columns))
-
-        new_columns = set(df_new_data.columns) - set(df_existing_data.columns)
-        # additional columns in new dataframe
-        if len(new_columns) >= 1:
-            print(len(new_columns), "new column(s) were returned:\n", new_columns)
+        _print_column_changes(existing_columns, df_new_data.columns)
 
         # write new data to file
         new_file_name = (
@@ -122,27 +585,483 @@ def append_idealista_data(
         df_new_data.to_csv(file_dest, index=False)
 
 
+def _write_new_partition(file_dest: str, rows: bytes) -> None:
+    """Function that writes a new partition completely before it gets its name."""
+    os.makedirs(os.path.dirname(os.path.abspath(file_dest)), exist_ok=True)
+    with open(file_dest + ".tmp", "wb") as destination:
+        destination.write(rows)
+        destination.flush()
+        os.fsync(destination.fileno())
+    os.replace(file_dest + ".tmp", file_dest)
+
+
+def _full_backup_and_append(file_dest: str, backup_path: str, rows: bytes) -> str:
+    """
+    Function that reads a file once: every block is written to the gzip backup and to a
+    temporary file, the rows are appended to the temporary file, which then replaces the file.
+
+    Returns:
+        str: Hash of the tail of the file that was backed up (see _tail_sha256).
+    """
+    size = os.path.getsize(file_dest)
+    with open(file_dest, "rb") as source, open(file_dest + ".tmp", "wb") as destination:
+        with gzip.open(backup_path + ".tmp", "wb", compresslevel=6) as backup:
+            for block in iter(lambda: source.read(1024 * 1024), b""):
+                backup.write(block)
+                destination.write(block)
+        tail_sha256 = _tail_sha256(file_dest, size)
+        destination.write(rows)
+        destination.flush()
+        os.fsync(destination.fileno())
+    os.replace(backup_path + ".tmp", backup_path)
+    os.replace(file_dest + ".tmp", file_dest)
+    return tail_sha256
+
+
+def _delta_backup(file_dest: str, backup_path: str, offset: int) -> str:
+    """
+    Function that writes the bytes of a file after offset to a gzip backup.
+
+    Returns:
+        str: Hash of the tail of the file that was backed up (see _tail_sha256).
+    """
+    with open(file_dest, "rb") as source:
+        source.seek(offset)
+        with gzip.open(backup_path + ".tmp", "wb", compresslevel=6) as backup:
+            shutil.copyfileobj(source, backup, length=1024 * 1024)
+    os.replace(backup_path + ".tmp", backup_path)
+    return _tail_sha256(file_dest, os.path.getsize(file_dest))
+
+
+def persist_idealista_data(
+    df_new_data: pd.DataFrame,
+    file_name: str = "idealista_data.csv",
+    data_dir: str = DATA_DIRECTORY,
+    schema_registry: SchemaRegistry = None,
+    full_backup_days: int = 7,
+    prune_backups: bool = True,
+) -> str:
+    """
+    Function that backs up the partition the new rows belong to and appends the rows in one pass.
+    The rows are deduplicated at ingestion (ListingKeyIndex.drop_known), so the history is
+    not read to deduplicate it.
+    If a full backup is due, the file is read once: every block is written to the gzip backup
+    and to a temporary file, the rows are appended to the temporary file, which then replaces
+    the partition at once. Otherwise only the bytes since the last full backup are read for the
+    delta backup and the rows are appended in a single write; the size before the append is
+    recorded in a journal, so an append that is interrupted (even by a crash) is undone the next
+    time the partition is opened (recover_interrupted_append). Either way the partition is
+    never left half-written.
+
+    Args:
+        df_new_data (pd.DataFrame): Dataframe with new idealista data.
+        file_name (str, optional): Main file of the history. Defaults to "idealista_data.csv".
+        data_dir (str, optional): Directory of the files. Defaults to DATA_DIRECTORY.
+        schema_registry (SchemaRegistry, optional): Registry of the partitions of the history.
+            Defaults to None (the registry <stem>_schema.json in data_dir).
+        full_backup_days (int, optional): Days after which a new full backup is created. Defaults to 7.
+        prune_backups (bool, optional): Delete old backups of the partition afterwards (see
+            prune_idealista_backups). Defaults to True.
+
+    Returns:
+        str: File name of the partition the rows were written to (None if there are no columns).
+    """
+    if schema_registry is None:
+        schema_registry = SchemaRegistry(
+            os.path.join(data_dir, os.path.splitext(file_name)[0] + "_schema.json")
+        )
+    if len(df_new_data.columns) == 0:
+        print("No data to write to", file_name)
+        return None
+    partition = _select_partition(df_new_data, schema_registry, file_name, data_dir)
+    file_dest = os.path.join(data_dir, partition)
+    recover_interrupted_append(file_dest)
+    partition_columns = read_csv_header(file_dest)
+    rows = df_new_data.reindex(columns=partition_columns or list(df_new_data.columns)).to_csv(
+        index=False, header=partition_columns is None, lineterminator=read_line_terminator(file_dest)
+    ).encode("utf-8")
+
+    if partition_columns is None:
+        _write_new_partition(file_dest, rows)
+        schema_registry.register(partition, df_new_data)
+        print(len(df_new_data), "lines written to new file", file_dest)
+        return partition
+
+    os.makedirs(os.path.join(data_dir, BACKUP_DIRECTORY_NAME), exist_ok=True)
+    now = datetime.now()
+    plan = _plan_backup(partition, data_dir, full_backup_days, now)
+    if plan is not None:
+        backup_file_name = _backup_file_name(partition, now, plan["is_delta"])
+        backup_path = os.path.join(data_dir, BACKUP_DIRECTORY_NAME, backup_file_name)
+
+    if plan is not None and not plan["is_delta"]:
+        tail_sha256 = _full_backup_and_append(file_dest, backup_path, rows)
+        _record_backup(partition, data_dir, plan, backup_file_name, now, tail_sha256)
+    else:
+        if plan is not None:
+            tail_sha256 = _delta_backup(file_dest, backup_path, plan["offset"])
+            _record_backup(partition, data_dir, plan, backup_file_name, now, tail_sha256)
+        _append_in_place(file_dest, rows)
+
+    if plan is not None and prune_backups:
+        prune_idealista_backups(file_name=partition, data_dir=data_dir)
+    schema_registry.register(partition, df_new_data)
+    print(len(df_new_data), "lines written to", file_dest)
+
+    return partition
+
+
+def iter_idealista_data(
+    chunksize: int = 100000,
+    usecols: list = None,
+    dtype: dict = None,
+    file_name: str = "idealista_data.csv",
+    data_dir: str = DATA_DIRECTORY,
+    schema_registry: SchemaRegistry = None,
+    dtype_profile: bool = False,
+):
+    """
+    Generator that reads the listing history in chunks, so that the memory needed does not grow
+    with the size of the history. Only the columns in usecols are parsed.
+    With a schema registry, all partitions are read and every chunk has the columns and dtypes
+    of the unified schema (columns that a partition does not have are missing values).
+
+    Args:
+        chunksize (int, optional): Maximum number of rows per chunk. Defaults to 100000.
+        usecols (list, optional): Columns to read. Defaults to None (all columns).
+        dtype (dict, optional): dtype per column, overrides the dtypes of the registry.
+            Defaults to None (object for propertyCode and externalReference, inferred otherwise).
+        file_name (str, optional): File that is read without registry. Defaults to "idealista_data.csv".
+        data_dir (str, optional): Directory of the files. Defaults to DATA_DIRECTORY.
+        schema_registry (SchemaRegistry, optional): Registry of the partitions of the history. Defaults to None.
+        dtype_profile (bool, optional): Convert the chunks to the compact dtypes of LISTING_DTYPE_PROFILE
+            (categories of different chunks can differ). Defaults to False.
+
+    Yields:
+        pd.DataFrame: Chunk of listings.
+    """
+    if schema_registry is None:
+        header = read_csv_header(os.path.join(data_dir, file_name))
+        if header is None:
+            return
+        partitions = {file_name: header}
+        dtypes = {column: object for column in STRING_COLUMNS}
+    else:
+        partitions = schema_registry.partitions
+        dtypes = schema_registry.read_dtypes()
+    all_columns = list(dtypes) if schema_registry is not None else header
+    columns = [column for column in (usecols or all_columns) if column in all_columns]
+    dtypes.update(dtype or {})
+
+    for partition, partition_columns in partitions.items():
+        partition_usecols = [column for column in columns if column in partition_columns]
+        for df_chunk in pd.read_csv(
+            os.path.join(data_dir, partition),
+            usecols=partition_usecols,
+            dtype={
+                column: dtypes[column] for column in partition_usecols if column in dtypes
+            },
+            chunksize=chunksize,
+        ):
+            df_chunk = df_chunk.reindex(columns=columns)
+            if schema_registry is not None:
+                df_chunk = df_chunk.astype({column: dtypes[column] for column in columns})
+            if dtype_profile:
+                df_chunk = apply_dtype_profile(df_chunk)
+            yield df_chunk
+
+
+def read_idealista_data(
+    schema_registry: SchemaRegistry,
+    columns: list = None,
+    data_dir: str = DATA_DIRECTORY,
+    dtype_profile: bool = False,
+) -> pd.DataFrame:
+    """
+    Function that reads all partitions of the listing history into one dataframe with the
+    unified schema. Each file is read once, only with the requested columns that it has;
+    columns that a partition does not have are missing values.
+
+    Args:
+        schema_registry (SchemaRegistry): Registry of the partitions of the history.
+        columns (list, optional): Columns to read. Defaults to None (all columns).
+        data_dir (str, optional): Directory of the files. Defaults to DATA_DIRECTORY.
+        dtype_profile (bool, optional): Convert the columns to the compact dtypes of
+            LISTING_DTYPE_PROFILE (categories, nullable booleans, Int16, float32). Defaults to False.
+
+    Returns:
+        pd.DataFrame: Listings of all partitions.
+    """
+    df_chunks = list(
+        iter_idealista_data(
+            usecols=columns, data_dir=data_dir, schema_registry=schema_registry
+        )
+    )
+    if not df_chunks:
+        return pd.DataFrame(columns=columns)
+    df = pd.concat(df_chunks, ignore_index=True)
+    return apply_dtype_profile(df) if dtype_profile else df
+
+
 def remove_duplicates_from_csv(
     file_name: str,
     data_dir: str = DATA_DIRECTORY,
+    chunksize: int = 100000,
 ) -> None:
     """
     Function that removes duplicate rows from a csv file.
     Used to deduplicate that idealista data files.
+    The file is read in chunks twice: first only the key columns to find the last row of
+    every key, then all rows, which are written unchanged to a new file that replaces the old one.
 
     Args:
         file_name (str): File that will be deduplicated.
         data_dir (str, optional): File location. Defaults to DATA_DIRECTORY.
+        chunksize (int, optional): Number of rows that are read at once. Defaults to 100000.
     """
     file_history = data_dir + file_name
-    df = pd.read_csv(file_history)
-    len_original = len(df)
-    df.drop_duplicates(
-        subset=["propertyCode", "price", "size"], inplace=True, keep="last"
+    key_columns = ["propertyCode", "price", "size"]
+    # 64 bit hash of the key of every row
+    key_hashes = np.concatenate(
+        [
+            pd.util.hash_pandas_object(df_chunk, index=False).to_numpy()
+            for df_chunk in iter_idealista_data(
+                chunksize=chunksize,
+                usecols=key_columns,
+                dtype={"price": "float64", "size": "float64"},
+                file_name=file_name,
+                data_dir=data_dir,
+            )
+        ]
+        or [np.array([], dtype=np.uint64)]
     )
-    len_dedup = len(df)
+    keep = ~pd.Series(key_hashes).duplicated(keep="last").to_numpy()
+    len_original, len_dedup = len(keep), int(keep.sum())
+
     if len_dedup < len_original:
+        position = 0
+        with open(file_history + ".tmp", "w", encoding="utf-8", newline="") as file:
+            # all values are read as text, so they are written back unchanged
+            for df_chunk in pd.read_csv(
+                file_history, dtype=str, keep_default_na=False, chunksize=chunksize
+            ):
+                df_chunk[keep[position : position + len(df_chunk)]].to_csv(
+                    file, header=position == 0, index=False
+                )
+                position += len(df_chunk)
+        os.replace(file_history + ".tmp", file_history)
         print(
             len_original - len_dedup, "duplicates were removed from file", file_history
         )
-    df.to_csv(file_history, index=False)
+
+
+def _parquet_dtypes(df: pd.DataFrame, dtypes: dict) -> dict:
+    """
+    Function that returns the dtypes the columns of a dataframe are written to parquet with,
+    so that every file of the dataset has the same type per column.
+
+    Args:
+        df (pd.DataFrame): Dataframe that will be written.
+        dtypes (dict): Read dtype per column (SchemaRegistry.read_dtypes), columns that are not in
+            it get the read dtype of their dtype in df.
+
+    Returns:
+        dict: "boolean", "Int64", "float64" or "object" (stored as string) per column.
+    """
+    write_dtypes = {}
+    for column in df.columns:
+        if column in dtypes:
+            write_dtypes[column] = dtypes[column]
+        elif column in STRING_COLUMNS:
+            write_dtypes[column] = "object"
+        else:
+            write_dtypes[column] = READ_DTYPES.get(storage_dtype(df[column].dtype), "object")
+    return write_dtypes
+
+
+def append_idealista_parquet(
+    df_new_data: pd.DataFrame,
+    data_dir: str = DATA_DIRECTORY,
+    dataset_name: str = PARQUET_DATASET_NAME,
+    partition_cols: list = None,
+    schema_registry: SchemaRegistry = None,
+) -> None:
+    """
+    Function that appends rows to the idealista data parquet dataset. The rows are written to
+    new files in the partition directories (e.g. insert_date=2024-01-01/furnished=furnished/),
+    existing files are not read or changed.
+    The columns are written with the dtypes of the schema registry (columns with other values
+    than numbers and booleans as strings), so that the files of different batches can be read
+    together. Dicts and lists (e.g. detailedType) are stored as strings like in the csv file.
+
+    Args:
+        df_new_data (pd.DataFrame): Dataframe with new idealista data.
+        data_dir (str, optional): Directory of the dataset. Defaults to DATA_DIRECTORY.
+        dataset_name (str, optional): Name of the dataset directory. Defaults to PARQUET_DATASET_NAME.
+        partition_cols (list, optional): Columns the dataset is partitioned by. Defaults to PARTITION_COLUMNS.
+        schema_registry (SchemaRegistry, optional): Registry with the dtypes of the columns.
+            Defaults to None (dtypes of df_new_data).
+    """
+    if len(df_new_data) == 0:
+        return
+    partition_cols = list(PARTITION_COLUMNS) if partition_cols is None else partition_cols
+    dtypes = {} if schema_registry is None else schema_registry.read_dtypes()
+    dtypes.update({column: "object" for column in partition_cols})
+
+    # categories are stored as strings (parquet encodes repeated values in a dictionary anyway)
+    df_write = df_new_data.astype(
+        {column: object for column in df_new_data.columns[df_new_data.dtypes == "category"]}
+    )
+    for column in partition_cols:
+        if column not in df_write.columns:
+            df_write[column] = None
+    write_dtypes = _parquet_dtypes(df_write, dtypes)
+    for column, dtype in write_dtypes.items():
+        if dtype in PARQUET_TYPES:
+            df_write[column] = df_write[column].astype(dtype)
+        else:
+            df_write[column] = (
+                df_write[column]
+                .astype(object)
+                .map(lambda value: None if np.ndim(value) == 0 and pd.isna(value) else str(value))
+            )
+    schema = pa.schema(
+        [(column, PARQUET_TYPES.get(dtype, pa.string())) for column, dtype in write_dtypes.items()]
+    )
+
+    dataset_path = os.path.join(data_dir, dataset_name)
+    df_write.to_parquet(
+        dataset_path, partition_cols=partition_cols, index=False, schema=schema
+    )
+    print(len(df_write), "lines written to", dataset_path)
+
+
+def read_idealista_parquet(
+    columns: list = None,
+    filters: list = None,
+    data_dir: str = DATA_DIRECTORY,
+    dataset_name: str = PARQUET_DATASET_NAME,
+    partition_cols: list = None,
+    dtype_profile: bool = False,
+) -> pd.DataFrame:
+    """
+    Function that reads the idealista data parquet dataset. Only the columns that are requested
+    are read, and partitions (and row groups) that cannot match the filters are skipped.
+    Files with different columns are read with the union of all columns.
+
+    Args:
+        columns (list, optional): Columns to read. Defaults to None (all columns).
+        filters (list, optional): Filters like [("insert_date", ">=", "2024-01-01"), ("furnished", "=", "furnished")]
+            (a list of lists means OR of the inner lists). Defaults to None.
+        data_dir (str, optional): Directory of the dataset. Defaults to DATA_DIRECTORY.
+        dataset_name (str, optional): Name of the dataset directory. Defaults to PARQUET_DATASET_NAME.
+        partition_cols (list, optional): Columns the dataset is partitioned by. Defaults to PARTITION_COLUMNS.
+        dtype_profile (bool, optional): Convert the columns to the compact dtypes of
+            LISTING_DTYPE_PROFILE. Defaults to False.
+
+    Returns:
+        pd.DataFrame: Dataframe with idealista data, empty if there is no dataset.
+    """
+    dataset_path = os.path.join(data_dir, dataset_name)
+    if not os.path.isdir(dataset_path):
+        return pd.DataFrame(columns=columns)
+    partition_cols = list(PARTITION_COLUMNS) if partition_cols is None else partition_cols
+
+    # partition values are read as strings (insert_date would otherwise be parsed as date)
+    partitioning = ds.partitioning(
+        pa.schema([(column, pa.string()) for column in partition_cols]), flavor="hive"
+    )
+    dataset = ds.dataset(dataset_path, format="parquet", partitioning=partitioning)
+    schema = pa.unify_schemas(
+        [fragment.physical_schema for fragment in dataset.get_fragments()]
+        + [partitioning.schema],
+        promote_options="permissive",
+    ).remove_metadata()
+    dataset = ds.dataset(
+        dataset_path, format="parquet", partitioning=partitioning, schema=schema
+    )
+
+    table = dataset.to_table(
+        columns=columns,
+        filter=pq.filters_to_expression(filters) if filters else None,
+    )
+    df = table.to_pandas()
+    return apply_dtype_profile(df) if dtype_profile else df
+
+
+def convert_csv_to_parquet(
+    file_name: str = "idealista_data.csv",
+    data_dir: str = DATA_DIRECTORY,
+    dataset_name: str = PARQUET_DATASET_NAME,
+    chunksize: int = 100000,
+    schema_registry: SchemaRegistry = None,
+) -> None:
+    """
+    Function that writes the rows of an idealista data csv file to the parquet dataset,
+    e.g. to move the existing history to the dataset once.
+    The dtypes of the columns are registered from all rows first, so that every chunk is
+    written with the same schema (e.g. floor as string, even if the first chunk only has numbers).
+
+    Args:
+        file_name (str, optional): Csv file that will be converted. Defaults to "idealista_data.csv".
+        data_dir (str, optional): Directory of the csv file and the dataset. Defaults to DATA_DIRECTORY.
+        dataset_name (str, optional): Name of the dataset directory. Defaults to PARQUET_DATASET_NAME.
+        chunksize (int, optional): Number of rows that are converted at once. Defaults to 100000.
+        schema_registry (SchemaRegistry, optional): Registry of the history.
+            Defaults to None (registry file of file_name in data_dir).
+    """
+    if schema_registry is None:
+        schema_registry = SchemaRegistry(
+            registry_file=os.path.join(
+                data_dir, os.path.splitext(file_name)[0] + "_schema.json"
+            )
+        )
+    for df_chunk in iter_idealista_data(
+        chunksize=chunksize, file_name=file_name, data_dir=data_dir
+    ):
+        schema_registry.register(file_name, df_chunk)
+
+    for df_chunk in iter_idealista_data(
+        chunksize=chunksize,
+        dtype=schema_registry.read_dtypes(),
+        file_name=file_name,
+        data_dir=data_dir,
+    ):
+        append_idealista_parquet(
+            df_new_data=df_chunk,
+            data_dir=data_dir,
+            dataset_name=dataset_name,
+            schema_registry=schema_registry,
+        )
+
+
+def main() -> None:
+    """Function that restores a backup or lists the backups of a csv file."""
+    # python -m functions.save_data_to_csv --restore [YYYY-MM-DD]
+    parser = argparse.ArgumentParser(description="Backups of the idealista data csv.")
+    parser.add_argument("--file-name", default="idealista_data.csv")
+    parser.add_argument("--data-dir", default=DATA_DIRECTORY)
+    parser.add_argument(
+        "--restore",
+        nargs="?",
+        const="latest",
+        metavar="DATE",
+        help="restore the last backup (created on or before DATE)",
+    )
+    parser.add_argument("--target", help="path of the restored file (default: the original file)")
+    args = parser.parse_args()
+
+    if args.restore:
+        restore_idealista_data(
+            file_name=args.file_name,
+            date=None if args.restore == "latest" else args.restore,
+            data_dir=args.data_dir,
+            target_path=args.target,
+        )
+    else:
+        for entry in read_backup_manifest(args.file_name, args.data_dir):
+            print(entry["created_at"], entry["type"], entry["size"], entry["file"])
+
+
+if __name__ == "__main__":
+    main()
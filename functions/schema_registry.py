@@ -0,0 +1,175 @@
+from global_variables import DATA_DIRECTORY
+
+import glob
+import json
+import os
+import threading
+import pandas as pd
+
+# columns with numbers as values that are ids, not numbers
+STRING_COLUMNS = ["propertyCode", "externalReference"]
+
+# dtypes used to read columns from csv, blanks are read as missing values
+READ_DTYPES = {"bool": "boolean", "int64": "Int64", "float64": "float64"}
+
+
+def storage_dtype(dtype) -> str:
+    """
+    Function that returns the dtype in which the values of a column are stored in csv,
+    e.g. "bool" for nullable booleans and "object" for categories.
+
+    Args:
+        dtype: pandas dtype of the column.
+
+    Returns:
+        str: "bool", "int64", "float64" or "object".
+    """
+    if pd.api.types.is_bool_dtype(dtype):
+        return "bool"
+    if pd.api.types.is_integer_dtype(dtype):
+        return "int64"
+    if pd.api.types.is_float_dtype(dtype):
+        return "float64"
+    return "object"
+
+
+def unify_dtypes(dtype_a: str, dtype_b: str) -> str:
+    """
+    Function that returns a dtype that can hold the values of both dtypes.
+
+    Args:
+        dtype_a (str): Name of the first dtype (e.g. "int64"), can be None.
+        dtype_b (str): Name of the second dtype, can be None.
+
+    Returns:
+        str: dtype_a if both are the same, float64 for int and float, object otherwise.
+    """
+    if dtype_a is None or dtype_a == dtype_b:
+        return dtype_b
+    if dtype_b is None:
+        return dtype_a
+    if {dtype_a, dtype_b} <= {"int64", "float64"}:
+        return "float64"
+    return "object"
+
+
+class SchemaRegistry:
+    """
+    Registry of the columns and dtypes of the csv files (partitions) of the listing history.
+    If the API returns new columns, the new listings are written to a new partition instead of
+    changing the existing ones, and the unified schema is the union of all partitions.
+    The registry is stored as json file, e.g.
+        {"columns": {"propertyCode": "object", ...},
+         "partitions": {"idealista_data.csv": {"propertyCode": "object", ...}, ...}}
+    """
+
+    def __init__(
+        self,
+        registry_file: str = os.path.join(DATA_DIRECTORY, "idealista_data_schema.json"),
+    ):
+        """
+        Args:
+            registry_file (str, optional): Json file of the registry. Defaults to DATA_DIRECTORY/idealista_data_schema.json.
+        """
+        self.registry_file = registry_file
+        self.partitions = {}
+        self._lock = threading.Lock()
+        try:
+            with open(registry_file, "r", encoding="utf-8") as file:
+                self.partitions = json.load(file)["partitions"]
+        except FileNotFoundError:
+            pass
+
+    @property
+    def columns(self) -> dict:
+        """Unified schema: all columns of all partitions with a dtype that fits all of them."""
+        columns = {}
+        for partition_columns in self.partitions.values():
+            for column, dtype in partition_columns.items():
+                columns[column] = unify_dtypes(columns.get(column), dtype)
+        return columns
+
+    def _save(self) -> None:
+        os.makedirs(os.path.dirname(os.path.abspath(self.registry_file)), exist_ok=True)
+        with open(self.registry_file + ".tmp", "w", encoding="utf-8") as file:
+            json.dump({"columns": self.columns, "partitions": self.partitions}, file, indent=2)
+        os.replace(self.registry_file + ".tmp", self.registry_file)
+
+    def register(self, partition: str, df: pd.DataFrame) -> None:
+        """
+        Function that adds the columns and dtypes of a dataframe to a partition.
+
+        Args:
+            partition (str): File name of the partition.
+            df (pd.DataFrame): Rows that were written to the partition.
+        """
+        with self._lock:
+            partition_columns = self.partitions.setdefault(partition, {})
+            for column, dtype in df.dtypes.items():
+                dtype = "object" if column in STRING_COLUMNS else storage_dtype(dtype)
+                partition_columns[column] = unify_dtypes(partition_columns.get(column), dtype)
+            self._save()
+
+    def register_csv(self, file_name: str, data_dir: str = DATA_DIRECTORY, nrows: int = 10000) -> None:
+        """
+        Function that registers an existing csv file. The dtypes are inferred from its first nrows rows.
+
+        Args:
+            file_name (str): Name of the csv file.
+            data_dir (str, optional): Directory of the file. Defaults to DATA_DIRECTORY.
+            nrows (int, optional): Number of rows used to infer the dtypes. Defaults to 10000.
+        """
+        df_sample = pd.read_csv(
+            os.path.join(data_dir, file_name),
+            nrows=nrows,
+            dtype={column: object for column in STRING_COLUMNS},
+        )
+        self.register(file_name, df_sample)
+
+    def discover(self, file_name: str = "idealista_data.csv", data_dir: str = DATA_DIRECTORY) -> None:
+        """
+        Function that registers the existing csv files of the history that are not registered yet,
+        i.e. file_name and the dated files that were written if the columns did not match.
+
+        Args:
+            file_name (str, optional): Name of the main csv file. Defaults to "idealista_data.csv".
+            data_dir (str, optional): Directory of the files. Defaults to DATA_DIRECTORY.
+        """
+        stem = os.path.splitext(file_name)[0]
+        file_paths = [os.path.join(data_dir, file_name)] + sorted(
+            glob.glob(os.path.join(data_dir, stem + "_????-??-??*.csv"))
+        )
+        for file_path in file_paths:
+            if os.path.exists(file_path) and os.path.basename(file_path) not in self.partitions:
+                self.register_csv(os.path.basename(file_path), data_dir)
+
+    def find_partition(self, columns: list) -> str:
+        """
+        Function that returns the last partition that has all columns.
+
+        Args:
+            columns (list): Columns of the rows that will be written.
+
+        Returns:
+            str: File name of the partition or None.
+        """
+        for partition, partition_columns in reversed(list(self.partitions.items())):
+            if set(columns) <= set(partition_columns):
+                return partition
+        return None
+
+    def read_dtypes(self, columns: list = None) -> dict:
+        """
+        Function that returns the dtypes to read columns from csv with pd.read_csv.
+
+        Args:
+            columns (list, optional): Columns that are read. Defaults to None (all columns).
+
+        Returns:
+            dict: dtype per column (nullable dtypes for bool and int columns).
+        """
+        return {
+            column: READ_DTYPES.get(dtype, "object")
+            for column, dtype in self.columns.items()
+            if columns is None or column in columns
+        }
@@ -1,12 +1,299 @@
+import ast
+import math
 import pandas as pd
+import numpy as np
+import pyarrow as pa
 import os
+import queue
+import random
+import threading
+import time
+from datetime import datetime
+from decimal import Decimal
 import boto3
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
 from botocore.exceptions import ClientError
 import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from functions.flatten_listings import NESTED_FIELDS
+from functions.listing_dtypes import apply_dtype_profile
+from functions.listing_snapshot import ListingSnapshot, item_content_hash
+from functions.schema_registry import STRING_COLUMNS
+
+# maximum number of items of one BatchWriteItem request
+BATCH_WRITE_SIZE = 25
+
+# errors after which a BatchWriteItem request is sent again
+RETRY_ERROR_CODES = (
+    "ProvisionedThroughputExceededException",
+    "ThrottlingException",
+    "RequestLimitExceeded",
+    "InternalServerError",
+)
+
+
+def _python_to_dynamodb(value):
+    """Function that converts a nested python value for TypeSerializer (floats to Decimal, NaN to None)."""
+    if isinstance(value, dict):
+        return {key: _python_to_dynamodb(nested_value) for key, nested_value in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_python_to_dynamodb(nested_value) for nested_value in value]
+    if isinstance(value, (float, np.floating)):
+        return Decimal(repr(float(value))) if math.isfinite(value) else None
+    if isinstance(value, np.integer):
+        return int(value)
+    if isinstance(value, np.bool_):
+        return bool(value)
+    return value
+
+
+def _parse_nested(value):
+    """Function that parses dicts and lists that were written to csv as their python repr."""
+    if isinstance(value, str) and value[:1] in ("{", "["):
+        try:
+            return ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            return value
+    return value
+
+
+def marshal_column(column: pd.Series) -> pd.Series:
+    """
+    Function that converts a column to DynamoDB attribute values of its native type:
+    numbers to N, flags to BOOL, dicts and lists (detailedType, suggestedTexts, ...) to M and L,
+    ids and text to S. The values are formatted for the whole column at once; missing values
+    and empty strings get None, so that the attribute is left out of the item.
+
+    Args:
+        column (pd.Series): Column of a listing dataframe.
+
+    Returns:
+        pd.Series: Attribute value (e.g. {"N": "1500.0"}) or None per row.
+    """
+    attributes = pd.Series(None, index=column.index, dtype=object)
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        column = column.astype(object)
+    values = column[column.notna()]
+    if values.dtype == object:
+        values = values[values != ""]
+    if len(values) == 0:
+        return attributes
+
+    kind = pd.api.types.infer_dtype(values, skipna=True)
+    if column.name in STRING_COLUMNS:
+        # ids that were read as floats (because of missing values) without ".0"
+        if pd.api.types.is_float_dtype(values.dtype) and (values % 1 == 0).all():
+            values = values.astype("int64")
+        formatted = [{"S": value} for value in values.astype(str)]
+    elif column.name in NESTED_FIELDS or kind == "mixed":
+        serializer = TypeSerializer()
+        formatted = [
+            serializer.serialize(_python_to_dynamodb(_parse_nested(value))) for value in values
+        ]
+    elif pd.api.types.is_bool_dtype(values.dtype) or kind == "boolean":
+        formatted = [{"BOOL": value} for value in values.astype(bool)]
+    elif pd.api.types.is_numeric_dtype(values.dtype) or kind in (
+        "integer",
+        "floating",
+        "mixed-integer-float",
+        "decimal",
+    ):
+        values = values[np.isfinite(values.astype("float64"))]
+        if pd.api.types.is_integer_dtype(values.dtype) or kind == "integer":
+            strings = values.astype("int64").astype(str)
+        else:
+            # shortest representation that reads back as the same number
+            strings = values.astype(str)
+        formatted = [{"N": value} for value in strings]
+    elif kind in ("datetime", "datetime64", "date"):
+        formatted = [{"S": value} for value in pd.to_datetime(values).map(pd.Timestamp.isoformat)]
+    else:
+        formatted = [{"S": value} for value in values.astype(str)]
+
+    attributes[values.index] = formatted
+    return attributes
+
+
+def marshal_dataframe(df: pd.DataFrame) -> list:
+    """
+    Function that converts the rows of a dataframe to DynamoDB items, column by column
+    (see marshal_column). Missing values are left out of the items.
+
+    Args:
+        df (pd.DataFrame): Rows that are written to the database.
+
+    Returns:
+        list: One item per row in DynamoDB JSON, e.g. {"price": {"N": "1500.0"}, ...}.
+    """
+    columns = list(df.columns)
+    df_attributes = pd.DataFrame(
+        {column: marshal_column(df[column]) for column in columns}, index=df.index
+    )
+    return [
+        {column: value for column, value in zip(columns, row) if isinstance(value, dict)}
+        for row in df_attributes.itertuples(index=False, name=None)
+    ]
+
+
+def _dynamodb_to_python(value):
+    """Function that converts a value of TypeDeserializer to plain python (Decimal to int or float)."""
+    if isinstance(value, dict):
+        return {key: _dynamodb_to_python(nested_value) for key, nested_value in value.items()}
+    if isinstance(value, (list, set)):
+        return [_dynamodb_to_python(nested_value) for nested_value in value]
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    return value
+
+
+def unmarshal_column(attributes: list) -> pd.Series:
+    """
+    Function that converts the attribute values of one attribute of a page of items to a column:
+    N to numbers (Int64 if all are integers), BOOL to nullable booleans, S to strings and
+    M and L to dicts and lists. The numbers of the whole column are parsed at once.
+
+    Args:
+        attributes (list): Attribute value (e.g. {"N": "1500.0"}) or None per item.
+
+    Returns:
+        pd.Series: Column of python values, missing attributes are missing values.
+    """
+    types = {next(iter(attribute)) for attribute in attributes if attribute is not None}
+    if types == {"N"}:
+        strings = pd.Series(
+            [attribute["N"] if attribute is not None else None for attribute in attributes],
+            dtype=object,
+        )
+        numbers = pd.to_numeric(strings)
+        if not strings.dropna().str.contains(r"[.eE]").any():
+            return numbers.astype("Int64")
+        return numbers.astype("float64")
+    if types == {"BOOL"}:
+        return pd.Series(
+            pd.array(
+                [attribute["BOOL"] if attribute is not None else None for attribute in attributes],
+                dtype="boolean",
+            )
+        )
+    if types <= {"S"}:
+        return pd.Series(
+            [attribute["S"] if attribute is not None else None for attribute in attributes],
+            dtype=object,
+        )
+    deserializer = TypeDeserializer()
+    return pd.Series(
+        [
+            _dynamodb_to_python(deserializer.deserialize(attribute)) if attribute is not None else None
+            for attribute in attributes
+        ],
+        dtype=object,
+    )
+
+
+def unmarshal_items(items: list, dtype_profile: bool = True) -> pd.DataFrame:
+    """
+    Function that converts a page of DynamoDB items to a dataframe, attribute by attribute
+    (see unmarshal_column). The columns are in the order in which they first appear.
+
+    Args:
+        items (list): Items in DynamoDB JSON, e.g. the Items of a Scan or Query response.
+        dtype_profile (bool, optional): Convert the columns to the compact dtypes of
+            LISTING_DTYPE_PROFILE. Defaults to True.
+
+    Returns:
+        pd.DataFrame: One row per item.
+    """
+    columns = list(dict.fromkeys(attribute for item in items for attribute in item))
+    df = pd.DataFrame(
+        {column: unmarshal_column([item.get(column) for item in items]) for column in columns},
+        index=pd.RangeIndex(len(items)),
+    )
+    return apply_dtype_profile(df) if dtype_profile else df
+
+
+def _projection_parameters(columns: list) -> dict:
+    """Function that builds a ProjectionExpression, with placeholders because e.g. size is a reserved word."""
+    if not columns:
+        return {}
+    return {
+        "ProjectionExpression": ", ".join("#p{}".format(number) for number in range(len(columns))),
+        "ExpressionAttributeNames": {
+            "#p{}".format(number): column for number, column in enumerate(columns)
+        },
+    }
+
+
+def _insert_date_condition(min_insert_date: str, max_insert_date: str) -> tuple:
+    """Function that builds the condition on insert_date of a date range, None if there are no dates."""
+    if min_insert_date and max_insert_date:
+        condition = "#insert_date BETWEEN :min_insert_date AND :max_insert_date"
+    elif min_insert_date:
+        condition = "#insert_date >= :min_insert_date"
+    elif max_insert_date:
+        condition = "#insert_date <= :max_insert_date"
+    else:
+        return None, {}, {}
+    values = {
+        ":" + name: {"S": value}
+        for name, value in [("min_insert_date", min_insert_date), ("max_insert_date", max_insert_date)]
+        if value
+    }
+    return condition, {"#insert_date": "insert_date"}, values
+
+
+# key designs of the table: "listing" spreads the writes over all listings (propertyCode as
+# hash key) and keeps one item per listing and day, so the price history of a listing is one
+# Query; its index district-insert_date-index serves queries by district and date.
+# "run" is the original design with one partition per day (insert_date, row number of the run).
+KEY_SCHEMAS = {
+    "listing": {
+        "KeySchema": [
+            {"AttributeName": "propertyCode", "KeyType": "HASH"},
+            {"AttributeName": "insert_date", "KeyType": "RANGE"},
+        ],
+        "AttributeDefinitions": [
+            {"AttributeName": "propertyCode", "AttributeType": "S"},
+            {"AttributeName": "insert_date", "AttributeType": "S"},
+            {"AttributeName": "district", "AttributeType": "S"},
+        ],
+        "GlobalSecondaryIndexes": [
+            {
+                "IndexName": "district-insert_date-index",
+                "KeySchema": [
+                    {"AttributeName": "district", "KeyType": "HASH"},
+                    {"AttributeName": "insert_date", "KeyType": "RANGE"},
+                ],
+                "Projection": {"ProjectionType": "ALL"},
+            }
+        ],
+    },
+    "run": {
+        "KeySchema": [
+            {"AttributeName": "insert_date", "KeyType": "HASH"},
+            {"AttributeName": "run", "KeyType": "RANGE"},
+        ],
+        "AttributeDefinitions": [
+            {"AttributeName": "insert_date", "AttributeType": "S"},
+            {"AttributeName": "run", "AttributeType": "N"},
+        ],
+        "GlobalSecondaryIndexes": [],
+    },
+}
 
 
 class DynamoDB_Helper:
-    def __init__(self):
+    def __init__(self, key_schema: str = "run"):
+        """
+        Args:
+            key_schema (str, optional): Key design of the table, a key of KEY_SCHEMAS. Defaults to "run"
+                (the design of the existing table).
+        """
+        if key_schema not in KEY_SCHEMAS:
+            raise ValueError(
+                "Unknown key schema {}, expected one of {}".format(key_schema, list(KEY_SCHEMAS))
+            )
+        self.key_schema = key_schema
         self.dynamodb_client = boto3.client("dynamodb")
         self.dynamodb_resource = boto3.resource("dynamodb")
 
@@ -45,48 +332,365 @@ class DynamoDB_Helper:
                 logging.info("Unexpected error: %s", e)
             return False
 
-    def create_table_NoSQL(self, table_name: str = "IdealistaDataMadrid") -> bool:
-        """Function that creates a new table in the NoSQL database.
+    def check_key_schema_NoSQL(self, table_name: str) -> None:
+        """Function that checks that an existing table has the key design of the helper.
+
+        Args:
+            table_name (str): Name of the table in the NoSQL database.
+
+        Raises:
+            ValueError: If the table is keyed differently, e.g. an existing "run" table
+                that is written with the "listing" key schema.
+        """
+        table_keys = {
+            (key["AttributeName"], key["KeyType"])
+            for key in self.dynamodb_client.describe_table(TableName=table_name)["Table"]["KeySchema"]
+        }
+        if table_keys == {
+            (key["AttributeName"], key["KeyType"]) for key in KEY_SCHEMAS[self.key_schema]["KeySchema"]
+        }:
+            return
+        matching_schemas = [
+            name
+            for name, schema in KEY_SCHEMAS.items()
+            if table_keys == {(key["AttributeName"], key["KeyType"]) for key in schema["KeySchema"]}
+        ]
+        raise ValueError(
+            "Table {} is keyed by {}, which does not match the key schema {}{}".format(
+                table_name,
+                sorted(table_keys, key=lambda key: key[1]),
+                self.key_schema,
+                ", use key_schema={}".format(matching_schemas[0]) if matching_schemas else "",
+            )
+        )
+
+    def create_table_NoSQL(
+        self,
+        table_name: str = "IdealistaDataMadrid",
+        billing_mode: str = "PAY_PER_REQUEST",
+        read_capacity: int = 5,
+        write_capacity: int = 5,
+        autoscaling: dict = None,
+    ) -> bool:
+        """Function that creates a new table in the NoSQL database with the key design of the helper.
 
         Args:
             table_name (str, optional): Name of the table that we want to write to the database. Defaults to "IdealistaDataMadrid".
+            billing_mode (str, optional): "PAY_PER_REQUEST" (on-demand capacity) or "PROVISIONED". Defaults to "PAY_PER_REQUEST".
+            read_capacity (int, optional): Provisioned read capacity units of the table and its indexes. Defaults to 5.
+            write_capacity (int, optional): Provisioned write capacity units of the table and its indexes. Defaults to 5.
+            autoscaling (dict, optional): Scale the provisioned capacity between min_capacity and max_capacity
+                to keep target_utilization (percent), e.g. {"min_capacity": 5, "max_capacity": 100,
+                "target_utilization": 70}. Defaults to None (fixed capacity).
 
         Returns:
-            bool: _description_
+            bool: True if the table was created, False if it failed and None if it already exists.
+
+        Raises:
+            ValueError: If the table already exists with another key design (see check_key_schema_NoSQL).
         """
         # check if a table with name table_name already exists in the database
         if self.check_if_table_exists_NoSQL(table_name=table_name):
             logging.info("Table %s already exists", table_name)
+            self.check_key_schema_NoSQL(table_name=table_name)
             return None
 
+        schema = KEY_SCHEMAS[self.key_schema]
+        key_attributes = {
+            key["AttributeName"]
+            for key_schema in [schema["KeySchema"]]
+            + [index["KeySchema"] for index in schema["GlobalSecondaryIndexes"]]
+            for key in key_schema
+        }
+        table_parameters = {
+            "TableName": table_name,
+            "KeySchema": schema["KeySchema"],
+            "AttributeDefinitions": [
+                definition
+                for definition in schema["AttributeDefinitions"]
+                if definition["AttributeName"] in key_attributes
+            ],
+            "BillingMode": billing_mode,
+        }
+        throughput = {"ReadCapacityUnits": read_capacity, "WriteCapacityUnits": write_capacity}
+        if schema["GlobalSecondaryIndexes"]:
+            table_parameters["GlobalSecondaryIndexes"] = [
+                {**index, "ProvisionedThroughput": throughput}
+                if billing_mode == "PROVISIONED"
+                else index
+                for index in schema["GlobalSecondaryIndexes"]
+            ]
+        if billing_mode == "PROVISIONED":
+            table_parameters["ProvisionedThroughput"] = throughput
+
         # Create table
         try:
-            self.dynamodb_client.create_table(
-                TableName=table_name,
-                KeySchema=[
-                    {"AttributeName": "insert_date", "KeyType": "HASH"},
-                    {"AttributeName": "run", "KeyType": "RANGE"},
-                ],
-                AttributeDefinitions=[
-                    {"AttributeName": "insert_date", "AttributeType": "S"},
-                    {"AttributeName": "run", "AttributeType": "N"},
-                ],
-                ProvisionedThroughput={
-                    "ReadCapacityUnits": 5,
-                    "WriteCapacityUnits": 5,
-                },
-            )
+            self.dynamodb_client.create_table(**table_parameters)
+            if billing_mode == "PROVISIONED" and autoscaling:
+                self.dynamodb_client.get_waiter("table_exists").wait(TableName=table_name)
+                self.enable_autoscaling_NoSQL(table_name=table_name, **autoscaling)
             logging.info("Table %s created successfully.", table_name)
             return True
         except ClientError as e:
-            logging.error("Failed to create table %s: %e", table_name, e)
+            logging.error("Failed to create table %s: %s", table_name, e)
             return False
 
-    def write_data_to_NoSQL(self, df: pd.DataFrame):
+    def enable_autoscaling_NoSQL(
+        self,
+        table_name: str = "IdealistaDataMadrid",
+        min_capacity: int = 5,
+        max_capacity: int = 100,
+        target_utilization: float = 70,
+    ) -> None:
+        """Function that lets AWS Application Auto Scaling adjust the provisioned read and write
+        capacity of a table and its global secondary indexes.
+
+        Args:
+            table_name (str, optional): Name of the table. Defaults to "IdealistaDataMadrid".
+            min_capacity (int, optional): Minimum capacity units. Defaults to 5.
+            max_capacity (int, optional): Maximum capacity units. Defaults to 100.
+            target_utilization (float, optional): Utilization (percent) that is kept. Defaults to 70.
+        """
+        autoscaling_client = boto3.client("application-autoscaling")
+        resources = [("table", "table/" + table_name)] + [
+            ("index", "table/{}/index/{}".format(table_name, index["IndexName"]))
+            for index in KEY_SCHEMAS[self.key_schema]["GlobalSecondaryIndexes"]
+        ]
+        for resource_type, resource_id in resources:
+            for capacity, metric in [
+                ("ReadCapacityUnits", "DynamoDBReadCapacityUtilization"),
+                ("WriteCapacityUnits", "DynamoDBWriteCapacityUtilization"),
+            ]:
+                dimension = "dynamodb:{}:{}".format(resource_type, capacity)
+                autoscaling_client.register_scalable_target(
+                    ServiceNamespace="dynamodb",
+                    ResourceId=resource_id,
+                    ScalableDimension=dimension,
+                    MinCapacity=min_capacity,
+                    MaxCapacity=max_capacity,
+                )
+                autoscaling_client.put_scaling_policy(
+                    PolicyName="{}-{}".format(resource_id.replace("/", "-"), metric),
+                    ServiceNamespace="dynamodb",
+                    ResourceId=resource_id,
+                    ScalableDimension=dimension,
+                    PolicyType="TargetTrackingScaling",
+                    TargetTrackingScalingPolicyConfiguration={
+                        "TargetValue": target_utilization,
+                        "PredefinedMetricSpecification": {"PredefinedMetricType": metric},
+                    },
+                )
+        logging.info("Auto scaling enabled for table %s.", table_name)
+
+    def _write_batches(
+        self,
+        table_name: str,
+        batches: list,
+        max_retries: int,
+        backoff_base: float,
+        backoff_max: float,
+    ) -> tuple:
+        """
+        Function that sends batches of items with BatchWriteItem on its own client.
+        Items that DynamoDB does not process (UnprocessedItems, e.g. when the table is throttled)
+        and throttled requests are sent again after a jittered exponential backoff.
+
+        Args:
+            table_name (str): Name of the table.
+            batches (list): Lists of at most BATCH_WRITE_SIZE items in DynamoDB JSON.
+            max_retries (int): Retries per batch.
+            backoff_base (float): Seconds of the first backoff.
+            backoff_max (float): Maximum seconds between two attempts.
+
+        Returns:
+            tuple: Number of written and failed items.
+        """
+        # clients of the default session must not be created by several threads at once
+        dynamodb_client = boto3.session.Session().client("dynamodb")
+        written, failed = 0, 0
+        for batch in batches:
+            requests = [{"PutRequest": {"Item": item}} for item in batch]
+            for attempt in range(max_retries + 1):
+                try:
+                    response = dynamodb_client.batch_write_item(
+                        RequestItems={table_name: requests}
+                    )
+                except ClientError as e:
+                    if e.response["Error"]["Code"] not in RETRY_ERROR_CODES:
+                        logging.error("Failed to write %d records: %s", len(requests), e)
+                        break
+                else:
+                    unprocessed = response.get("UnprocessedItems", {}).get(table_name, [])
+                    written += len(requests) - len(unprocessed)
+                    requests = unprocessed
+                    if not requests:
+                        break
+                if attempt < max_retries:
+                    time.sleep(random.uniform(0, min(backoff_max, backoff_base * 2**attempt)))
+            failed += len(requests)
+        return written, failed
+
+    def _put_items(
+        self,
+        table_name: str,
+        items: list,
+        max_retries: int,
+        backoff_base: float,
+        backoff_max: float,
+    ) -> list:
+        """
+        Function that writes items one by one with conditional PutItem requests on its own client.
+        An item is only put if the table has no item with the same key and content_hash, so a
+        retried put of an item that was already written changes nothing. Throttled requests are
+        sent again after a jittered exponential backoff.
+
+        Args:
+            table_name (str): Name of the table.
+            items (list): Items in DynamoDB JSON with a content_hash attribute.
+            max_retries (int): Retries per item.
+            backoff_base (float): Seconds of the first backoff.
+            backoff_max (float): Maximum seconds between two attempts.
+
+        Returns:
+            list: "written", "unchanged" (already in the table) or "failed" per item.
+        """
+        dynamodb_client = boto3.session.Session().client("dynamodb")
+        results = []
+        for item in items:
+            result = "failed"
+            for attempt in range(max_retries + 1):
+                try:
+                    dynamodb_client.put_item(
+                        TableName=table_name,
+                        Item=item,
+                        ConditionExpression="attribute_not_exists(content_hash) OR content_hash <> :content_hash",
+                        ExpressionAttributeValues={":content_hash": item["content_hash"]},
+                    )
+                    result = "written"
+                    break
+                except ClientError as e:
+                    if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+                        result = "unchanged"
+                        break
+                    if e.response["Error"]["Code"] not in RETRY_ERROR_CODES:
+                        logging.error("Failed to write record: %s", e)
+                        break
+                if attempt < max_retries:
+                    time.sleep(random.uniform(0, min(backoff_max, backoff_base * 2**attempt)))
+            results.append(result)
+        return results
+
+    def put_items_conditionally(
+        self,
+        items: list,
+        table_name: str = "IdealistaDataMadrid",
+        max_workers: int = 4,
+        max_retries: int = 8,
+        backoff_base: float = 0.1,
+        backoff_max: float = 10,
+    ) -> list:
+        """
+        Function that writes items with conditional puts (see _put_items), split across
+        max_workers threads with one client each. BatchWriteItem does not support conditions.
+
+        Args:
+            items (list): Items in DynamoDB JSON with a content_hash attribute.
+            table_name (str, optional): Name of the table. Defaults to "IdealistaDataMadrid".
+            max_workers (int, optional): Number of threads. Defaults to 4.
+            max_retries (int, optional): Retries per item. Defaults to 8.
+            backoff_base (float, optional): Seconds of the first backoff. Defaults to 0.1.
+            backoff_max (float, optional): Maximum seconds between two attempts. Defaults to 10.
+
+        Returns:
+            list: "written", "unchanged" or "failed" per item, in the order of items.
+        """
+        if not items:
+            return []
+        max_workers = min(max_workers, len(items))
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            worker_results = list(
+                executor.map(
+                    lambda worker: self._put_items(
+                        table_name,
+                        items[worker::max_workers],
+                        max_retries,
+                        backoff_base,
+                        backoff_max,
+                    ),
+                    range(max_workers),
+                )
+            )
+
+        results = [None] * len(items)
+        for worker, worker_result in enumerate(worker_results):
+            results[worker::max_workers] = worker_result
+        return results
+
+    def batch_write_items(
+        self,
+        items: list,
+        table_name: str = "IdealistaDataMadrid",
+        max_workers: int = 4,
+        max_retries: int = 8,
+        backoff_base: float = 0.1,
+        backoff_max: float = 10,
+    ) -> tuple:
+        """
+        Function that writes items with BatchWriteItem requests of BATCH_WRITE_SIZE items,
+        split across max_workers threads with one client each.
+
+        Args:
+            items (list): Items in DynamoDB JSON (see marshal_dataframe).
+            table_name (str, optional): Name of the table. Defaults to "IdealistaDataMadrid".
+            max_workers (int, optional): Number of threads. Defaults to 4.
+            max_retries (int, optional): Retries per batch (throttling, UnprocessedItems). Defaults to 8.
+            backoff_base (float, optional): Seconds of the first backoff. Defaults to 0.1.
+            backoff_max (float, optional): Maximum seconds between two attempts. Defaults to 10.
+
+        Returns:
+            tuple: Number of items that were written and that failed.
+        """
+        batches = [
+            items[start : start + BATCH_WRITE_SIZE]
+            for start in range(0, len(items), BATCH_WRITE_SIZE)
+        ]
+        if not batches:
+            return 0, 0
+        max_workers = min(max_workers, len(batches))
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = list(
+                executor.map(
+                    lambda worker: self._write_batches(
+                        table_name,
+                        batches[worker::max_workers],
+                        max_retries,
+                        backoff_base,
+                        backoff_max,
+                    ),
+                    range(max_workers),
+                )
+            )
+
+        return sum(result[0] for result in results), sum(result[1] for result in results)
+
+    def write_data_to_NoSQL(
+        self,
+        df: pd.DataFrame,
+        max_workers: int = 4,
+        snapshot: ListingSnapshot = None,
+        table_name: str = "IdealistaDataMadrid",
+    ):
         """Function that writes data from the idealista API to a table in aws dynamoDB.
 
         Args:
             df (pd.DataFrame): data that is written to the database
+            max_workers (int, optional): Number of threads that write at the same time. Defaults to 4.
+            snapshot (ListingSnapshot, optional): If set, only listings that are new or changed since
+                they were last written are written, with conditional puts, and the snapshot is
+                updated. Defaults to None (all listings are written).
+            table_name (str, optional): Name of the table. Defaults to "IdealistaDataMadrid".
         """
         # check that AWS credentials are set as environment variables
         AWS_ACCESS_KEY_ID = os.getenv("AWS_ACCESS_KEY_ID")
@@ -100,30 +704,285 @@ class DynamoDB_Helper:
                 "AWS credentials are not fully set. Please ensure AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, and AWS_DEFAULT_REGION are properly configured."
             )
 
-        # convert all columns to type string because dynamoDB cannot handle floats
         df_write = df.copy(deep=True)
         df_write.reset_index(inplace=True)
-        df_write = df_write.astype("str")
 
-        # set the sort key
+        # set the sort key (observation date, and row number of the run for the "run" key design)
+        if "insert_date" not in df_write.columns:
+            df_write["insert_date"] = datetime.today().strftime("%Y-%m-%d")
         df_write["run"] = df_write.index
 
-        # write each row as one record to the database
-        records = df_write.to_dict(orient="records")
-        table = self.dynamodb_resource.Table("IdealistaDataMadrid")
-        success_count = 0
-        error_count = 0
+        # write each row as one record to the database, with numbers, flags and nested
+        # fields as native DynamoDB types; counts are the items DynamoDB confirmed, failed
+        # items are the ones that were still unprocessed after all retries
+        items = marshal_dataframe(df_write)
 
-        with table.batch_writer() as batch:
-            for record in records:
-                try:
-                    batch.put_item(Item=record)
-                    success_count += 1
-                except ClientError as e:
-                    print("Failed to write record to DynamoDB: e", e)
-                    error_count += 1
+        # items need the key attributes and one request must not contain a key twice,
+        # e.g. a listing returned by two queries with different prices (the last one is kept)
+        key_attributes = [
+            key["AttributeName"] for key in KEY_SCHEMAS[self.key_schema]["KeySchema"]
+        ]
+        items_by_key = {}
+        for item in items:
+            if all(attribute in item for attribute in key_attributes):
+                items_by_key[
+                    tuple(next(iter(item[attribute].values())) for attribute in key_attributes)
+                ] = item
+        if len(items_by_key) < len(items):
+            print(
+                len(items) - len(items_by_key),
+                "record(s) without or with the same key {} were not written".format(key_attributes),
+            )
+        items = list(items_by_key.values())
+
+        if snapshot is None:
+            success_count, error_count = self.batch_write_items(
+                items, table_name=table_name, max_workers=max_workers
+            )
+        else:
+            for item in items:
+                item["content_hash"] = {"S": item_content_hash(item)}
+            changed_items = [
+                item
+                for item in items
+                if snapshot.is_changed(item["propertyCode"]["S"], item["content_hash"]["S"])
+            ]
+            print(len(items) - len(changed_items), "unchanged record(s) were not written")
+            results = self.put_items_conditionally(
+                changed_items, table_name=table_name, max_workers=max_workers
+            )
+            # listings that are already in the table (e.g. written by a failed run) count as written
+            snapshot.update(
+                {
+                    item["propertyCode"]["S"]: item["content_hash"]["S"]
+                    for item, result in zip(changed_items, results)
+                    if result != "failed"
+                }
+            )
+            success_count = results.count("written") + results.count("unchanged")
+            error_count = results.count("failed")
 
         print(f"Total records written: {success_count}")
         print(f"Total records failed: {error_count}")
 
         return df_write
+
+    def _to_page(self, items: list, dtype_profile: bool, as_arrow: bool):
+        df = unmarshal_items(items, dtype_profile=dtype_profile)
+        return pa.Table.from_pandas(df, preserve_index=False) if as_arrow else df
+
+    def iter_scan_NoSQL(
+        self,
+        table_name: str = "IdealistaDataMadrid",
+        total_segments: int = 4,
+        columns: list = None,
+        min_insert_date: str = None,
+        max_insert_date: str = None,
+        page_size: int = None,
+        dtype_profile: bool = True,
+        as_arrow: bool = False,
+    ):
+        """
+        Generator that reads a table with a parallel Scan: the table is split into total_segments
+        segments that are scanned at the same time, each by a thread with its own client.
+        Every page is converted to a dataframe as soon as it arrives, so the items of the
+        whole table are never held as one list of dicts.
+
+        Args:
+            table_name (str, optional): Name of the table. Defaults to "IdealistaDataMadrid".
+            total_segments (int, optional): Number of segments (and threads). Defaults to 4.
+            columns (list, optional): Attributes that are read. Defaults to None (all attributes).
+            min_insert_date (str, optional): Only items with insert_date on or after (YYYY-MM-DD).
+            max_insert_date (str, optional): Only items with insert_date on or before (YYYY-MM-DD).
+            page_size (int, optional): Maximum number of items per page. Defaults to None (1 MB pages).
+            dtype_profile (bool, optional): Convert the columns to the compact dtypes of
+                LISTING_DTYPE_PROFILE. Defaults to True.
+            as_arrow (bool, optional): Yield pyarrow tables instead of dataframes. Defaults to False.
+
+        Yields:
+            pd.DataFrame: Items of one page (pa.Table if as_arrow is True), pages of the segments
+                in the order in which they arrive.
+        """
+        parameters = {"TableName": table_name, "TotalSegments": total_segments}
+        projection = _projection_parameters(columns)
+        condition, names, values = _insert_date_condition(min_insert_date, max_insert_date)
+        if projection or condition:
+            parameters["ExpressionAttributeNames"] = {
+                **projection.get("ExpressionAttributeNames", {}),
+                **names,
+            }
+        if projection:
+            parameters["ProjectionExpression"] = projection["ProjectionExpression"]
+        if condition:
+            parameters["FilterExpression"] = condition
+            parameters["ExpressionAttributeValues"] = values
+        if page_size:
+            parameters["Limit"] = page_size
+
+        # a few pages per segment are buffered, the threads wait while the consumer is behind
+        pages = queue.Queue(maxsize=2 * total_segments)
+        stop = threading.Event()
+        segment_done = object()
+
+        def put(page) -> None:
+            while not stop.is_set():
+                try:
+                    pages.put(page, timeout=0.1)
+                    return
+                except queue.Full:
+                    pass
+
+        def scan_segment(segment: int) -> None:
+            try:
+                dynamodb_client = boto3.session.Session().client("dynamodb")
+                segment_parameters = {**parameters, "Segment": segment}
+                while not stop.is_set():
+                    response = dynamodb_client.scan(**segment_parameters)
+                    put(response["Items"])
+                    if "LastEvaluatedKey" not in response:
+                        break
+                    segment_parameters["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+            finally:
+                put(segment_done)
+
+        executor = ThreadPoolExecutor(max_workers=total_segments)
+        futures = [executor.submit(scan_segment, segment) for segment in range(total_segments)]
+        try:
+            finished = 0
+            while finished < total_segments:
+                page = pages.get()
+                if page is segment_done:
+                    finished += 1
+                elif page:
+                    yield self._to_page(page, dtype_profile, as_arrow)
+            for future in futures:
+                # errors of the segments
+                future.result()
+        finally:
+            stop.set()
+            executor.shutdown(wait=True)
+
+    def iter_query_NoSQL(
+        self,
+        propertyCode: str = None,
+        district: str = None,
+        min_insert_date: str = None,
+        max_insert_date: str = None,
+        table_name: str = "IdealistaDataMadrid",
+        columns: list = None,
+        dtype_profile: bool = True,
+        as_arrow: bool = False,
+    ):
+        """
+        Generator that reads the items of a listing, of a district or of a date range with Query,
+        page by page. With the "listing" key design, a listing is read from the table and a
+        district from district-insert_date-index, both optionally within a date range; a date range
+        alone is read with a filtered parallel Scan. With the "run" key design, every day of the
+        date range is one Query.
+
+        Args:
+            propertyCode (str, optional): Code of the listing.
+            district (str, optional): District, e.g. "Centro".
+            min_insert_date (str, optional): First insert_date (YYYY-MM-DD).
+            max_insert_date (str, optional): Last insert_date (YYYY-MM-DD).
+            table_name (str, optional): Name of the table. Defaults to "IdealistaDataMadrid".
+            columns (list, optional): Attributes that are read. Defaults to None (all attributes).
+            dtype_profile (bool, optional): Convert the columns to the compact dtypes of
+                LISTING_DTYPE_PROFILE. Defaults to True.
+            as_arrow (bool, optional): Yield pyarrow tables instead of dataframes. Defaults to False.
+
+        Yields:
+            pd.DataFrame: Items of one page (pa.Table if as_arrow is True).
+        """
+        projection = _projection_parameters(columns)
+        condition, names, values = _insert_date_condition(min_insert_date, max_insert_date)
+
+        if self.key_schema == "run":
+            if propertyCode is not None or district is not None or not (min_insert_date and max_insert_date):
+                raise ValueError(
+                    'Tables with the "run" key design can only be queried by min_insert_date and max_insert_date'
+                )
+            queries = [
+                ("#insert_date = :insert_date", {":insert_date": {"S": day.strftime("%Y-%m-%d")}}, None)
+                for day in pd.date_range(min_insert_date, max_insert_date)
+            ]
+            names = {"#insert_date": "insert_date"}
+        elif propertyCode is not None:
+            queries = [
+                (
+                    " AND ".join(filter(None, ["#propertyCode = :propertyCode", condition])),
+                    {":propertyCode": {"S": str(propertyCode)}, **values},
+                    None,
+                )
+            ]
+            names = {**names, "#propertyCode": "propertyCode"}
+        elif district is not None:
+            queries = [
+                (
+                    " AND ".join(filter(None, ["#district = :district", condition])),
+                    {":district": {"S": district}, **values},
+                    KEY_SCHEMAS["listing"]["GlobalSecondaryIndexes"][0]["IndexName"],
+                )
+            ]
+            names = {**names, "#district": "district"}
+        elif condition:
+            yield from self.iter_scan_NoSQL(
+                table_name=table_name,
+                columns=columns,
+                min_insert_date=min_insert_date,
+                max_insert_date=max_insert_date,
+                dtype_profile=dtype_profile,
+                as_arrow=as_arrow,
+            )
+            return
+        else:
+            raise ValueError("Query needs a propertyCode, a district or an insert_date range")
+
+        dynamodb_client = boto3.session.Session().client("dynamodb")
+        for key_condition, key_values, index_name in queries:
+            parameters = {
+                "TableName": table_name,
+                "KeyConditionExpression": key_condition,
+                "ExpressionAttributeNames": {
+                    **projection.get("ExpressionAttributeNames", {}),
+                    **names,
+                },
+                "ExpressionAttributeValues": key_values,
+            }
+            if index_name:
+                parameters["IndexName"] = index_name
+            if projection:
+                parameters["ProjectionExpression"] = projection["ProjectionExpression"]
+            while True:
+                response = dynamodb_client.query(**parameters)
+                if response["Items"]:
+                    yield self._to_page(response["Items"], dtype_profile, as_arrow)
+                if "LastEvaluatedKey" not in response:
+                    break
+                parameters["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+    def read_data_from_NoSQL(self, dtype_profile: bool = True, **filters) -> pd.DataFrame:
+        """
+        Function that reads items into one dataframe, with Query if filters are given
+        (see iter_query_NoSQL) and with a parallel Scan of the whole table otherwise.
+
+        Args:
+            dtype_profile (bool, optional): Convert the columns to the compact dtypes of
+                LISTING_DTYPE_PROFILE. Defaults to True.
+            **filters: Arguments of iter_query_NoSQL, e.g. propertyCode, district,
+                min_insert_date, max_insert_date, columns or table_name.
+
+        Returns:
+            pd.DataFrame: All items that were read.
+        """
+        query_filters = ["propertyCode", "district", "min_insert_date", "max_insert_date"]
+        if any(filters.get(name) is not None for name in query_filters):
+            pages = self.iter_query_NoSQL(dtype_profile=False, **filters)
+        else:
+            pages = self.iter_scan_NoSQL(dtype_profile=False, **filters)
+        df_pages = list(pages)
+        if not df_pages:
+            return pd.DataFrame(columns=filters.get("columns"))
+        # the columns of the pages are only converted once, categories of pages differ
+        df = pd.concat(df_pages, ignore_index=True)
+        return apply_dtype_profile(df) if dtype_profile else df
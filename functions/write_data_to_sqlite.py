@@ -0,0 +1,340 @@
+from global_variables import DATA_DIRECTORY
+
+import argparse
+import json
+import os
+import sqlite3
+import threading
+import pandas as pd
+
+from functions.save_data_to_csv import iter_idealista_data
+from functions.schema_registry import SchemaRegistry, STRING_COLUMNS
+
+# one row per listing and day: a listing that is retrieved again on the same day is updated
+PRIMARY_KEY_COLUMNS = ["propertyCode", "insert_date"]
+
+# columns that are indexed; the table is created with them, all other columns are added
+# when a dataframe has them for the first time
+INDEXED_COLUMNS = {
+    "propertyCode": "TEXT NOT NULL",
+    "insert_date": "TEXT NOT NULL",
+    "district": "TEXT",
+    "neighborhood": "TEXT",
+    "priceByArea": "REAL",
+}
+
+# the primary key (propertyCode, insert_date) is the index of propertyCode
+INDEXES = {
+    "idx_listings_insert_date": ["insert_date"],
+    "idx_listings_district_neighborhood": ["district", "neighborhood", "priceByArea"],
+    "idx_listings_price_by_area": ["priceByArea"],
+}
+
+
+def sqlite_type(dtype) -> str:
+    """
+    Function that returns the SQLite column type for a pandas dtype.
+
+    Args:
+        dtype: pandas dtype of the column.
+
+    Returns:
+        str: "INTEGER" for booleans and integers, "REAL" for floats, "TEXT" otherwise.
+    """
+    if pd.api.types.is_bool_dtype(dtype) or pd.api.types.is_integer_dtype(dtype):
+        return "INTEGER"
+    if pd.api.types.is_float_dtype(dtype):
+        return "REAL"
+    return "TEXT"
+
+
+def sqlite_value(value, as_string: bool = False):
+    """
+    Function that converts a value of an object column to a value SQLite can store.
+
+    Args:
+        value: Value of the column.
+        as_string (bool, optional): Store values that are not missing as strings (ids). Defaults to False.
+
+    Returns:
+        Dicts and lists as json, the value as string if as_string, the value itself otherwise.
+    """
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False)
+    if as_string and not pd.isna(value):
+        return str(value)
+    return value
+
+
+class SQLiteListingStore:
+    """
+    Local SQLite database with one row per listing and insert_date, indexed on propertyCode,
+    insert_date, district/neighborhood and priceByArea, so that questions like the price
+    history of a listing or the cheap flats of a district do not require reading the csv.
+    """
+
+    def __init__(
+        self,
+        db_file: str = os.path.join(DATA_DIRECTORY, "idealista_data.sqlite"),
+        table_name: str = "listings",
+    ):
+        """
+        Args:
+            db_file (str, optional): SQLite database file. Defaults to DATA_DIRECTORY/idealista_data.sqlite.
+            table_name (str, optional): Name of the table of the listings. Defaults to "listings".
+        """
+        if db_file != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(db_file)), exist_ok=True)
+        self.db_file = db_file
+        self.table_name = table_name
+        self.connection = sqlite3.connect(db_file, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS "{}" ({}, PRIMARY KEY ({}))'.format(
+                    table_name,
+                    ", ".join('"{}" {}'.format(column, type_) for column, type_ in INDEXED_COLUMNS.items()),
+                    ", ".join('"{}"'.format(column) for column in PRIMARY_KEY_COLUMNS),
+                )
+            )
+            for index_name, index_columns in INDEXES.items():
+                self.connection.execute(
+                    'CREATE INDEX IF NOT EXISTS "{}" ON "{}" ({})'.format(
+                        index_name,
+                        table_name,
+                        ", ".join('"{}"'.format(column) for column in index_columns),
+                    )
+                )
+
+    @property
+    def columns(self) -> list:
+        """Columns of the table."""
+        return [
+            row[1]
+            for row in self.connection.execute('PRAGMA table_info("{}")'.format(self.table_name))
+        ]
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def __len__(self) -> int:
+        return self.connection.execute('SELECT COUNT(*) FROM "{}"'.format(self.table_name)).fetchone()[0]
+
+    def upsert(self, df: pd.DataFrame) -> int:
+        """
+        Function that inserts the listings of a dataframe, or updates them if the table already has
+        a row with the same propertyCode and insert_date. Columns that the table does not have yet are added.
+
+        Args:
+            df (pd.DataFrame): Listings with the columns propertyCode and insert_date.
+
+        Returns:
+            int: Number of rows that were written.
+        """
+        missing_columns = [column for column in PRIMARY_KEY_COLUMNS if column not in df.columns]
+        if missing_columns:
+            raise ValueError("Listings without column(s) {} cannot be stored".format(missing_columns))
+        if len(df) == 0:
+            return 0
+
+        # ids as strings, dicts and lists as json, missing values as NULL
+        df_write = df.astype(
+            {
+                column: object
+                for column in df.columns
+                if column in STRING_COLUMNS or df[column].dtype == "category"
+            }
+        )
+        for column in df_write.columns[df_write.dtypes == object]:
+            df_write[column] = df_write[column].apply(
+                sqlite_value, args=(column in STRING_COLUMNS,)
+            )
+        df_write = df_write.astype(object).where(df_write.notna(), None)
+
+        columns = list(df_write.columns)
+        quoted_columns = ", ".join('"{}"'.format(column) for column in columns)
+        with self._lock, self.connection:
+            existing_columns = self.columns
+            for column in columns:
+                if column not in existing_columns:
+                    self.connection.execute(
+                        'ALTER TABLE "{}" ADD COLUMN "{}" {}'.format(
+                            self.table_name, column, sqlite_type(df[column].dtype)
+                        )
+                    )
+            updated_columns = [column for column in columns if column not in PRIMARY_KEY_COLUMNS]
+            self.connection.executemany(
+                'INSERT INTO "{}" ({}) VALUES ({}) ON CONFLICT ({}) DO {}'.format(
+                    self.table_name,
+                    quoted_columns,
+                    ", ".join("?" for _ in columns),
+                    ", ".join('"{}"'.format(column) for column in PRIMARY_KEY_COLUMNS),
+                    "UPDATE SET "
+                    + ", ".join('"{0}" = excluded."{0}"'.format(column) for column in updated_columns)
+                    if updated_columns
+                    else "NOTHING",
+                ),
+                df_write.itertuples(index=False, name=None),
+            )
+        print(len(df_write), "lines written to", self.db_file)
+
+        return len(df_write)
+
+    def query(self, sql: str, params=()) -> pd.DataFrame:
+        """
+        Function that runs a SELECT statement on the database.
+
+        Args:
+            sql (str): SQL statement, e.g. 'SELECT * FROM listings WHERE district = ?'.
+            params (optional): Values of the placeholders. Defaults to ().
+
+        Returns:
+            pd.DataFrame: Result of the statement.
+        """
+        return pd.read_sql_query(sql, self.connection, params=params)
+
+    def query_listings(
+        self,
+        propertyCode: str = None,
+        district: str = None,
+        neighborhood: str = None,
+        max_price_by_area: float = None,
+        min_insert_date: str = None,
+        max_insert_date: str = None,
+        columns: list = None,
+        order_by: str = None,
+        limit: int = None,
+    ) -> pd.DataFrame:
+        """
+        Function that returns the listings that match all given filters (filters that are None are ignored).
+
+        Args:
+            propertyCode (str, optional): Code of the listing.
+            district (str, optional): District, e.g. "Centro".
+            neighborhood (str, optional): Neighborhood, e.g. "Lavapiés-Embajadores".
+            max_price_by_area (float, optional): Maximum rent per m2.
+            min_insert_date (str, optional): First insert_date (YYYY-MM-DD).
+            max_insert_date (str, optional): Last insert_date (YYYY-MM-DD).
+            columns (list, optional): Columns that are returned. Defaults to None (all columns).
+            order_by (str, optional): Column the rows are sorted by. Defaults to None.
+            limit (int, optional): Maximum number of rows. Defaults to None.
+
+        Returns:
+            pd.DataFrame: Matching listings.
+        """
+        filters = [
+            ('"propertyCode" = ?', None if propertyCode is None else str(propertyCode)),
+            ('"district" = ?', district),
+            ('"neighborhood" = ?', neighborhood),
+            ('"priceByArea" <= ?', max_price_by_area),
+            ('"insert_date" >= ?', min_insert_date),
+            ('"insert_date" <= ?', max_insert_date),
+        ]
+        filters = [(condition, value) for condition, value in filters if value is not None]
+        existing_columns = self.columns
+        for column in (columns or []) + ([order_by] if order_by else []):
+            if column not in existing_columns:
+                raise ValueError("Unknown column {} in table {}".format(column, self.table_name))
+
+        sql = 'SELECT {} FROM "{}"'.format(
+            ", ".join('"{}"'.format(column) for column in columns) if columns else "*",
+            self.table_name,
+        )
+        if filters:
+            sql += " WHERE " + " AND ".join(condition for condition, _ in filters)
+        if order_by:
+            sql += ' ORDER BY "{}"'.format(order_by)
+        if limit is not None:
+            sql += " LIMIT {:d}".format(limit)
+
+        return self.query(sql, [value for _, value in filters])
+
+    def price_history(self, propertyCode: str) -> pd.DataFrame:
+        """
+        Function that returns the price of a listing on every day it was stored.
+
+        Args:
+            propertyCode (str): Code of the listing.
+
+        Returns:
+            pd.DataFrame: Columns insert_date, price, size and priceByArea, sorted by insert_date.
+        """
+        return self.query_listings(
+            propertyCode=propertyCode,
+            columns=[
+                column
+                for column in ["insert_date", "price", "size", "priceByArea"]
+                if column in self.columns
+            ],
+            order_by="insert_date",
+        )
+
+    def cheap_listings(self, district: str, max_price_by_area: float, **filters) -> pd.DataFrame:
+        """
+        Function that returns the listings of a district with a rent per m2 of at most max_price_by_area,
+        cheapest first.
+
+        Args:
+            district (str): District, e.g. "Centro".
+            max_price_by_area (float): Maximum rent per m2.
+            **filters: Other arguments of query_listings, e.g. neighborhood or min_insert_date.
+
+        Returns:
+            pd.DataFrame: Matching listings.
+        """
+        return self.query_listings(
+            district=district, max_price_by_area=max_price_by_area, order_by="priceByArea", **filters
+        )
+
+
+def load_idealista_data_to_sqlite(
+    store: SQLiteListingStore,
+    file_name: str = "idealista_data.csv",
+    data_dir: str = DATA_DIRECTORY,
+    schema_registry: SchemaRegistry = None,
+    chunksize: int = 100000,
+) -> int:
+    """
+    Function that writes the listing history from csv to the database in chunks, e.g. to fill a new database.
+
+    Args:
+        store (SQLiteListingStore): Database the listings are written to.
+        file_name (str, optional): Csv file with listings (ignored if schema_registry is set). Defaults to "idealista_data.csv".
+        data_dir (str, optional): Directory of the files. Defaults to DATA_DIRECTORY.
+        schema_registry (SchemaRegistry, optional): Registry of the partitions of the history. Defaults to None.
+        chunksize (int, optional): Number of rows that are read at once. Defaults to 100000.
+
+    Returns:
+        int: Number of rows that were written.
+    """
+    return sum(
+        store.upsert(df_chunk)
+        for df_chunk in iter_idealista_data(
+            chunksize=chunksize,
+            file_name=file_name,
+            data_dir=data_dir,
+            schema_registry=schema_registry,
+        )
+    )
+
+
+def main() -> None:
+    """Function that loads the csv history into the database and prints its size."""
+    # python -m functions.write_data_to_sqlite --load
+    parser = argparse.ArgumentParser(description="Local SQLite database of the listings.")
+    parser.add_argument("--load", action="store_true", help="write the csv history to the database")
+    parser.add_argument("--data-dir", default=DATA_DIRECTORY)
+    args = parser.parse_args()
+
+    store = SQLiteListingStore(os.path.join(args.data_dir, "idealista_data.sqlite"))
+    if args.load:
+        schema_registry = SchemaRegistry(os.path.join(args.data_dir, "idealista_data_schema.json"))
+        schema_registry.discover(file_name="idealista_data.csv", data_dir=args.data_dir)
+        load_idealista_data_to_sqlite(store, data_dir=args.data_dir, schema_registry=schema_registry)
+    print(len(store), "rows in", store.db_file)
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
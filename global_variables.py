@@ -1,4 +1,6 @@
 import os
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DATA_DIRECTORY = os.path.join(BASE_DIR, "data/")
+# IDEALISTA_DATA_DIRECTORY points a run to another data directory (e.g. against the API stand-in)
+DATA_DIRECTORY = os.getenv("IDEALISTA_DATA_DIRECTORY", os.path.join(BASE_DIR, "data/"))
 TEST_DATA_DIRECTORY = os.path.join(BASE_DIR, "tests/test_data/")
+QUERY_JOBS_FILE = os.path.join(BASE_DIR, "query_jobs.yaml")
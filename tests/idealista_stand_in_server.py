@@ -0,0 +1,437 @@
+"""Local stand-in for the idealista API (/oauth/token and /3.5/es/search) for load tests and benchmarks.
+
+Start it on its own and point the pipeline to it:
+    python -m tests.idealista_stand_in_server --port 8000 --listings 50000 --latency 0.2
+    IDEALISTA_API_URL=http://127.0.0.1:8000 IDEALISTA_DATA_DIRECTORY=/tmp/idealista_stand_in/ \
+        IDEALISTA_NOSQL=False python __main__.py
+
+IDEALISTA_DATA_DIRECTORY and IDEALISTA_NOSQL=False keep the fake listings out of data/ and DynamoDB.
+
+or benchmark the concurrent page retrieval against it:
+    python -m tests.idealista_stand_in_server --benchmark --listings 50000 --latency 0.2 --workers 16
+"""
+
+import argparse
+import json
+import math
+import random
+import threading
+import time
+import urllib.parse
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from functions.idealista_client import IdealistaClient
+from functions.get_bearer_access_token import request_bearer_access_token
+from functions.request_scheduler import RequestScheduler, TokenBucketRateLimiter
+from functions.retrieve_data_from_idealista import retrieve_all_pages_from_idealista
+
+CENTER = (40.416944, -3.703333)
+DISTRICTS = {
+    "Centro": ["Malasaña-Universidad", "Lavapiés-Embajadores", "Sol", "Palacio", "Cortes"],
+    "Salamanca": ["Recoletos", "Goya", "Lista", "Castellana"],
+    "Chamberí": ["Trafalgar", "Almagro", "Arapiles", "Gaztambide"],
+    "Retiro": ["Ibiza", "Niño Jesús", "Pacífico"],
+    "Arganzuela": ["Palos de Moguer", "Delicias", "Legazpi"],
+}
+METERS_PER_DEGREE_LATITUDE = 6371000 * math.pi / 180
+
+
+def generate_listings(number_of_listings: int, seed: int = 0) -> list:
+    """
+    Function that generates listings with the same fields as the elementList of the idealista API.
+
+    Args:
+        number_of_listings (int): Number of listings.
+        seed (int, optional): Seed of the random generator. Defaults to 0.
+
+    Returns:
+        list: Listings within 5 km of the center of Madrid.
+    """
+    rng = random.Random(seed)
+    listings = []
+    for i in range(number_of_listings):
+        distance = 5000 * math.sqrt(rng.random())
+        angle = rng.uniform(0, 2 * math.pi)
+        latitude = CENTER[0] + distance * math.cos(angle) / METERS_PER_DEGREE_LATITUDE
+        longitude = CENTER[1] + distance * math.sin(angle) / (
+            METERS_PER_DEGREE_LATITUDE * math.cos(math.radians(CENTER[0]))
+        )
+        size = float(rng.randint(40, 250))
+        price = float(round(size * rng.uniform(12, 35), -1))
+        district = rng.choice(list(DISTRICTS))
+        neighborhood = rng.choice(DISTRICTS[district])
+        property_code = str(100000000 + i)
+        listing = {
+            "propertyCode": property_code,
+            "thumbnail": "https://img3.idealista.com/blur/WEB_LISTING/0/" + property_code + ".jpg",
+            "externalReference": "REF" + str(i) if rng.random() < 0.3 else None,
+            "numPhotos": rng.randint(3, 40),
+            "floor": str(rng.randint(0, 9)),
+            "price": price,
+            "propertyType": rng.choice(["flat", "flat", "flat", "penthouse", "duplex", "studio"]),
+            "operation": "rent",
+            "size": size,
+            "exterior": rng.random() < 0.8,
+            "rooms": rng.randint(0, 5),
+            "bathrooms": rng.randint(1, 3),
+            "address": "Calle " + rng.choice(["Mayor", "Atocha", "Alcalá", "Princesa", "Serrano"]),
+            "province": "Madrid",
+            "municipality": "Madrid",
+            "district": district,
+            "country": "es",
+            "neighborhood": neighborhood,
+            "latitude": round(latitude, 7),
+            "longitude": round(longitude, 7),
+            "showAddress": rng.random() < 0.5,
+            "url": "https://www.idealista.com/inmueble/" + property_code + "/",
+            "description": "Piso en alquiler en " + neighborhood,
+            "hasVideo": rng.random() < 0.3,
+            "status": "good",
+            "newDevelopment": False,
+            "hasLift": rng.random() < 0.7,
+            "priceByArea": round(price / size),
+            "detailedType": {"typology": "flat"},
+            "suggestedTexts": {"subtitle": neighborhood + ", Madrid", "title": "Piso en Calle"},
+            "hasPlan": rng.random() < 0.5,
+            "has3DTour": rng.random() < 0.1,
+            "has360": rng.random() < 0.1,
+            "hasStaging": False,
+            "topNewDevelopment": False,
+            "superTopHighlight": False,
+            "modificationDate": int(time.time() * 1000) - i * 60000,
+            "furnished": rng.choice(["furnished", "furnishedKitchen"]),
+        }
+        if listing["externalReference"] is None:
+            del listing["externalReference"]
+        if rng.random() < 0.2:
+            listing["parkingSpace"] = {
+                "hasParkingSpace": True,
+                "isParkingSpaceIncludedInPrice": rng.random() < 0.5,
+            }
+        if rng.random() < 0.1:
+            listing["labels"] = [{"name": "apartamentoType", "text": "Apartamento"}]
+        if rng.random() < 0.1:
+            listing["highlight"] = {"groupDescription": "Destacado"}
+        listings.append(listing)
+    return listings
+
+
+def distance_in_meters(latitude: float, longitude: float, center: tuple) -> float:
+    d_latitude = (latitude - center[0]) * METERS_PER_DEGREE_LATITUDE
+    d_longitude = (
+        (longitude - center[1]) * METERS_PER_DEGREE_LATITUDE * math.cos(math.radians(center[0]))
+    )
+    return math.sqrt(d_latitude**2 + d_longitude**2)
+
+
+class IdealistaStandIn:  # pylint: disable=too-many-instance-attributes
+    """
+    Local HTTP server that answers like the idealista API. Latency, error rate,
+    throttling (429 with Retry-After) and token expiry are configurable.
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        number_of_listings: int = 2000,
+        latency: float = 0.0,
+        error_rate: float = 0.0,
+        requests_per_second: float = None,
+        token_ttl: float = 3600,
+        seed: int = 0,
+    ):
+        """
+        Args:
+            host (str, optional): Host to bind to. Defaults to "127.0.0.1".
+            port (int, optional): Port to bind to, 0 picks a free port. Defaults to 0.
+            number_of_listings (int, optional): Listings in the fake index. Defaults to 2000.
+            latency (float, optional): Seconds every response is delayed. Defaults to 0.0.
+            error_rate (float, optional): Share of search requests answered with 503. Defaults to 0.0.
+            requests_per_second (float, optional): Search requests above this rate are answered with 429.
+                Defaults to None (no throttling).
+            token_ttl (float, optional): Seconds after which a bearer token expires. Defaults to 3600.
+            seed (int, optional): Seed for the listings and the errors. Defaults to 0.
+        """
+        self.listings = generate_listings(number_of_listings, seed=seed)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.requests_per_second = requests_per_second
+        self.token_ttl = token_ttl
+        self.rng = random.Random(seed)
+        self.tokens = {}
+        # filtered and sorted listings per query, so that the pages of a query are cheap
+        self._matches = {}
+        self.stats = {"token": 0, "search": 0, "401": 0, "429": 0, "503": 0}
+        self._lock = threading.Lock()
+        self._allowance = requests_per_second
+        self._last_request = time.monotonic()
+        self.server = ThreadingHTTPServer((host, port), self._handler_class())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return "http://{host}:{port}".format(host=host, port=port)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _count(self, key: str) -> None:
+        with self._lock:
+            self.stats[key] += 1
+
+    def _throttled(self) -> bool:
+        if self.requests_per_second is None:
+            return False
+        with self._lock:
+            now = time.monotonic()
+            self._allowance = min(
+                self.requests_per_second,
+                self._allowance + (now - self._last_request) * self.requests_per_second,
+            )
+            self._last_request = now
+            if self._allowance < 1:
+                return True
+            self._allowance -= 1
+            return False
+
+    def issue_token(self) -> dict:
+        access_token = uuid.uuid4().hex
+        with self._lock:
+            self.tokens[access_token] = time.time() + self.token_ttl
+        return {"access_token": access_token, "expires_in": int(self.token_ttl)}
+
+    def token_is_valid(self, authorization: str) -> bool:
+        if authorization is None or not authorization.startswith("Bearer "):
+            return False
+        expires_at = self.tokens.get(authorization[len("Bearer "):])
+        return expires_at is not None and expires_at > time.time()
+
+    def _filter_and_sort(self, parameters: dict) -> list:
+        center = tuple(float(x) for x in parameters.get("center", "40.416944,-3.703333").split(","))
+        max_distance = float(parameters.get("distance", 5000))
+        min_price = float(parameters.get("minPrice", 0))
+        max_price = float(parameters.get("maxPrice", math.inf))
+        min_size = float(parameters.get("minSize", 0))
+        furnished = parameters.get("furnished")
+
+        matches = []
+        for listing in self.listings:
+            if not min_price <= listing["price"] <= max_price or listing["size"] < min_size:
+                continue
+            if furnished is not None and listing["furnished"] != furnished:
+                continue
+            distance = distance_in_meters(listing["latitude"], listing["longitude"], center)
+            if distance > max_distance:
+                continue
+            match = {k: v for k, v in listing.items() if k not in ("furnished", "modificationDate")}
+            match["distance"] = str(int(distance))
+            matches.append((listing, match))
+
+        order = parameters.get("order", "ratioeurm2")
+        sort_keys = {
+            "ratioeurm2": lambda m: m[0]["priceByArea"],
+            "price": lambda m: m[0]["price"],
+            "size": lambda m: m[0]["size"],
+            "distance": lambda m: int(m[1]["distance"]),
+            "modificationDate": lambda m: m[0]["modificationDate"],
+            "publicationDate": lambda m: m[0]["modificationDate"],
+        }
+        matches.sort(
+            key=sort_keys.get(order, sort_keys["ratioeurm2"]),
+            reverse=parameters.get("sort", "asc") == "desc",
+        )
+
+        return [match for _, match in matches]
+
+    def search(self, parameters: dict) -> dict:
+        """
+        Function that filters, sorts and paginates the listings like the search endpoint.
+
+        Args:
+            parameters (dict): Query parameters of the request.
+
+        Returns:
+            dict: Response with elementList, total, totalPages, actualPage and summary.
+        """
+        query = tuple(
+            sorted((k, v) for k, v in parameters.items() if k not in ("numPage", "maxItems"))
+        )
+        with self._lock:
+            matches = self._matches.get(query)
+        if matches is None:
+            matches = self._filter_and_sort(parameters)
+            with self._lock:
+                self._matches[query] = matches
+
+        max_items = int(parameters.get("maxItems", 50))
+        num_page = int(parameters.get("numPage", 1))
+        total = len(matches)
+        total_pages = math.ceil(total / max_items)
+        element_list = matches[(num_page - 1) * max_items : num_page * max_items]
+        return {
+            "elementList": element_list,
+            "total": total,
+            "totalPages": total_pages,
+            "actualPage": num_page,
+            "itemsPerPage": max_items,
+            "numPaginations": 0,
+            "summary": ["Alquilar", "Viviendas", "Madrid", "De más de {} euros".format(int(float(parameters.get("minPrice", 0))))],
+            "filter": {"locationName": "Madrid"},
+            "alertName": "Viviendas en Madrid",
+            "totalAppliedFilters": len(parameters),
+            "lowerRangePosition": (num_page - 1) * max_items,
+            "upperRangePosition": (num_page - 1) * max_items + len(element_list),
+            "paginable": total_pages > 1,
+        }
+
+    def handle_post(self, request_path: str, authorization: str) -> tuple:
+        """
+        Function that answers a POST request like the token and search endpoints.
+
+        Args:
+            request_path (str): Path and query string of the request.
+            authorization (str): Authorization header of the request.
+
+        Returns:
+            tuple: Status code, response body and additional headers.
+        """
+        if self.latency:
+            time.sleep(self.latency)
+
+        path, _, query = request_path.partition("?")
+        if path == "/oauth/token":
+            self._count("token")
+            if not str(authorization or "").startswith("Basic "):
+                return 401, {"error": "unauthorized"}, None
+            return 200, self.issue_token(), None
+        if path == "/3.5/es/search":
+            return self._search_response(query, authorization)
+        return 404, {"error": "not found"}, None
+
+    def _search_response(self, query: str, authorization: str) -> tuple:
+        self._count("search")
+        if not self.token_is_valid(authorization):
+            self._count("401")
+            return 401, {"error": "invalid_token"}, None
+        if self._throttled():
+            self._count("429")
+            return 429, {"message": "Too many requests"}, {"Retry-After": "1"}
+        with self._lock:
+            failed = self.rng.random() < self.error_rate
+        if failed:
+            self._count("503")
+            return 503, {"message": "Service unavailable"}, None
+
+        return 200, self.search(dict(urllib.parse.parse_qsl(query))), None
+
+    def _handler_class(self):
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):  # pylint: disable=W0622
+                pass
+
+            def _send(self, status_code: int, body: dict, headers: dict = None):
+                payload = json.dumps(body).encode("utf-8")
+                self.send_response(status_code)
+                self.send_header("Content-Type", "application/json;charset=UTF-8")
+                self.send_header("Content-Length", str(len(payload)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_POST(self):  # pylint: disable=C0103
+                length = int(self.headers.get("Content-Length", 0))
+                if length:
+                    self.rfile.read(length)
+                self._send(*stand_in.handle_post(self.path, self.headers.get("Authorization")))
+
+        return Handler
+
+
+def benchmark(stand_in: IdealistaStandIn, max_workers: int) -> None:
+    """Function that retrieves all pages of both furnished queries from the stand-in and prints the throughput."""
+    scheduler = RequestScheduler(
+        rate_limiter=TokenBucketRateLimiter(rate=10000, capacity=max_workers)
+    )
+    with IdealistaClient(
+        base_url=stand_in.url, pool_size=max_workers, scheduler=scheduler
+    ) as client:
+        access_token = request_bearer_access_token("Basic benchmark", client=client)[
+            "access_token"
+        ]
+        start = time.perf_counter()
+        pages = retrieve_all_pages_from_idealista(
+            access_token=access_token,
+            query_parameters=[{"furnished": "furnishedKitchen"}, {"furnished": "furnished"}],
+            max_workers=max_workers,
+            client=client,
+        )
+        seconds = time.perf_counter() - start
+
+    number_of_pages = sum(len(query_pages) for query_pages in pages)
+    print(
+        number_of_pages,
+        "pages in",
+        round(seconds, 2),
+        "seconds (",
+        round(number_of_pages / seconds, 1),
+        "pages per second with",
+        max_workers,
+        "workers ), server stats:",
+        stand_in.stats,
+    )
+
+
+def main() -> None:
+    """Function that starts the stand-in or runs the benchmark against it."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--listings", type=int, default=2000)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--requests-per-second", type=float, default=None)
+    parser.add_argument("--token-ttl", type=float, default=3600)
+    parser.add_argument("--benchmark", action="store_true")
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    server = IdealistaStandIn(
+        host=args.host,
+        port=0 if args.benchmark else args.port,
+        number_of_listings=args.listings,
+        latency=args.latency,
+        error_rate=args.error_rate,
+        requests_per_second=args.requests_per_second,
+        token_ttl=args.token_ttl,
+    )
+    if args.benchmark:
+        with server:
+            benchmark(server, max_workers=args.workers)
+    else:
+        print("idealista stand-in listening on", server.url)
+        server.server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
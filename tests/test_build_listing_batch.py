@@ -0,0 +1,60 @@
+from functions.build_listing_batch import ListingBatchBuilder
+import unittest
+import pandas as pd
+from pandas.testing import assert_frame_equal
+
+
+class TestListingBatchBuilder(unittest.TestCase):
+    def test_to_dataframe(self):
+        """TestListingBatchBuilder 1: records of several pages are combined into one dataframe"""
+        builder = ListingBatchBuilder()
+        builder.add_records(
+            [{"propertyCode": "1", "price": 1500.0}, {"propertyCode": "2", "price": 900.0}],
+            furnished="furnished",
+        )
+        builder.add_records(
+            [{"propertyCode": "3", "price": 1200.0, "parkingSpace": "yes"}],
+            furnished="furnishedKitchen",
+        )
+        builder.add_records([], furnished="furnished")
+
+        df_expected = pd.DataFrame(
+            {
+                "propertyCode": ["1", "2", "3"],
+                "price": [1500.0, 900.0, 1200.0],
+                "furnished": ["furnished", "furnished", "furnishedKitchen"],
+                "parkingSpace": [None, None, "yes"],
+            }
+        )
+        self.assertEqual(len(builder), 3)
+        assert_frame_equal(builder.to_dataframe(), df_expected)
+
+    def test_matches_from_dict(self):
+        """TestListingBatchBuilder 2: same result as pd.DataFrame.from_dict for a single page"""
+        records = [
+            {"propertyCode": "1", "exterior": True, "rooms": 2},
+            {"propertyCode": "2", "exterior": False, "rooms": 3},
+        ]
+        builder = ListingBatchBuilder()
+        builder.add_records(records)
+
+        assert_frame_equal(builder.to_dataframe(), pd.DataFrame.from_dict(records))
+
+    def test_record_column_in_constant_columns(self):
+        """TestListingBatchBuilder 3: a record column that is also a constant column is rejected"""
+        builder = ListingBatchBuilder()
+        builder.add_records([{"propertyCode": "1", "price": 1500.0}], furnished="furnished")
+
+        with self.assertRaisesRegex(ValueError, "furnished"):
+            builder.add_records(
+                [{"propertyCode": "2", "price": 900.0, "furnished": "unfurnished"}],
+                furnished="furnished",
+            )
+
+        # the rejected page is not added
+        self.assertEqual(len(builder), 1)
+        self.assertEqual(list(builder.to_dataframe()["furnished"]), ["furnished"])
+
+
+if __name__ == "__main__":
+    unittest.main()
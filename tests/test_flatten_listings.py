@@ -0,0 +1,78 @@
+from functions.flatten_listings import QueryMetadataTable, flatten_listing, make_query_id
+import unittest
+
+
+class TestFlattenListings(unittest.TestCase):
+    def test_flatten_listing(self):
+        """TestFlattenListings 1: nested fields are replaced by scalar fields in their place"""
+        record = {
+            "propertyCode": "1",
+            "detailedType": {"typology": "flat", "subTypology": "penthouse"},
+            "price": 1500.0,
+            "suggestedTexts": {"subtitle": "Sol, Madrid", "title": "Piso en Calle Mayor"},
+            "parkingSpace": {"hasParkingSpace": True, "isParkingSpaceIncludedInPrice": False},
+            "labels": [{"name": "apartamentoType", "text": "Apartamento"}],
+            "highlight": {"groupDescription": "Destacado", "price": 1},
+        }
+
+        self.assertEqual(
+            list(flatten_listing(record).items()),
+            [
+                ("propertyCode", "1"),
+                ("typology", "flat"),
+                ("subTypology", "penthouse"),
+                ("price", 1500.0),
+                ("subtitle", "Sol, Madrid"),
+                ("title", "Piso en Calle Mayor"),
+                ("hasParkingSpace", True),
+                ("isParkingSpaceIncludedInPrice", False),
+                ("labelName", "apartamentoType"),
+                ("labelText", "Apartamento"),
+                ("groupDescription", "Destacado"),
+                # name of a field of the listing
+                ("highlightPrice", 1),
+            ],
+        )
+        self.assertEqual(flatten_listing({"propertyCode": "1", "labels": []}), {"propertyCode": "1"})
+
+    def test_query_metadata(self):
+        """TestFlattenListings 2: all pages of a query have the same query_id and one metadata row"""
+        query_metadata = QueryMetadataTable()
+        data = {"summary": ["Alquilar", "Madrid"], "total": 120, "totalPages": 3}
+        query_ids = [
+            query_metadata.add("locale=es&furnished=furnished&numPage=" + str(page), data)
+            for page in [1, 2, 3]
+        ]
+        query_ids.append(query_metadata.add("locale=es&furnished=furnishedKitchen&numPage=1", data))
+
+        self.assertEqual(len(set(query_ids[:3])), 1)
+        self.assertEqual(query_ids[0], make_query_id("locale=es&furnished=furnished"))
+        self.assertNotEqual(query_ids[0], query_ids[3])
+        df = query_metadata.to_dataframe()
+        self.assertEqual(list(df["query_id"]), [query_ids[0], query_ids[3]])
+        self.assertEqual(df.loc[0, "request_data"], "locale=es&furnished=furnished")
+        self.assertEqual(df.loc[0, "summary"], '["Alquilar", "Madrid"]')
+
+    def test_flatten_several_labels(self):
+        """TestFlattenListings 3: the values of all labels are kept"""
+        record = {
+            "propertyCode": "1",
+            "labels": [
+                {"name": "apartamentoType", "text": "Apartamento"},
+                {"name": "luxuryType", "text": "Lujo"},
+                {"name": "other"},
+            ],
+        }
+
+        self.assertEqual(
+            flatten_listing(record),
+            {
+                "propertyCode": "1",
+                "labelName": "apartamentoType|luxuryType|other",
+                "labelText": "Apartamento|Lujo|",
+            },
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,10 +1,15 @@
 from functions.get_bearer_access_token import (
+    BearerTokenProvider,
     get_bearer_access_token,
     encode_api_credentials,
 )
 from unittest.mock import patch
 from nose.tools import assert_equal
 import unittest
+import os
+import json
+
+from global_variables import TEST_DATA_DIRECTORY
 
 
 class TestEncodeApiCredentials(unittest.TestCase):
@@ -51,3 +56,56 @@ class TestGetBearerAccessToken(unittest.TestCase):
         )
 
         assert_equal(test_response, "bbbbb")
+
+
+class TestBearerTokenProvider(unittest.TestCase):
+    def setUp(self):
+        self.cache_file = os.path.join(TEST_DATA_DIRECTORY, ".idealista_token.json")
+        self.mock_request_patcher = patch(
+            "functions.get_bearer_access_token.request_bearer_access_token"
+        )
+        self.mock_request = self.mock_request_patcher.start()
+        self.mock_request.side_effect = [
+            {"access_token": "token_1", "expires_in": 3600},
+            {"access_token": "token_2", "expires_in": 3600},
+        ]
+
+    def tearDown(self):
+        self.mock_request_patcher.stop()
+        if os.path.exists(self.cache_file):
+            os.remove(self.cache_file)
+
+    def test_token_is_shared_through_cache_file(self):
+        """TestBearerTokenProvider 1: a second provider (e.g. another process) reuses the cached token"""
+        provider_1 = BearerTokenProvider("authorization_string", cache_file=self.cache_file)
+        provider_2 = BearerTokenProvider("authorization_string", cache_file=self.cache_file)
+
+        assert_equal(provider_1.get_token(), "token_1")
+        assert_equal(provider_2.get_token(), "token_1")
+        assert_equal(self.mock_request.call_count, 1)
+
+    def test_token_is_refreshed_before_expiry(self):
+        """TestBearerTokenProvider 2: a token within the refresh margin is replaced"""
+        provider = BearerTokenProvider(
+            "authorization_string", cache_file=self.cache_file, refresh_margin=3600
+        )
+
+        assert_equal(provider.get_token(), "token_1")
+        assert_equal(provider.get_token(), "token_2")
+
+    def test_invalidate(self):
+        """TestBearerTokenProvider 3: a rejected token is not used again"""
+        provider = BearerTokenProvider("authorization_string", cache_file=self.cache_file)
+
+        provider.invalidate(provider.get_token())
+
+        assert_equal(provider.get_token(), "token_2")
+        assert_equal(self.mock_request.call_count, 2)
+
+    def test_incomplete_cache_file(self):
+        """TestBearerTokenProvider 4: a cached token without expiry is replaced by a new token"""
+        with open(self.cache_file, "w", encoding="utf-8") as file:
+            json.dump({"access_token": "old_token"}, file)
+        provider = BearerTokenProvider("authorization_string", cache_file=self.cache_file)
+
+        assert_equal(provider.get_token(), "token_1")
@@ -0,0 +1,54 @@
+from functions.idealista_client import (
+    IdealistaClient,
+    SEARCH_PATH,
+    build_search_headers,
+)
+from functions.get_bearer_access_token import get_bearer_access_token
+from unittest.mock import patch, MagicMock
+import unittest
+
+
+class TestIdealistaClient(unittest.TestCase):
+    def test_connection_pool(self):
+        """TestIdealistaClient 1: pool size and default headers are configurable"""
+        client = IdealistaClient(pool_size=8, headers={"User-Agent": "real-estate-madrid"})
+
+        adapter = client.session.get_adapter("https://api.idealista.com")
+        self.assertEqual(adapter._pool_maxsize, 8)  # pylint: disable=W0212
+        self.assertEqual(client.session.headers["Accept"], "application/json")
+        self.assertEqual(client.session.headers["User-Agent"], "real-estate-madrid")
+        client.close()
+
+    def test_post(self):
+        """TestIdealistaClient 2: requests are sent over the shared session"""
+        client = IdealistaClient(base_url="http://localhost:8000/", timeout=2)
+        with patch.object(client.session, "post") as mock_post:
+            headers = build_search_headers("bbbbb")
+            client.post(SEARCH_PATH + "numPage=1", headers=headers)
+
+            mock_post.assert_called_once_with(
+                "http://localhost:8000/3.5/es/search?numPage=1",
+                headers=headers,
+                data=None,
+                timeout=2,
+            )
+
+    def test_get_bearer_access_token_with_client(self):
+        """TestIdealistaClient 3: get_bearer_access_token uses the client if one is passed"""
+        client = MagicMock()
+        client.post.return_value.status_code = 200
+        client.post.return_value.text = "{'access_token': 'bbbbb', 'expires_in': 3600}"
+
+        access_token = get_bearer_access_token(
+            base64_authorization_string="authorization_string", client=client
+        )
+
+        self.assertEqual(access_token, "bbbbb")
+        self.assertEqual(
+            client.post.call_args.kwargs["headers"]["Authorization"],
+            "authorization_string",
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
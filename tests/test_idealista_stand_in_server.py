@@ -0,0 +1,86 @@
+from functions.idealista_client import IdealistaClient
+from functions.get_bearer_access_token import BearerTokenProvider
+from functions.request_scheduler import RequestScheduler, TokenBucketRateLimiter, CircuitBreaker
+from functions.retrieve_data_from_idealista import (
+    retrieve_all_pages_from_idealista,
+    retrieve_data_from_idealista,
+    url_encode_request_data,
+)
+from tests.idealista_stand_in_server import IdealistaStandIn
+import unittest
+import os
+
+from global_variables import TEST_DATA_DIRECTORY
+
+
+class TestIdealistaStandInServer(unittest.TestCase):
+    def setUp(self):
+        self.cache_file = os.path.join(TEST_DATA_DIRECTORY, ".idealista_token.json")
+
+    def tearDown(self):
+        if os.path.exists(self.cache_file):
+            os.remove(self.cache_file)
+
+    def retrieve_all_listings(self, stand_in: IdealistaStandIn, max_workers: int = 4) -> list:
+        scheduler = RequestScheduler(
+            rate_limiter=TokenBucketRateLimiter(rate=1000, capacity=max_workers),
+            circuit_breaker=CircuitBreaker(failure_threshold=100),
+            max_retries=30,
+            backoff_base=0.01,
+            backoff_max=0.2,
+        )
+        with IdealistaClient(
+            base_url=stand_in.url, pool_size=max_workers, scheduler=scheduler
+        ) as client:
+            token_provider = BearerTokenProvider(
+                "Basic test", client=client, cache_file=self.cache_file
+            )
+            pages = retrieve_all_pages_from_idealista(
+                token_provider=token_provider, max_workers=max_workers, client=client
+            )
+        return [listing["propertyCode"] for data in pages[0] for listing in data["elementList"]]
+
+    def test_all_pages_are_retrieved(self):
+        """TestIdealistaStandInServer 1: all listings are retrieved concurrently in page order"""
+        with IdealistaStandIn(number_of_listings=230) as stand_in:
+            property_codes = self.retrieve_all_listings(stand_in)
+
+            self.assertEqual(stand_in.stats["search"], 5)
+            self.assertEqual(stand_in.stats["token"], 1)
+        self.assertEqual(len(set(property_codes)), 230)
+
+    def test_throttling_and_errors_are_retried(self):
+        """TestIdealistaStandInServer 2: 429 and 503 responses are retried without losing pages"""
+        with IdealistaStandIn(
+            number_of_listings=500, requests_per_second=5, error_rate=0.3
+        ) as stand_in:
+            property_codes = self.retrieve_all_listings(stand_in, max_workers=8)
+
+            self.assertGreater(stand_in.stats["429"], 0)
+            self.assertGreater(stand_in.stats["503"], 0)
+        self.assertEqual(len(set(property_codes)), 500)
+
+    def test_expired_token_is_refreshed(self):
+        """TestIdealistaStandInServer 3: a token that expires during the run is replaced once"""
+        with IdealistaStandIn(number_of_listings=100) as stand_in:
+            with IdealistaClient(base_url=stand_in.url) as client:
+                token_provider = BearerTokenProvider(
+                    "Basic test", client=client, cache_file=self.cache_file
+                )
+                request_data = url_encode_request_data(numPage=1)
+                retrieve_data_from_idealista(
+                    request_data, client=client, token_provider=token_provider
+                )
+                # the server forgets all tokens, as if they had expired
+                stand_in.tokens.clear()
+                df, _, _ = retrieve_data_from_idealista(
+                    request_data, client=client, token_provider=token_provider
+                )
+
+            self.assertEqual(stand_in.stats["401"], 1)
+            self.assertEqual(stand_in.stats["token"], 2)
+        self.assertEqual(len(df), 50)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,47 @@
+from functions.listing_dtypes import apply_dtype_profile
+import unittest
+import numpy as np
+import pandas as pd
+
+
+class TestListingDtypes(unittest.TestCase):
+    def test_apply_dtype_profile(self):
+        """TestListingDtypes 1: columns get the compact dtypes, flags read as strings become booleans"""
+        df = pd.DataFrame(
+            {
+                "propertyCode": ["1", "2", "3"],
+                "district": ["Centro", "Centro", None],
+                "exterior": ["True", "false", np.nan],
+                "hasLift": [True, False, None],
+                "rooms": [1.0, 3.0, np.nan],
+                "latitude": [40.4168, 40.4169, 40.417],
+                "price": [1500.0, 1200.0, 900.0],
+            }
+        )
+
+        df_compact = apply_dtype_profile(df)
+
+        self.assertEqual(df_compact["district"].dtype, "category")
+        self.assertEqual(df_compact["exterior"].dtype, "boolean")
+        self.assertEqual(list(df_compact["exterior"])[:2], [True, False])
+        self.assertTrue(pd.isna(df_compact.loc[2, "exterior"]))
+        self.assertEqual(df_compact["hasLift"].dtype, "boolean")
+        self.assertEqual(df_compact["rooms"].dtype, "Int16")
+        self.assertEqual(df_compact["latitude"].dtype, np.float32)
+        # columns that are not in the profile and the input are unchanged
+        self.assertEqual(df_compact["price"].dtype, np.float64)
+        self.assertEqual(df_compact["propertyCode"].dtype, object)
+        self.assertEqual(df["exterior"].dtype, object)
+
+    def test_keep_float_precision(self):
+        """TestListingDtypes 2: coordinates keep float64 before they are stored"""
+        df = pd.DataFrame({"latitude": [40.4168], "rooms": [2]})
+
+        df_compact = apply_dtype_profile(df, downcast_floats=False)
+
+        self.assertEqual(df_compact["latitude"].dtype, np.float64)
+        self.assertEqual(df_compact["rooms"].dtype, "Int16")
+
+
+if __name__ == "__main__":
+    unittest.main()
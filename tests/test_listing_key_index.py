@@ -0,0 +1,103 @@
+from functions.listing_key_index import (
+    ListingKeyIndex,
+    make_listing_key,
+    rebuild_listing_key_index,
+    load_listing_key_index,
+)
+import unittest
+import os
+import shutil
+import pandas as pd
+
+from global_variables import TEST_DATA_DIRECTORY
+
+
+class TestListingKeyIndex(unittest.TestCase):
+    def setUp(self):
+        self.index_file = os.path.join(TEST_DATA_DIRECTORY, "idealista_data_keys.txt")
+        self.csv_file = os.path.join(TEST_DATA_DIRECTORY, "idealista_data_rebuild.csv")
+
+    def tearDown(self):
+        for file_path in [self.index_file, self.csv_file]:
+            if os.path.exists(file_path):
+                os.remove(file_path)
+
+    def test_make_listing_key(self):
+        """TestListingKeyIndex 1: values read from the API and from csv give the same key"""
+        self.assertEqual(
+            make_listing_key("103051203", 1600, 114.0),
+            make_listing_key("103051203", "1600.0", "114.0"),
+        )
+
+    def test_index_is_persisted(self):
+        """TestListingKeyIndex 2: keys that were added are known after reloading the index"""
+        df = pd.DataFrame(
+            {"propertyCode": ["1", "2", "2"], "price": [1500.0, 900.0, 900.0], "size": [70.0, 50.0, 50.0]}
+        )
+        self.assertEqual(ListingKeyIndex(self.index_file).add_dataframe(df), 2)
+
+        key_index = ListingKeyIndex(self.index_file)
+        self.assertEqual(len(key_index), 2)
+        self.assertIn({"propertyCode": "1", "price": 1500, "size": 70}, key_index)
+        self.assertNotIn({"propertyCode": "1", "price": 1400, "size": 70}, key_index)
+        self.assertEqual(key_index.add_dataframe(df), 0)
+
+    def test_drop_known(self):
+        """TestListingKeyIndex 3: known listings and duplicates within the batch are dropped"""
+        key_index = ListingKeyIndex(self.index_file)
+        key_index.add_dataframe(
+            pd.DataFrame({"propertyCode": ["1"], "price": [1500.0], "size": [70.0]})
+        )
+        df = pd.DataFrame(
+            {
+                "propertyCode": ["1", "1", "2", "2"],
+                "price": [1500.0, 1400.0, 900.0, 900.0],
+                "size": [70.0] * 4,
+                "insert_date": ["2024-01-01", "2024-01-01", "2024-01-01", "2024-01-02"],
+            }
+        )
+
+        df_new = key_index.drop_known(df)
+
+        self.assertEqual(list(df_new.index), [1, 3])
+
+    def test_rebuild_listing_key_index(self):
+        """TestListingKeyIndex 4: the index is regenerated from the csv files"""
+        pd.DataFrame(
+            {"propertyCode": ["1", "2"], "price": [1500, 900], "size": [70, 50], "floor": ["1", "bj"]}
+        ).to_csv(self.csv_file, index=False)
+        with open(self.index_file, "w", encoding="utf-8") as file:
+            file.write("outdated|1.0|1.0\n")
+
+        key_index = rebuild_listing_key_index(
+            file_names=["idealista_data_rebuild.csv"],
+            data_dir=TEST_DATA_DIRECTORY,
+            index_file=self.index_file,
+        )
+
+        self.assertEqual(len(key_index), 2)
+        self.assertIn({"propertyCode": "2", "price": 900.0, "size": 50.0}, key_index)
+        self.assertEqual(len(ListingKeyIndex(self.index_file)), 2)
+
+    def test_load_index_after_upgrade(self):
+        """TestListingKeyIndex 5: an existing history without key file is indexed before the first run"""
+        data_dir = os.path.join(TEST_DATA_DIRECTORY, "idealista_upgrade/")
+        self.addCleanup(shutil.rmtree, data_dir, ignore_errors=True)
+        os.makedirs(data_dir)
+        pd.DataFrame(
+            {"propertyCode": ["1", "2"], "price": [1500, 900], "size": [70, 50]}
+        ).to_csv(os.path.join(data_dir, "idealista_data.csv"), index=False)
+        index_file = os.path.join(data_dir, "idealista_data_keys.txt")
+
+        key_index = load_listing_key_index(data_dir=data_dir, index_file=index_file)
+
+        self.assertEqual(len(key_index), 2)
+        self.assertTrue(os.path.exists(index_file))
+        df_new = key_index.drop_known(
+            pd.DataFrame({"propertyCode": ["1", "3"], "price": [1500.0, 800.0], "size": [70.0, 40.0]})
+        )
+        self.assertEqual(list(df_new["propertyCode"]), ["3"])
+
+
+if __name__ == "__main__":
+    unittest.main()
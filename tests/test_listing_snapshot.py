@@ -0,0 +1,41 @@
+from functions.listing_snapshot import ListingSnapshot, item_content_hash
+from functions.write_data_to_nosql import marshal_dataframe
+import unittest
+import os
+import pandas as pd
+
+from global_variables import TEST_DATA_DIRECTORY
+
+
+class TestListingSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.snapshot_file = os.path.join(TEST_DATA_DIRECTORY, "idealista_nosql_snapshot.json")
+
+    def tearDown(self):
+        if os.path.exists(self.snapshot_file):
+            os.remove(self.snapshot_file)
+
+    def test_content_hash_and_snapshot(self):
+        """TestListingSnapshot 1: the hash ignores run and date, changed listings are detected after reloading"""
+        df = pd.DataFrame({"propertyCode": ["1"], "rooms": [2], "insert_date": ["2024-01-01"], "run": [0]})
+        df_next_day = pd.DataFrame(
+            {
+                "propertyCode": ["1"],
+                "rooms": pd.array([2], dtype="Int16"),
+                "insert_date": ["2024-01-02"],
+                "run": [5],
+            }
+        )
+        content_hash = item_content_hash(marshal_dataframe(df)[0])
+        self.assertEqual(content_hash, item_content_hash(marshal_dataframe(df_next_day)[0]))
+
+        ListingSnapshot(self.snapshot_file).update({"1": content_hash})
+
+        snapshot = ListingSnapshot(self.snapshot_file)
+        self.assertFalse(snapshot.is_changed("1", content_hash))
+        self.assertTrue(snapshot.is_changed("1", "0" * 16))
+        self.assertTrue(snapshot.is_changed("2", content_hash))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,95 @@
+from functions.plan_query_shards import (
+    split_price_band,
+    split_circle,
+    haversine_distance,
+    retrieve_sharded_data_from_idealista,
+)
+from unittest.mock import patch
+import unittest
+import urllib
+import pandas as pd
+
+
+def fake_retrieve_page_from_idealista(request_data, **_kwargs):
+    """The unsplit query (minPrice 200, no maxPrice) has 30 pages, every price band has 2 pages.
+    Listing 0 of every page is the same listing, so it has to be deduplicated."""
+    parameters = dict(urllib.parse.parse_qsl(request_data))
+    unsplit = parameters["minPrice"] == "200" and "maxPrice" not in parameters
+    totalPages = 30 if unsplit else 2
+    numPage = int(parameters["numPage"])
+    listings = [
+        {"propertyCode": "0", "latitude": 40.416944, "longitude": -3.703333, "distance": "0"},
+        {
+            "propertyCode": "{min}-{max}-{page}".format(
+                min=parameters["minPrice"], max=parameters.get("maxPrice", ""), page=numPage
+            ),
+            "latitude": 40.42,
+            "longitude": -3.70,
+            "distance": "500",
+        },
+    ]
+    return {
+        "elementList": listings,
+        "summary": [],
+        "totalPages": totalPages,
+        "actualPage": numPage,
+        "total": 50 * totalPages,
+    }
+
+
+class TestPlanQueryShards(unittest.TestCase):
+    def test_split_price_band(self):
+        """TestPlanQueryShards 1: open and closed price bands are split in two"""
+        self.assertEqual(
+            split_price_band({"minPrice": "200"}),
+            [{"minPrice": "200", "maxPrice": "400"}, {"minPrice": "400"}],
+        )
+        self.assertEqual(
+            split_price_band({"minPrice": "400", "maxPrice": "800"}),
+            [
+                {"minPrice": "400", "maxPrice": "600"},
+                {"minPrice": "600", "maxPrice": "800"},
+            ],
+        )
+        self.assertEqual(split_price_band({"minPrice": "400", "maxPrice": "450"}), [])
+
+    def test_split_circle(self):
+        """TestPlanQueryShards 2: seven circles with half the radius cover the original circle"""
+        center = "40.416944,-3.703333"
+        shards = split_circle({"center": center, "distance": "5000"})
+
+        self.assertEqual(len(shards), 7)
+        self.assertTrue(all(shard["distance"] == "2500" for shard in shards))
+        distances = haversine_distance(
+            pd.Series([float(s["center"].split(",")[0]) for s in shards]),
+            pd.Series([float(s["center"].split(",")[1]) for s in shards]),
+            center,
+        )
+        self.assertAlmostEqual(distances.iloc[0], 0)
+        for distance in distances.iloc[1:]:
+            self.assertAlmostEqual(distance, 5000 * 3**0.5 / 2, delta=5)
+        self.assertEqual(split_circle({"center": center, "distance": "800"}), [])
+
+    @patch("functions.retrieve_data_from_idealista.retrieve_page_from_idealista")
+    def test_retrieve_sharded_data_from_idealista(self, mock_retrieve):
+        """TestPlanQueryShards 3: a query above the page limit is split and deduplicated"""
+        mock_retrieve.side_effect = fake_retrieve_page_from_idealista
+
+        df = retrieve_sharded_data_from_idealista(
+            query_parameters=[{"furnished": "furnished"}],
+            access_token="bbbbb",
+            query_columns=[{"furnished": "furnished"}],
+            max_pages=20,
+        )
+
+        # the unsplit query and the band 200-400 are probed, the band 200-400 and the open band
+        # above 400 fit within 20 pages and their second pages are retrieved
+        self.assertEqual(mock_retrieve.call_count, 5)
+        self.assertEqual(
+            sorted(df["propertyCode"]), ["0", "200-400-1", "200-400-2", "400--1", "400--2"]
+        )
+        self.assertTrue((df["furnished"] == "furnished").all())
+
+
+if __name__ == "__main__":
+    unittest.main()
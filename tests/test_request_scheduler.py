@@ -0,0 +1,143 @@
+from functions.request_scheduler import (
+    RequestScheduler,
+    TokenBucketRateLimiter,
+    CircuitBreaker,
+    CircuitOpenError,
+    parse_retry_after,
+)
+from unittest.mock import patch, MagicMock
+import unittest
+import time
+
+
+def mock_response(status_code: int, retry_after: str = None) -> MagicMock:
+    response = MagicMock(status_code=status_code)
+    response.headers = {} if retry_after is None else {"Retry-After": retry_after}
+    return response
+
+
+class TestRequestScheduler(unittest.TestCase):
+    @patch("functions.request_scheduler.time.sleep")
+    def test_retry_after_is_honored(self, mock_sleep):
+        """TestRequestScheduler 1: throttled requests are retried after Retry-After seconds"""
+        request_function = MagicMock(
+            side_effect=[mock_response(429, retry_after="7"), mock_response(200)]
+        )
+        scheduler = RequestScheduler(rate_limiter=TokenBucketRateLimiter(rate=1000))
+
+        response = scheduler.send(request_function)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(request_function.call_count, 2)
+        mock_sleep.assert_any_call(7.0)
+
+    @patch("functions.request_scheduler.time.sleep")
+    def test_retries_are_limited(self, mock_sleep):
+        """TestRequestScheduler 2: the last response is returned once all retries are used up"""
+        request_function = MagicMock(return_value=mock_response(503))
+        scheduler = RequestScheduler(
+            rate_limiter=TokenBucketRateLimiter(rate=1000),
+            circuit_breaker=CircuitBreaker(failure_threshold=10),
+            max_retries=3,
+        )
+
+        response = scheduler.send(request_function)
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(request_function.call_count, 4)
+        for call in mock_sleep.call_args_list:
+            self.assertLessEqual(call.args[0], scheduler.backoff_max)
+
+    def test_circuit_breaker_opens(self):
+        """TestRequestScheduler 3: while the circuit is open, requests wait for it instead of failing"""
+        clock = [0.0]
+
+        def sleep(seconds):
+            clock[0] += seconds
+
+        request_function = MagicMock(return_value=mock_response(500))
+        circuit_breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+        scheduler = RequestScheduler(
+            rate_limiter=TokenBucketRateLimiter(rate=1000),
+            circuit_breaker=circuit_breaker,
+            max_retries=3,
+            backoff_max=1,
+        )
+
+        with patch("functions.request_scheduler.time.monotonic", side_effect=lambda: clock[0]), patch(
+            "functions.request_scheduler.time.sleep", side_effect=sleep
+        ):
+            response = scheduler.send(request_function)
+            # the last failure opened the circuit again
+            self.assertGreater(circuit_breaker.seconds_until_closed(), 0)
+
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(request_function.call_count, 4)
+        # two waits for the circuit (after the 2nd and the 3rd failure)
+        self.assertGreaterEqual(clock[0], 120)
+
+    @patch("functions.request_scheduler.time.sleep")
+    def test_throttling_does_not_open_circuit(self, _):
+        """TestRequestScheduler 6: a burst of 429 responses does not open the circuit"""
+        request_function = MagicMock(
+            side_effect=[mock_response(429, retry_after="1")] * 10 + [mock_response(200)]
+        )
+        circuit_breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+        scheduler = RequestScheduler(
+            rate_limiter=TokenBucketRateLimiter(rate=1000),
+            circuit_breaker=circuit_breaker,
+            max_retries=10,
+        )
+
+        response = scheduler.send(request_function)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(circuit_breaker.opened_at)
+        self.assertEqual(circuit_breaker.seconds_until_closed(), 0)
+
+    def test_circuit_wait_is_limited(self):
+        """TestRequestScheduler 7: a request fails once it waited max_circuit_wait seconds for the circuit"""
+        clock = [time.monotonic()]
+        start = clock[0]
+
+        def sleep(seconds):
+            clock[0] += seconds
+
+        request_function = MagicMock(return_value=mock_response(500))
+        scheduler = RequestScheduler(
+            rate_limiter=TokenBucketRateLimiter(rate=1000),
+            circuit_breaker=CircuitBreaker(failure_threshold=2, reset_timeout=60),
+            max_retries=10,
+            backoff_max=1,
+            max_circuit_wait=90,
+        )
+
+        with patch("functions.request_scheduler.time.monotonic", side_effect=lambda: clock[0]), patch(
+            "functions.request_scheduler.time.sleep", side_effect=sleep
+        ):
+            with self.assertRaises(CircuitOpenError):
+                scheduler.send(request_function)
+
+        # one wait of 60 seconds, the second one would exceed 90 seconds
+        self.assertEqual(request_function.call_count, 3)
+        self.assertLess(clock[0] - start, 90)
+
+    def test_rate_limiter(self):
+        """TestRequestScheduler 4: the token bucket allows a burst and then the configured rate"""
+        rate_limiter = TokenBucketRateLimiter(rate=50, capacity=2)
+        start = time.monotonic()
+        for _ in range(7):
+            rate_limiter.acquire()
+
+        # 2 requests from the burst, 5 more at 50 per second take about 0.1 seconds
+        self.assertGreaterEqual(time.monotonic() - start, 0.09)
+
+    def test_parse_retry_after(self):
+        """TestRequestScheduler 5: Retry-After in seconds and as HTTP date"""
+        self.assertEqual(parse_retry_after("120"), 120.0)
+        self.assertEqual(parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT"), 0.0)
+        self.assertIsNone(parse_retry_after("soon"))
+
+
+if __name__ == "__main__":
+    unittest.main()
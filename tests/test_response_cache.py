@@ -0,0 +1,125 @@
+from functions.response_cache import ResponseCache, ResponseCacheMissError
+from functions.retrieve_data_from_idealista import retrieve_data_from_idealista
+from unittest.mock import patch
+import unittest
+import os
+import shutil
+import time
+
+from global_variables import TEST_DATA_DIRECTORY
+
+
+class TestResponseCache(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = os.path.join(TEST_DATA_DIRECTORY, "idealista_response_cache/")
+        with open(
+            os.path.join(TEST_DATA_DIRECTORY, "idealista_data_short.txt"), "r", encoding="UTF-8"
+        ) as file:
+            self.idealista_data_raw = file.read()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def test_get_and_put(self):
+        """TestResponseCache 1: bodies are stored compressed and keyed by the request data"""
+        cache = ResponseCache(cache_dir=self.cache_dir)
+        cache.put("numPage=1", self.idealista_data_raw)
+
+        self.assertEqual(cache.get("numPage=1"), self.idealista_data_raw)
+        self.assertIsNone(cache.get("numPage=2"))
+        file_path = os.path.join(self.cache_dir, cache.key("numPage=1") + ".json.gz")
+        self.assertLess(os.path.getsize(file_path), len(self.idealista_data_raw))
+
+    def test_ttl(self):
+        """TestResponseCache 2: expired entries are not used, except in replay-only mode"""
+        ResponseCache(cache_dir=self.cache_dir).put("numPage=1", "{}")
+
+        with patch("functions.response_cache.time.time", return_value=time.time() + 120):
+            self.assertIsNone(ResponseCache(cache_dir=self.cache_dir, ttl=60).get("numPage=1"))
+            self.assertEqual(
+                ResponseCache(cache_dir=self.cache_dir, ttl=60, replay_only=True).get(
+                    "numPage=1"
+                ),
+                "{}",
+            )
+
+    def test_replay_only_miss(self):
+        """TestResponseCache 3: a miss in replay-only mode raises instead of requesting the API"""
+        cache = ResponseCache(cache_dir=self.cache_dir, replay_only=True)
+
+        with patch("functions.retrieve_data_from_idealista.requests") as mock_requests:
+            with self.assertRaises(ResponseCacheMissError):
+                retrieve_data_from_idealista(
+                    request_data="numPage=1", access_token="bbbbb", cache=cache
+                )
+            mock_requests.post.assert_not_called()
+
+    def test_lru_eviction(self):
+        """TestResponseCache 4: the least recently used entries are evicted above max_bytes"""
+        cache = ResponseCache(cache_dir=self.cache_dir)
+        cache.put("numPage=1", self.idealista_data_raw)
+        # room for two entries, but not for three
+        cache.max_bytes = int(
+            2.5
+            * os.path.getsize(
+                os.path.join(self.cache_dir, cache.key("numPage=1") + ".json.gz")
+            )
+        )
+        cache.put("numPage=2", self.idealista_data_raw + " ")
+        # entry 1 is older than entry 2, but was used more recently
+        for request_data, age in [("numPage=1", 20), ("numPage=2", 10)]:
+            os.utime(
+                os.path.join(self.cache_dir, cache.key(request_data) + ".json.gz"),
+                (time.time() - age, time.time() - age),
+            )
+        cache.get("numPage=1")
+        cache.put("numPage=3", self.idealista_data_raw + "  ")
+
+        self.assertIsNotNone(cache.get("numPage=1"))
+        self.assertIsNone(cache.get("numPage=2"))
+        self.assertIsNotNone(cache.get("numPage=3"))
+
+    def test_key_includes_base_url(self):
+        """TestResponseCache 5: responses of another API host are not used"""
+        cache = ResponseCache(cache_dir=self.cache_dir, base_url="http://127.0.0.1:8000")
+        cache.put("numPage=1", self.idealista_data_raw)
+
+        self.assertIsNone(ResponseCache(cache_dir=self.cache_dir).get("numPage=1"))
+        self.assertEqual(
+            ResponseCache(cache_dir=self.cache_dir, base_url="http://127.0.0.1:8000/").get(
+                "numPage=1"
+            ),
+            self.idealista_data_raw,
+        )
+
+    def test_retrieve_data_from_cache(self):
+        """TestResponseCache 6: retrieve_data_from_idealista does not request cached pages"""
+        cache = ResponseCache(cache_dir=self.cache_dir)
+        cache.put("numPage=1", self.idealista_data_raw)
+
+        with patch("functions.retrieve_data_from_idealista.requests") as mock_requests:
+            df, totalPages, _ = retrieve_data_from_idealista(
+                request_data="numPage=1", access_token="bbbbb", cache=cache
+            )
+            mock_requests.post.assert_not_called()
+
+        self.assertEqual(totalPages, 1)
+        self.assertEqual(len(df), 1)
+
+    def test_put_tracks_size(self):
+        """TestResponseCache 7: put does not scan the cache directory while the cache is not full"""
+        cache = ResponseCache(cache_dir=self.cache_dir)
+
+        with patch("functions.response_cache.os.scandir") as mock_scandir:
+            cache.put("numPage=1", self.idealista_data_raw)
+            cache.put("numPage=1", self.idealista_data_raw)
+            mock_scandir.assert_not_called()
+
+        self.assertEqual(
+            cache._total_bytes,  # pylint: disable=W0212
+            os.path.getsize(os.path.join(self.cache_dir, cache.key("numPage=1") + ".json.gz")),
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,13 +1,17 @@
 from functions.retrieve_data_from_idealista import (
     retrieve_data_from_idealista,
+    retrieve_all_pages_from_idealista,
     url_encode_request_data,
 )
 import unittest
-from unittest.mock import patch
+from unittest.mock import patch, MagicMock
 import pandas as pd
 from pandas.testing import assert_frame_equal
 import os
+import urllib
 
+from functions.request_scheduler import IdealistaAPIError
+from functions.flatten_listings import make_query_id
 from global_variables import TEST_DATA_DIRECTORY
 
 
@@ -22,6 +26,13 @@ class TestUrlEcodeRequestData(unittest.TestCase):
         test_data = url_encode_request_data(furnished="furnishedKitchen")
         self.assertEqual(test_data, data)
 
+    def test_url_encode_request_data_location_id(self):
+        """TestUrlEcodeRequestData 2: locationId replaces center and distance"""
+        test_data = url_encode_request_data(locationId="0-EU-ES-28")
+        self.assertIn("locationId=0-EU-ES-28", test_data)
+        self.assertNotIn("center", test_data)
+        self.assertNotIn("distance", test_data)
+
 
 class TestRetrieveDataFromIdealista(unittest.TestCase):
     @classmethod
@@ -38,7 +49,17 @@ class TestRetrieveDataFromIdealista(unittest.TestCase):
         with open(cls.file_path_idealista_data_raw, "r", encoding='UTF-8') as file:
             cls.idealista_data_raw = file.read()
 
-        cls.idealista_data = pd.read_pickle(cls.file_path_idealista_data_transformed)
+        # nested fields are flattened and the summary (filters) is replaced by the query id
+        df = pd.read_pickle(cls.file_path_idealista_data_transformed)
+        position = df.columns.get_loc("detailedType")
+        df.insert(position, "typology", [value["typology"] for value in df["detailedType"]])
+        df.insert(position + 1, "subtitle", [value["subtitle"] for value in df["suggestedTexts"]])
+        df.insert(position + 2, "title", [value["title"] for value in df["suggestedTexts"]])
+        df = df.drop(columns=["detailedType", "suggestedTexts", "filters"])
+        df["query_id"] = make_query_id(
+            "locale=es&operation=rent&propertyType=homes&locationId=0-EU-ES-28"
+        )
+        cls.idealista_data = df
         cls.mock_post_patcher = patch("functions.retrieve_data_from_idealista.requests")
         cls.mock_post = cls.mock_post_patcher.start()
 
@@ -59,3 +80,72 @@ class TestRetrieveDataFromIdealista(unittest.TestCase):
         assert totalPages == 1
         assert actualPage == 1
         assert_frame_equal(test_response, self.idealista_data)
+
+    def test_retrieve_data_from_idealista_reauthenticates(self):
+        """TestRetrieveDataFromIdealista 2: an expired token (401) is refreshed once"""
+        token_provider = MagicMock()
+        token_provider.get_token.side_effect = ["expired_token", "new_token"]
+        unauthorized, ok = MagicMock(status_code=401), MagicMock(status_code=200)
+        ok.text = str(self.idealista_data_raw)
+        self.mock_post.post.side_effect = [unauthorized, ok]
+
+        test_response, _, _ = retrieve_data_from_idealista(
+            request_data="locale=es&operation=rent&propertyType=homes&locationId=0-EU-ES-28",
+            token_provider=token_provider,
+        )
+        self.mock_post.post.side_effect = None
+
+        token_provider.invalidate.assert_called_once_with("expired_token")
+        self.assertEqual(
+            self.mock_post.post.call_args.kwargs["headers"]["Authorization"],
+            "Bearer new_token",
+        )
+        assert_frame_equal(test_response, self.idealista_data)
+
+
+class TestRetrieveAllPagesFromIdealista(unittest.TestCase):
+    @staticmethod
+    def fake_retrieve_page_from_idealista(request_data, **_kwargs):
+        """Returns one listing per page, 3 pages for furnished and 1 page for furnishedKitchen"""
+        parameters = dict(urllib.parse.parse_qsl(request_data))
+        totalPages = 3 if parameters["furnished"] == "furnished" else 1
+        numPage = int(parameters["numPage"])
+        return {
+            "elementList": [{"query": parameters["furnished"], "page": numPage}],
+            "summary": [],
+            "totalPages": totalPages,
+            "actualPage": numPage,
+        }
+
+    @patch("functions.retrieve_data_from_idealista.retrieve_page_from_idealista")
+    def test_retrieve_all_pages_from_idealista(self, mock_retrieve):
+        """TestRetrieveAllPagesFromIdealista 1: pages of all queries are returned in page order"""
+        mock_retrieve.side_effect = self.fake_retrieve_page_from_idealista
+
+        pages = retrieve_all_pages_from_idealista(
+            access_token="bbbbb",
+            query_parameters=[{"furnished": "furnishedKitchen"}, {"furnished": "furnished"}],
+            max_workers=3,
+        )
+
+        self.assertEqual(mock_retrieve.call_count, 4)
+        self.assertEqual([data["actualPage"] for data in pages[0]], [1])
+        self.assertEqual([data["actualPage"] for data in pages[1]], [1, 2, 3])
+        self.assertEqual(pages[1][0]["elementList"][0]["query"], "furnished")
+
+    @patch("functions.retrieve_data_from_idealista.retrieve_page_from_idealista")
+    def test_failed_pages_are_skipped(self, mock_retrieve):
+        """TestRetrieveAllPagesFromIdealista 2: a page that fails after all retries does not discard the others"""
+
+        def fail_on_page_2(request_data, **kwargs):
+            if "numPage=2" in request_data:
+                raise IdealistaAPIError("failed", status_code=503)
+            return self.fake_retrieve_page_from_idealista(request_data, **kwargs)
+
+        mock_retrieve.side_effect = fail_on_page_2
+
+        pages = retrieve_all_pages_from_idealista(
+            access_token="bbbbb", query_parameters=[{"furnished": "furnished"}]
+        )
+
+        self.assertEqual([data["actualPage"] for data in pages[0]], [1, 3])
@@ -0,0 +1,55 @@
+from functions.listing_key_index import ListingKeyIndex
+from functions.retrieve_new_listings import retrieve_new_data_from_idealista
+from unittest.mock import patch
+import unittest
+import os
+import urllib
+import pandas as pd
+
+from global_variables import TEST_DATA_DIRECTORY
+
+
+class TestRetrieveNewListings(unittest.TestCase):
+    def setUp(self):
+        self.index_file = os.path.join(TEST_DATA_DIRECTORY, "idealista_data_keys.txt")
+
+    def tearDown(self):
+        if os.path.exists(self.index_file):
+            os.remove(self.index_file)
+
+    @staticmethod
+    def fake_retrieve_page_from_idealista(request_data, **_kwargs):
+        """10 pages with one listing each, listing n is on page n"""
+        parameters = dict(urllib.parse.parse_qsl(request_data))
+        numPage = int(parameters["numPage"])
+        return {
+            "elementList": [{"propertyCode": str(numPage), "price": 1000.0, "size": 50.0}],
+            "summary": [],
+            "totalPages": 10,
+            "actualPage": numPage,
+        }
+
+    @patch("functions.retrieve_data_from_idealista.retrieve_page_from_idealista")
+    def test_stops_at_known_listings(self, mock_retrieve):
+        """TestRetrieveNewListings 1: pagination stops at the first page with only known listings"""
+        mock_retrieve.side_effect = self.fake_retrieve_page_from_idealista
+        key_index = ListingKeyIndex(self.index_file)
+        key_index.add_dataframe(
+            pd.DataFrame({"propertyCode": ["3", "4"], "price": [1000.0] * 2, "size": [50.0] * 2})
+        )
+
+        df = retrieve_new_data_from_idealista(
+            query_parameters=[{"furnished": "furnished"}],
+            key_index=key_index,
+            access_token="bbbbb",
+            query_columns=[{"furnished": "furnished"}],
+        )
+
+        self.assertEqual(mock_retrieve.call_count, 3)
+        self.assertIn("order=modificationDate&sort=desc", mock_retrieve.call_args.kwargs["request_data"])
+        self.assertEqual(list(df["propertyCode"]), ["1", "2"])
+        self.assertEqual(list(df["furnished"]), ["furnished", "furnished"])
+
+
+if __name__ == "__main__":
+    unittest.main()
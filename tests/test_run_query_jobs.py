@@ -0,0 +1,96 @@
+from functions.run_query_jobs import expand_query_job, load_query_jobs, run_query_jobs
+from unittest.mock import patch
+import unittest
+import os
+import pandas as pd
+
+from global_variables import TEST_DATA_DIRECTORY
+
+
+class TestRunQueryJobs(unittest.TestCase):
+    def setUp(self):
+        self.spec_file = os.path.join(TEST_DATA_DIRECTORY, "query_jobs.yaml")
+
+    def tearDown(self):
+        if os.path.exists(self.spec_file):
+            os.remove(self.spec_file)
+
+    def test_load_query_jobs(self):
+        """TestRunQueryJobs 1: the matrix is expanded and columns are formatted with the parameters"""
+        with open(self.spec_file, "w", encoding="utf-8") as file:
+            file.write(
+                "defaults:\n"
+                "  columns: {furnished: '{furnished}'}\n"
+                "jobs:\n"
+                "  - name: madrid\n"
+                "    parameters: {distance: 5000, airConditioning: True}\n"
+                "    matrix:\n"
+                "      furnished: [furnishedKitchen, furnished]\n"
+                "      bedrooms: ['0', '1,2']\n"
+                "  - name: barcelona\n"
+                "    parameters: {center: '41.387400,2.168600'}\n"
+                "    columns: {city: Barcelona}\n"
+            )
+
+        queries = load_query_jobs(self.spec_file)
+
+        self.assertEqual(len(queries), 5)
+        self.assertEqual(
+            queries[1],
+            {
+                "name": "madrid",
+                "parameters": {
+                    "distance": "5000",
+                    "airConditioning": "True",
+                    "furnished": "furnishedKitchen",
+                    "bedrooms": "1,2",
+                },
+                "columns": {"furnished": "furnishedKitchen"},
+            },
+        )
+        self.assertEqual(queries[4]["columns"], {"furnished": "", "city": "Barcelona"})
+
+    def test_unknown_parameter(self):
+        """TestRunQueryJobs 2: jobs with parameters that url_encode_request_data does not know are rejected"""
+        with self.assertRaises(ValueError):
+            expand_query_job({"name": "madrid", "parameters": {"rooms": "2"}})
+        with self.assertRaises(ValueError):
+            expand_query_job({"name": "madrid", "matrix": {"numPage": [1, 2]}})
+
+    @patch("functions.run_query_jobs.retrieve_sharded_data_from_idealista")
+    def test_run_query_jobs(self, mock_retrieve):
+        """TestRunQueryJobs 3: all queries are retrieved together and overlapping listings are removed once"""
+        mock_retrieve.return_value = pd.DataFrame(
+            {
+                "propertyCode": ["1", "2", "2", "3"],
+                "price": [1000.0, 1200.0, 1200.0, 900.0],
+                "size": [50.0, 60.0, 60.0, 45.0],
+                "bedrooms": ["1", "1", "2", "2"],
+            }
+        )
+        queries = expand_query_job(
+            {"name": "madrid", "matrix": {"bedrooms": ["1", "2"]}, "columns": {"bedrooms": "{bedrooms}"}}
+        )
+
+        df = run_query_jobs(
+            queries=queries, access_token="bbbbb", extra_columns={"insert_date": "2024-01-01"}
+        )
+
+        mock_retrieve.assert_called_once()
+        self.assertEqual(
+            mock_retrieve.call_args.kwargs["query_parameters"],
+            [{"bedrooms": "1"}, {"bedrooms": "2"}],
+        )
+        self.assertEqual(
+            mock_retrieve.call_args.kwargs["query_columns"],
+            [
+                {"bedrooms": "1", "insert_date": "2024-01-01"},
+                {"bedrooms": "2", "insert_date": "2024-01-01"},
+            ],
+        )
+        self.assertEqual(list(df["propertyCode"]), ["1", "2", "3"])
+        self.assertEqual(list(df["bedrooms"]), ["1", "1", "2"])
+
+
+if __name__ == "__main__":
+    unittest.main()
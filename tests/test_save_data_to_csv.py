@@ -1,15 +1,27 @@
 import pandas as pd
 import os
+import shutil
 from pandas.testing import assert_frame_equal
 import unittest
 from datetime import datetime
+from unittest.mock import patch
 
 from functions.save_data_to_csv import (
     initialize_csv,
     backup_idealista_data,
+    restore_idealista_data,
+    prune_idealista_backups,
+    read_backup_manifest,
     append_idealista_data,
     remove_duplicates_from_csv,
+    append_idealista_parquet,
+    read_idealista_parquet,
+    convert_csv_to_parquet,
+    iter_idealista_data,
+    persist_idealista_data,
+    recover_interrupted_append,
 )
+from functions.schema_registry import SchemaRegistry
 from global_variables import TEST_DATA_DIRECTORY
 
 
@@ -21,12 +33,9 @@ class TestSaveDataToCsv(unittest.TestCase):
         cls.file_path_idealista_data = os.path.join(
             cls.data_directory, cls.file_name_idealista_data
         )
-        cls.file_path_idealista_data_backup = os.path.join(
-            cls.data_directory + "idealista_data_backups/",
-            cls.file_name_idealista_data.strip(".csv")
-            + "_backup_"
-            + datetime.today().strftime("%Y-%m-%d")
-            + ".csv",
+        cls.backup_directory = os.path.join(cls.data_directory, "idealista_data_backups/")
+        cls.file_path_idealista_data_restored = os.path.join(
+            cls.data_directory, "idealista_data_restored.csv"
         )
 
         cls.df_existing_data = pd.DataFrame(
@@ -296,7 +305,9 @@ class TestSaveDataToCsv(unittest.TestCase):
     @classmethod
     def tearDownClass(cls):
         os.remove(cls.file_path_idealista_data)
-        os.remove(cls.file_path_idealista_data_backup)
+        shutil.rmtree(cls.backup_directory, ignore_errors=True)
+        if os.path.exists(cls.file_path_idealista_data_restored):
+            os.remove(cls.file_path_idealista_data_restored)
         os.remove(
             os.path.join(
                 TEST_DATA_DIRECTORY,
@@ -321,8 +332,13 @@ class TestSaveDataToCsv(unittest.TestCase):
             file_name=self.file_name_idealista_data,
             data_dir=TEST_DATA_DIRECTORY,
         )
+        restore_idealista_data(
+            file_name=self.file_name_idealista_data,
+            data_dir=TEST_DATA_DIRECTORY,
+            target_path=self.file_path_idealista_data_restored,
+        )
         original = pd.read_csv(self.file_path_idealista_data)
-        backup = pd.read_csv(self.file_path_idealista_data_backup)
+        backup = pd.read_csv(self.file_path_idealista_data_restored)
 
         assert_frame_equal(original, backup)
 
@@ -799,3 +815,370 @@ class TestSaveDataToCsv(unittest.TestCase):
 
         # reset
         self.df_existing_data.to_csv(self.file_path_idealista_data, index=False)
+
+
+class TestAppendIdealistaData(unittest.TestCase):
+    def setUp(self):
+        self.file_name = "idealista_data_append.csv"
+        self.file_path = os.path.join(TEST_DATA_DIRECTORY, self.file_name)
+
+    def tearDown(self):
+        if os.path.exists(self.file_path):
+            os.remove(self.file_path)
+
+    def test_append_creates_file(self):
+        """TestAppendIdealistaData 1: the file is created with a header if there is no history"""
+        df = pd.DataFrame({"propertyCode": ["1"], "price": [1000.0]})
+        append_idealista_data(
+            df_new_data=df, data_dir=TEST_DATA_DIRECTORY, file_name=self.file_name
+        )
+
+        assert_frame_equal(pd.read_csv(self.file_path, dtype={"propertyCode": object}), df)
+
+    def test_append_only_adds_rows(self):
+        """TestAppendIdealistaData 2: new rows are added in the column order of the file"""
+        with open(self.file_path, "w", encoding="utf-8") as file:
+            # last line without line break (and no append journal): the line break is added
+            file.write("propertyCode,price\n1,1000.0\n3,900.0")
+
+        append_idealista_data(
+            df_new_data=pd.DataFrame({"price": [1200.0], "propertyCode": ["2"]}),
+            data_dir=TEST_DATA_DIRECTORY,
+            file_name=self.file_name,
+        )
+
+        with open(self.file_path, "r", encoding="utf-8") as file:
+            self.assertEqual(file.read(), "propertyCode,price\n1,1000.0\n3,900.0\n2,1200.0\n")
+
+    def test_append_keeps_crlf_line_ends(self):
+        """TestAppendIdealistaData 3: rows appended to a file with CRLF line ends use CRLF as well"""
+        with open(self.file_path, "wb") as file:
+            file.write(b"propertyCode,price\r\n1,1000.0\r\n")
+
+        append_idealista_data(
+            df_new_data=pd.DataFrame({"propertyCode": ["2"], "price": [1200.0]}),
+            data_dir=TEST_DATA_DIRECTORY,
+            file_name=self.file_name,
+        )
+
+        with open(self.file_path, "rb") as file:
+            self.assertEqual(file.read(), b"propertyCode,price\r\n1,1000.0\r\n2,1200.0\r\n")
+
+
+class TestParquetDataset(unittest.TestCase):
+    def setUp(self):
+        self.dataset_name = "idealista_data_parquet/"
+        self.dataset_path = os.path.join(TEST_DATA_DIRECTORY, self.dataset_name)
+
+    def tearDown(self):
+        shutil.rmtree(self.dataset_path, ignore_errors=True)
+
+    def test_append_and_read_parquet(self):
+        """TestParquetDataset 1: batches are partitioned and read back with projection and filters"""
+        append_idealista_parquet(
+            df_new_data=pd.DataFrame(
+                {
+                    "propertyCode": ["1", "2"],
+                    "price": [1000.0, 1200.0],
+                    "detailedType": [{"typology": "flat"}, {"typology": "flat"}],
+                    "insert_date": ["2024-01-01"] * 2,
+                    "furnished": ["furnished", "furnishedKitchen"],
+                }
+            ),
+            data_dir=TEST_DATA_DIRECTORY,
+        )
+        # second batch with an additional column
+        append_idealista_parquet(
+            df_new_data=pd.DataFrame(
+                {
+                    "propertyCode": ["3"],
+                    "price": [900.0],
+                    "detailedType": [{"typology": "flat"}],
+                    "newColumn": ["x"],
+                    "insert_date": ["2024-01-08"],
+                    "furnished": ["furnished"],
+                }
+            ),
+            data_dir=TEST_DATA_DIRECTORY,
+        )
+
+        self.assertTrue(
+            os.path.isdir(
+                os.path.join(self.dataset_path, "insert_date=2024-01-08", "furnished=furnished")
+            )
+        )
+        df_all = read_idealista_parquet(data_dir=TEST_DATA_DIRECTORY)
+        self.assertEqual(sorted(df_all["propertyCode"]), ["1", "2", "3"])
+        self.assertEqual(set(df_all["detailedType"]), {"{'typology': 'flat'}"})
+        self.assertEqual(df_all["newColumn"].isna().sum(), 2)
+
+        df = read_idealista_parquet(
+            columns=["propertyCode", "price"],
+            filters=[("insert_date", ">=", "2024-01-01"), ("furnished", "=", "furnished")],
+            data_dir=TEST_DATA_DIRECTORY,
+        )
+        assert_frame_equal(
+            df.sort_values("propertyCode").reset_index(drop=True),
+            pd.DataFrame({"propertyCode": ["1", "3"], "price": [1000.0, 900.0]}),
+        )
+
+    def test_convert_csv_with_mixed_chunks(self):
+        """TestParquetDataset 2: chunks with different inferred dtypes are written with one schema"""
+        file_name = "idealista_data_mixed_types.csv"
+        pd.DataFrame(
+            {
+                "propertyCode": ["1", "2", "3", "4"],
+                "floor": ["1", "2", "bj", "ss"],
+                "price": [1000, 1200, 900.5, 800],
+                "exterior": [True, False, None, True],
+                "insert_date": ["2024-01-01"] * 4,
+                "furnished": ["furnished"] * 4,
+            }
+        ).to_csv(os.path.join(TEST_DATA_DIRECTORY, file_name), index=False)
+        self.addCleanup(os.remove, os.path.join(TEST_DATA_DIRECTORY, file_name))
+        self.addCleanup(
+            os.remove, os.path.join(TEST_DATA_DIRECTORY, "idealista_data_mixed_types_schema.json")
+        )
+
+        # floor is int64 in the first chunk and object in the second one
+        convert_csv_to_parquet(file_name=file_name, data_dir=TEST_DATA_DIRECTORY, chunksize=2)
+
+        df = read_idealista_parquet(data_dir=TEST_DATA_DIRECTORY).sort_values("propertyCode")
+        self.assertEqual(list(df["floor"]), ["1", "2", "bj", "ss"])
+        self.assertEqual(list(df["price"]), [1000.0, 1200.0, 900.5, 800.0])
+        self.assertEqual(list(df["propertyCode"]), ["1", "2", "3", "4"])
+
+
+class TestBackupIdealistaData(unittest.TestCase):
+    def setUp(self):
+        self.data_directory = os.path.join(TEST_DATA_DIRECTORY, "backup_test/")
+        self.file_path = os.path.join(self.data_directory, "idealista_data.csv")
+        os.makedirs(self.data_directory, exist_ok=True)
+        with open(self.file_path, "w", encoding="utf-8") as file:
+            file.write("propertyCode,price\n1,1000.0\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.data_directory, ignore_errors=True)
+
+    def append_line(self, line: str) -> None:
+        with open(self.file_path, "a", encoding="utf-8") as file:
+            file.write(line)
+
+    def test_delta_backups_and_restore(self):
+        """TestBackupIdealistaData 1: appended rows are backed up as delta and every backup can be restored"""
+        with patch("functions.save_data_to_csv.datetime") as mock_datetime:
+            mock_datetime.fromisoformat = datetime.fromisoformat
+            for day, line in [(1, None), (2, "2,1200.0\n"), (3, "3,900.0\n")]:
+                mock_datetime.now.return_value = datetime(2024, 1, day, 12)
+                if line:
+                    self.append_line(line)
+                backup_idealista_data(file_name="idealista_data.csv", data_dir=self.data_directory)
+            # unchanged file, no new backup
+            backup_idealista_data(file_name="idealista_data.csv", data_dir=self.data_directory)
+
+        entries = read_backup_manifest(data_dir=self.data_directory)
+        self.assertEqual([entry["type"] for entry in entries], ["full", "delta", "delta"])
+        self.assertEqual(entries[2]["offset"], len("propertyCode,price\n1,1000.0\n"))
+
+        target_path = os.path.join(self.data_directory, "restored.csv")
+        restore_idealista_data(data_dir=self.data_directory, date="2024-01-02", target_path=target_path)
+        with open(target_path, "r", encoding="utf-8") as file:
+            self.assertEqual(file.read(), "propertyCode,price\n1,1000.0\n2,1200.0\n")
+        restore_idealista_data(data_dir=self.data_directory, target_path=target_path)
+        with open(target_path, "r", encoding="utf-8") as file:
+            self.assertEqual(file.read(), "propertyCode,price\n1,1000.0\n2,1200.0\n3,900.0\n")
+
+    def test_full_backup_after_rewrite(self):
+        """TestBackupIdealistaData 2: a full backup is created if the file was not only appended to"""
+        backup_idealista_data(file_name="idealista_data.csv", data_dir=self.data_directory)
+        with open(self.file_path, "w", encoding="utf-8") as file:
+            file.write("propertyCode,price\n1,1100.0\n2,1200.0\n")
+        backup_idealista_data(file_name="idealista_data.csv", data_dir=self.data_directory)
+
+        entries = read_backup_manifest(data_dir=self.data_directory)
+        self.assertEqual([entry["type"] for entry in entries], ["full", "full"])
+
+    def test_prune_idealista_backups(self):
+        """TestBackupIdealistaData 3: only the last backup per day, week and month is kept"""
+        with patch("functions.save_data_to_csv.datetime") as mock_datetime:
+            mock_datetime.fromisoformat = datetime.fromisoformat
+            for day in range(1, 16):
+                mock_datetime.now.return_value = datetime(2024, 1, day, 12)
+                self.append_line(str(day) + ",1000.0\n")
+                # full backup every 7 days
+                backup_idealista_data(file_name="idealista_data.csv", data_dir=self.data_directory)
+
+        deleted = prune_idealista_backups(
+            data_dir=self.data_directory, keep_daily=2, keep_weekly=2, keep_monthly=1
+        )
+
+        kept = [entry["created_at"][:10] for entry in read_backup_manifest(data_dir=self.data_directory)]
+        # days 14 and 15 (also the last backups of their weeks and of the month) and
+        # the full backup of day 8 that the delta of day 14 belongs to
+        self.assertEqual(kept, ["2024-01-08", "2024-01-14", "2024-01-15"])
+        self.assertEqual(len(deleted), 12)
+        # backup files and manifest
+        self.assertEqual(len(os.listdir(os.path.join(self.data_directory, "idealista_data_backups/"))), 4)
+
+
+class TestPersistIdealistaData(unittest.TestCase):
+    def setUp(self):
+        self.data_directory = os.path.join(TEST_DATA_DIRECTORY, "persist_test/")
+        self.file_path = os.path.join(self.data_directory, "idealista_data.csv")
+        self.schema_registry = SchemaRegistry(
+            os.path.join(self.data_directory, "idealista_data_schema.json")
+        )
+
+    def tearDown(self):
+        shutil.rmtree(self.data_directory, ignore_errors=True)
+
+    def persist(self, day: int, rows: list, microsecond: int = 0) -> str:
+        with patch("functions.save_data_to_csv.datetime") as mock_datetime:
+            mock_datetime.fromisoformat = datetime.fromisoformat
+            mock_datetime.now.return_value = datetime(2024, 1, day, 12, 0, 0, microsecond)
+            mock_datetime.today.return_value = datetime(2024, 1, day, 12)
+            return persist_idealista_data(
+                pd.DataFrame(rows, columns=["propertyCode", "price"]),
+                data_dir=self.data_directory,
+                schema_registry=self.schema_registry,
+            )
+
+    def test_backup_and_append(self):
+        """TestPersistIdealistaData 1: the state before every run is backed up and the rows are appended"""
+        self.assertEqual(self.persist(1, [["1", 1000.0]]), "idealista_data.csv")
+        self.persist(2, [["2", 1200.0]])
+        self.persist(3, [["3", 900.0]])
+        # full backup is due again
+        self.persist(9, [["4", 1100.0]])
+
+        with open(self.file_path, "r", encoding="utf-8") as file:
+            self.assertEqual(
+                file.read(), "propertyCode,price\n1,1000.0\n2,1200.0\n3,900.0\n4,1100.0\n"
+            )
+        entries = read_backup_manifest(data_dir=self.data_directory)
+        self.assertEqual([entry["type"] for entry in entries], ["full", "delta", "full"])
+        target_path = os.path.join(self.data_directory, "restored.csv")
+        restore_idealista_data(data_dir=self.data_directory, date="2024-01-03", target_path=target_path)
+        with open(target_path, "r", encoding="utf-8") as file:
+            self.assertEqual(file.read(), "propertyCode,price\n1,1000.0\n2,1200.0\n")
+        self.assertEqual(list(self.schema_registry.partitions), ["idealista_data.csv"])
+        self.assertFalse(
+            [name for name in os.listdir(self.data_directory) if name.endswith(".tmp")]
+        )
+
+    def test_failed_append_is_rolled_back(self):
+        """TestPersistIdealistaData 2: a failed append leaves the file as it was"""
+        self.persist(1, [["1", 1000.0]])
+        self.persist(2, [["2", 1200.0]])
+        with open(self.file_path, "rb") as file:
+            content = file.read()
+
+        with patch("functions.save_data_to_csv.os.fsync", side_effect=OSError("disk full")):
+            with self.assertRaises(OSError):
+                self.persist(3, [["3", 900.0]])
+
+        with open(self.file_path, "rb") as file:
+            self.assertEqual(file.read(), content)
+
+    def test_interrupted_append_is_undone(self):
+        """TestPersistIdealistaData 3: an append that was killed is cut back when the file is opened again"""
+        self.persist(1, [["1", 1000.0]])
+        size = os.path.getsize(self.file_path)
+        # state after a crash: journal with the size before the append, rows partly written
+        with open(self.file_path + ".append_journal.json", "w", encoding="utf-8") as file:
+            file.write('{"size": %d}' % size)
+        with open(self.file_path, "a", encoding="utf-8") as file:
+            file.write("2,1200.0\n3,9")
+
+        recover_interrupted_append(self.file_path)
+
+        self.assertEqual(os.path.getsize(self.file_path), size)
+        self.assertFalse(os.path.exists(self.file_path + ".append_journal.json"))
+        self.persist(2, [["2", 1200.0]])
+        with open(self.file_path, "r", encoding="utf-8") as file:
+            self.assertEqual(file.read(), "propertyCode,price\n1,1000.0\n2,1200.0\n")
+
+    def test_backups_within_one_second(self):
+        """TestPersistIdealistaData 4: backups created within the same second do not overwrite each other"""
+        self.persist(1, [["1", 1000.0]])
+        self.persist(2, [["2", 1200.0]])
+        self.persist(3, [["3", 900.0]], microsecond=1000)
+        self.persist(3, [["4", 1100.0]], microsecond=2000)
+
+        # the first delta of the day is pruned, which must not delete the second one
+        entries = read_backup_manifest(data_dir=self.data_directory)
+        self.assertEqual([entry["type"] for entry in entries], ["full", "delta"])
+        for entry in entries:
+            self.assertTrue(
+                os.path.exists(
+                    os.path.join(self.data_directory, "idealista_data_backups", entry["file"])
+                )
+            )
+        target_path = os.path.join(self.data_directory, "restored.csv")
+        restore_idealista_data(data_dir=self.data_directory, target_path=target_path)
+        with open(target_path, "r", encoding="utf-8") as file:
+            self.assertEqual(file.read(), "propertyCode,price\n1,1000.0\n2,1200.0\n3,900.0\n")
+
+    def test_append_keeps_crlf_line_ends(self):
+        """TestPersistIdealistaData 5: rows appended to a partition with CRLF line ends use CRLF as well"""
+        os.makedirs(self.data_directory, exist_ok=True)
+        with open(self.file_path, "wb") as file:
+            file.write(b"propertyCode,price\r\n1,1000.0\r\n")
+
+        self.persist(1, [["2", 1200.0]])
+        self.persist(2, [["3", 900.0]])
+
+        with open(self.file_path, "rb") as file:
+            self.assertEqual(
+                file.read(), b"propertyCode,price\r\n1,1000.0\r\n2,1200.0\r\n3,900.0\r\n"
+            )
+
+
+class TestIterIdealistaData(unittest.TestCase):
+    def setUp(self):
+        self.file_name = "idealista_data_chunks.csv"
+        self.file_path = os.path.join(TEST_DATA_DIRECTORY, self.file_name)
+        with open(self.file_path, "w", encoding="utf-8") as file:
+            file.write(
+                "propertyCode,price,size,floor,description\n"
+                "0123,1000.0,50.0,1,a\n"
+                "2,1200,60.0,bj,\n"
+                "0123,1000,50,2,b\n"
+                "3,900.0,45.0,,c\n"
+                "2,1200.0,60.0,3,d\n"
+            )
+
+    def tearDown(self):
+        os.remove(self.file_path)
+
+    def test_iter_idealista_data(self):
+        """TestIterIdealistaData 1: chunks have at most chunksize rows, the selected columns and dtypes"""
+        chunks = list(
+            iter_idealista_data(
+                chunksize=2,
+                usecols=["size", "propertyCode"],
+                dtype={"size": "float32"},
+                file_name=self.file_name,
+                data_dir=TEST_DATA_DIRECTORY,
+            )
+        )
+
+        self.assertEqual([len(chunk) for chunk in chunks], [2, 2, 1])
+        self.assertEqual(list(chunks[0].columns), ["size", "propertyCode"])
+        self.assertEqual(chunks[0]["size"].dtype, "float32")
+        self.assertEqual(chunks[0]["propertyCode"].tolist(), ["0123", "2"])
+
+    def test_remove_duplicates_in_chunks(self):
+        """TestIterIdealistaData 2: duplicates in different chunks are removed, other values are not changed"""
+        remove_duplicates_from_csv(
+            file_name=self.file_name, data_dir=TEST_DATA_DIRECTORY, chunksize=2
+        )
+
+        with open(self.file_path, "r", encoding="utf-8") as file:
+            self.assertEqual(
+                file.read(),
+                "propertyCode,price,size,floor,description\n"
+                "0123,1000,50,2,b\n"
+                "3,900.0,45.0,,c\n"
+                "2,1200.0,60.0,3,d\n",
+            )
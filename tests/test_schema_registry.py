@@ -0,0 +1,70 @@
+from functions.schema_registry import SchemaRegistry, unify_dtypes
+from functions.save_data_to_csv import append_idealista_data, read_idealista_data
+import unittest
+import os
+import shutil
+import pandas as pd
+from pandas.testing import assert_frame_equal
+
+from global_variables import TEST_DATA_DIRECTORY
+
+
+class TestSchemaRegistry(unittest.TestCase):
+    def setUp(self):
+        self.data_directory = os.path.join(TEST_DATA_DIRECTORY, "schema_test/")
+        self.registry_file = os.path.join(self.data_directory, "idealista_data_schema.json")
+        os.makedirs(self.data_directory, exist_ok=True)
+
+    def tearDown(self):
+        shutil.rmtree(self.data_directory, ignore_errors=True)
+
+    def test_unify_dtypes(self):
+        """TestSchemaRegistry 1: dtypes are widened so that both columns fit"""
+        self.assertEqual(unify_dtypes(None, "bool"), "bool")
+        self.assertEqual(unify_dtypes("int64", "float64"), "float64")
+        self.assertEqual(unify_dtypes("bool", "object"), "object")
+
+    def test_new_columns_are_written_to_new_partition(self):
+        """TestSchemaRegistry 2: batches with new or missing columns are read back as one typed frame"""
+        # existing history without registry
+        pd.DataFrame(
+            {"propertyCode": ["1"], "price": [1000.0], "rooms": [2], "hasLift": [True]}
+        ).to_csv(os.path.join(self.data_directory, "idealista_data.csv"), index=False)
+        schema_registry = SchemaRegistry(self.registry_file)
+
+        # new column
+        append_idealista_data(
+            df_new_data=pd.DataFrame(
+                {"propertyCode": ["2"], "price": [1200.0], "rooms": [3], "hasLift": [False], "newColumn": ["x"]}
+            ),
+            data_dir=self.data_directory,
+            schema_registry=schema_registry,
+        )
+        # missing column, appended to the partition with the new column
+        append_idealista_data(
+            df_new_data=pd.DataFrame({"propertyCode": ["3"], "price": [900.0], "newColumn": ["y"]}),
+            data_dir=self.data_directory,
+            schema_registry=schema_registry,
+        )
+
+        schema_registry = SchemaRegistry(self.registry_file)
+        self.assertEqual(len(schema_registry.partitions), 2)
+        df = read_idealista_data(schema_registry, data_dir=self.data_directory)
+        assert_frame_equal(
+            df,
+            pd.DataFrame(
+                {
+                    "propertyCode": ["1", "2", "3"],
+                    "price": [1000.0, 1200.0, 900.0],
+                    "rooms": pd.array([2, 3, None], dtype="Int64"),
+                    "hasLift": pd.array([True, False, None], dtype="boolean"),
+                    "newColumn": [float("nan"), "x", "y"],
+                }
+            ).astype({"newColumn": object}),
+        )
+        df = read_idealista_data(schema_registry, columns=["propertyCode", "newColumn"], data_dir=self.data_directory)
+        self.assertEqual(list(df.columns), ["propertyCode", "newColumn"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,12 +1,15 @@
 import unittest
 from unittest.mock import patch, MagicMock
 
-from functions.write_data_to_nosql import DynamoDB_Helper
+from functions.write_data_to_nosql import DynamoDB_Helper, marshal_dataframe, unmarshal_items
+from functions.listing_snapshot import ListingSnapshot
+from botocore.exceptions import ClientError
 
 import botocore.session
 import botocore.errorfactory
 
 import pandas as pd
+import numpy as np
 import os
 from global_variables import TEST_DATA_DIRECTORY
 
@@ -25,7 +28,7 @@ class TestCreateTableNoSQL(unittest.TestCase):
         cls.mock_dynamodb_resource.return_value = cls.mock_dynamodb
 
         # set up DynamoDB client
-        cls.dynamodb_helper = DynamoDB_Helper()
+        cls.dynamodb_helper = DynamoDB_Helper(key_schema="listing")
 
     @classmethod
     def tearDownClass(cls):
@@ -114,6 +117,15 @@ class TestCreateTableNoSQL(unittest.TestCase):
             return_value=True,
             autospec=True,
         ):
+            self.mock_dynamodb.describe_table.side_effect = None
+            self.mock_dynamodb.describe_table.return_value = {
+                "Table": {
+                    "KeySchema": [
+                        {"AttributeName": "propertyCode", "KeyType": "HASH"},
+                        {"AttributeName": "insert_date", "KeyType": "RANGE"},
+                    ]
+                }
+            }
             # Call the function create_table_NoSQL
             test_table_name = "test_table"
             result = self.dynamodb_helper.create_table_NoSQL(test_table_name)
@@ -126,6 +138,66 @@ class TestCreateTableNoSQL(unittest.TestCase):
             )
             self.assertIsNone(result)
 
+    def test_existing_table_with_other_key_schema(self):
+        """An existing table keyed by run is not written with the listing key schema"""
+        with patch.object(
+            DynamoDB_Helper, "check_if_table_exists_NoSQL", return_value=True, autospec=True
+        ):
+            self.mock_dynamodb.reset_mock()
+            self.mock_dynamodb.describe_table.side_effect = None
+            self.mock_dynamodb.describe_table.return_value = {
+                "Table": {
+                    "KeySchema": [
+                        {"AttributeName": "insert_date", "KeyType": "HASH"},
+                        {"AttributeName": "run", "KeyType": "RANGE"},
+                    ]
+                }
+            }
+
+            with self.assertRaisesRegex(ValueError, "key_schema=run"):
+                self.dynamodb_helper.create_table_NoSQL("IdealistaDataMadrid")
+            self.mock_dynamodb.create_table.assert_not_called()
+            # the default key schema is the one of the existing table
+            self.assertIsNone(DynamoDB_Helper().create_table_NoSQL("IdealistaDataMadrid"))
+
+
+    def test_table_key_schema_and_capacity(self):
+        """Tables are keyed by propertyCode and date with a district index, on-demand or autoscaled"""
+        with patch.object(
+            DynamoDB_Helper, "check_if_table_exists_NoSQL", return_value=False, autospec=True
+        ):
+            self.mock_dynamodb.reset_mock()
+            self.dynamodb_helper.create_table_NoSQL("test_table")
+            parameters = self.mock_dynamodb.create_table.call_args.kwargs
+            self.assertEqual(
+                [key["AttributeName"] for key in parameters["KeySchema"]],
+                ["propertyCode", "insert_date"],
+            )
+            self.assertEqual(parameters["BillingMode"], "PAY_PER_REQUEST")
+            self.assertNotIn("ProvisionedThroughput", parameters)
+            self.assertEqual(
+                parameters["GlobalSecondaryIndexes"][0]["IndexName"], "district-insert_date-index"
+            )
+
+            self.mock_dynamodb.reset_mock()
+            self.dynamodb_helper.create_table_NoSQL(
+                "test_table",
+                billing_mode="PROVISIONED",
+                autoscaling={"min_capacity": 5, "max_capacity": 50, "target_utilization": 70},
+            )
+            parameters = self.mock_dynamodb.create_table.call_args.kwargs
+            self.assertEqual(parameters["ProvisionedThroughput"]["WriteCapacityUnits"], 5)
+            self.assertIn("ProvisionedThroughput", parameters["GlobalSecondaryIndexes"][0])
+            # read and write capacity of the table and the index
+            self.assertEqual(self.mock_dynamodb.register_scalable_target.call_count, 4)
+            self.assertEqual(
+                self.mock_dynamodb.register_scalable_target.call_args.kwargs["ResourceId"],
+                "table/test_table/index/district-insert_date-index",
+            )
+
+        with self.assertRaises(ValueError):
+            DynamoDB_Helper(key_schema="unknown")
+
 
 class TestWriteToDynamoDB(unittest.TestCase):
     @classmethod
@@ -135,15 +207,10 @@ class TestWriteToDynamoDB(unittest.TestCase):
         # provide sample df
         cls.data_directory = TEST_DATA_DIRECTORY
         cls.file_name_idealista_data = "df_nosql_test.csv"
-        cls.file_name_idealista_data_processed = "df_nosql_test_result.pkl"
         cls.file_path_idealista_data = os.path.join(
             cls.data_directory, cls.file_name_idealista_data
         )
-        cls.file_path_idealista_data_processed = os.path.join(
-            cls.data_directory, cls.file_name_idealista_data_processed
-        )
         cls.df = pd.read_csv(cls.file_path_idealista_data, keep_default_na=False)
-        cls.test_df = pd.read_pickle(cls.file_path_idealista_data_processed)
 
     @classmethod
     def tearDownClass(cls):
@@ -159,38 +226,159 @@ class TestWriteToDynamoDB(unittest.TestCase):
     )
     @patch("functions.write_data_to_nosql.boto3")
     def test_write_data_to_NoSQL_success(self, mock_boto3):
-        # Mocking DynamoDB batch_writer
-        mock_batch_writer = MagicMock()
-        mock_batch_writer.__enter__.return_value = mock_batch_writer
-        mock_batch_writer.__exit__.return_value = False
-
-        # Mocking DynamoDB Table
-        mock_table = MagicMock()
-        mock_table.batch_writer.return_value = mock_batch_writer
-        mock_table.put_item.side_effect = [
-            None,
-            None,
-            None,
-        ]  # Successful write
-
-        # Mocking DynamoDB client and its operations
-        mock_dynamodb = MagicMock()
-        mock_dynamodb.Table.return_value = mock_table
-        mock_boto3.resource.return_value = mock_dynamodb
+        # Mocking the clients of the writer threads
+        mock_worker_client = MagicMock()
+        mock_worker_client.batch_write_item.return_value = {"UnprocessedItems": {}}
+        mock_boto3.session.Session.return_value.client.return_value = mock_worker_client
 
         # Instantiate YourClass
-        obj = DynamoDB_Helper()
+        obj = DynamoDB_Helper(key_schema="listing")
 
         # Call the function
         result = obj.write_data_to_NoSQL(self.df)
 
         # Assertions
         mock_boto3.client.assert_called_once_with("dynamodb")
-        mock_dynamodb.Table.assert_called_once_with("IdealistaDataMadrid")
-        self.assertEqual(mock_batch_writer.put_item.call_count, 1)
-        pd.testing.assert_frame_equal(
-            result, self.test_df
-        )  # Check if DataFrame is modified as expected
+        mock_boto3.session.Session.return_value.client.assert_called_once_with("dynamodb")
+        request_items = mock_worker_client.batch_write_item.call_args.kwargs["RequestItems"]
+        self.assertEqual(len(request_items["IdealistaDataMadrid"]), 1)
+        item = request_items["IdealistaDataMadrid"][0]["PutRequest"]["Item"]
+        self.assertEqual(item["propertyCode"], {"S": "123456678"})
+        self.assertEqual(item["price"], {"N": "1500.0"})
+        self.assertEqual(item["exterior"], {"BOOL": True})
+        self.assertEqual(item["detailedType"], {"M": {"typology": {"S": "flat"}}})
+        self.assertEqual(item["run"], {"N": "0"})
+        # blank values are not written
+        self.assertNotIn("externalReference", item)
+        self.assertEqual(list(result["run"]), [0])
+
+    def test_marshal_dataframe(self):
+        """Columns are converted to native DynamoDB types, missing values are left out"""
+        df = pd.DataFrame(
+            {
+                "propertyCode": [103051203, np.nan],
+                "rooms": pd.array([2, None], dtype="Int16"),
+                "latitude": np.array([40.4168, 40.5], dtype="float32"),
+                "hasLift": pd.array([True, None], dtype="boolean"),
+                "district": pd.Categorical(["Centro", None]),
+                "suggestedTexts": [{"title": "Piso", "score": 1.5}, np.nan],
+                "description": ["", "Piso"],
+            }
+        )
+
+        items = marshal_dataframe(df)
+
+        self.assertEqual(
+            items[0],
+            {
+                "propertyCode": {"S": "103051203"},
+                "rooms": {"N": "2"},
+                "latitude": {"N": "40.4168"},
+                "hasLift": {"BOOL": True},
+                "district": {"S": "Centro"},
+                "suggestedTexts": {"M": {"title": {"S": "Piso"}, "score": {"N": "1.5"}}},
+            },
+        )
+        self.assertEqual(items[1], {"latitude": {"N": "40.5"}, "description": {"S": "Piso"}})
+
+    @patch.dict(
+        os.environ,
+        {
+            "AWS_ACCESS_KEY_ID": "your_access_key",
+            "AWS_SECRET_ACCESS_KEY": "your_secret_key",
+            "AWS_DEFAULT_REGION": "your_region",
+        },
+    )
+    @patch("functions.write_data_to_nosql.boto3")
+    def test_write_data_to_NoSQL_one_item_per_key(self, mock_boto3):
+        """A listing that is in the batch twice on the same day is written once"""
+        mock_worker_client = MagicMock()
+        mock_worker_client.batch_write_item.return_value = {"UnprocessedItems": {}}
+        mock_boto3.session.Session.return_value.client.return_value = mock_worker_client
+        df = pd.DataFrame(
+            {"propertyCode": ["1", "1", "2"], "price": [1500.0, 1400.0, 900.0], "insert_date": "2024-01-01"}
+        )
+
+        DynamoDB_Helper(key_schema="listing").write_data_to_NoSQL(df, table_name="test_table")
+
+        requests = mock_worker_client.batch_write_item.call_args.kwargs["RequestItems"]["test_table"]
+        self.assertEqual(
+            [request["PutRequest"]["Item"]["price"] for request in requests],
+            [{"N": "1400.0"}, {"N": "900.0"}],
+        )
+
+    @patch("functions.write_data_to_nosql.time.sleep")
+    @patch("functions.write_data_to_nosql.boto3")
+    def test_batch_write_items_retries_unprocessed_items(self, mock_boto3, _mock_sleep):
+        """Unprocessed items are sent again, items that are never processed are counted as failed"""
+        mock_worker_client = MagicMock()
+        mock_boto3.session.Session.return_value.client.return_value = mock_worker_client
+
+        def batch_write_item(RequestItems):
+            requests = RequestItems["test_table"]
+            if requests[0]["PutRequest"]["Item"]["run"] == {"N": "0"}:
+                # the first item of the first batch is never processed
+                return {"UnprocessedItems": {"test_table": requests[:1]}}
+            if len(requests) > 5:
+                # throttled: half of the batch is processed
+                return {"UnprocessedItems": {"test_table": requests[len(requests) // 2 :]}}
+            return {"UnprocessedItems": {}}
+
+        mock_worker_client.batch_write_item.side_effect = batch_write_item
+        items = marshal_dataframe(pd.DataFrame({"insert_date": "2024-01-01", "run": range(60)}))
+
+        written, failed = DynamoDB_Helper().batch_write_items(
+            items, table_name="test_table", max_workers=2, max_retries=3
+        )
+
+        self.assertEqual((written, failed), (59, 1))
+        for call in mock_worker_client.batch_write_item.call_args_list:
+            self.assertLessEqual(len(call.kwargs["RequestItems"]["test_table"]), 25)
+        # every worker has its own client
+        self.assertEqual(mock_boto3.session.Session.return_value.client.call_count, 2)
+
+    @patch.dict(
+        os.environ,
+        {
+            "AWS_ACCESS_KEY_ID": "your_access_key",
+            "AWS_SECRET_ACCESS_KEY": "your_secret_key",
+            "AWS_DEFAULT_REGION": "your_region",
+        },
+    )
+    @patch("functions.write_data_to_nosql.boto3")
+    def test_write_data_to_NoSQL_incremental(self, mock_boto3):
+        """Only new or changed listings are written, puts of listings in the table change nothing"""
+        mock_worker_client = MagicMock()
+        mock_boto3.session.Session.return_value.client.return_value = mock_worker_client
+        snapshot_file = os.path.join(TEST_DATA_DIRECTORY, "idealista_nosql_snapshot.json")
+        self.addCleanup(lambda: os.path.exists(snapshot_file) and os.remove(snapshot_file))
+        df = pd.DataFrame(
+            {"propertyCode": ["1", "2", "3"], "price": [1500.0, 900.0, 1200.0], "insert_date": "2024-01-01"}
+        )
+
+        DynamoDB_Helper(key_schema="listing").write_data_to_NoSQL(df, snapshot=ListingSnapshot(snapshot_file))
+        self.assertEqual(mock_worker_client.put_item.call_count, 3)
+
+        # next day: listing 2 has a new price, listing 3 was already written by a retry
+        mock_worker_client.reset_mock()
+        mock_worker_client.put_item.side_effect = [
+            None,
+            ClientError({"Error": {"Code": "ConditionalCheckFailedException"}}, "PutItem"),
+        ]
+        snapshot = ListingSnapshot(snapshot_file)
+        snapshot.hashes.pop("3")
+        df["insert_date"] = "2024-01-02"
+        df.loc[1, "price"] = 850.0
+
+        DynamoDB_Helper(key_schema="listing").write_data_to_NoSQL(df, max_workers=1, snapshot=snapshot)
+
+        written = [
+            call.kwargs["Item"]["propertyCode"]["S"]
+            for call in mock_worker_client.put_item.call_args_list
+        ]
+        self.assertEqual(written, ["2", "3"])
+        self.assertIn("ConditionExpression", mock_worker_client.put_item.call_args.kwargs)
+        self.assertEqual(len(ListingSnapshot(snapshot_file)), 3)
 
     # test case where keys are not set
     @patch.dict(
@@ -209,5 +397,101 @@ class TestWriteToDynamoDB(unittest.TestCase):
                 obj.write_data_to_NoSQL(self.df)
 
 
+class TestReadFromDynamoDB(unittest.TestCase):
+    def setUp(self):
+        self.items = marshal_dataframe(
+            pd.DataFrame(
+                {
+                    "propertyCode": [str(code) for code in range(10)],
+                    "insert_date": "2024-01-01",
+                    "price": [1000.0 + code for code in range(10)],
+                    "rooms": [1, 2] * 5,
+                    "district": ["Centro", "Retiro"] * 5,
+                    "hasLift": [True, False] * 5,
+                }
+            )
+        )
+
+    def test_unmarshal_items(self):
+        """Items are converted to a typed dataframe, missing attributes are missing values"""
+        items = self.items[:2] + [{"propertyCode": {"S": "x"}, "detailedType": {"M": {"typology": {"S": "flat"}}}}]
+
+        df = unmarshal_items(items)
+
+        self.assertEqual(list(df.columns), ["propertyCode", "insert_date", "price", "rooms", "district", "hasLift", "detailedType"])
+        self.assertEqual(df["price"].dtype, np.float64)
+        self.assertEqual(df["rooms"].dtype, "Int16")
+        self.assertEqual(df["district"].dtype, "category")
+        self.assertEqual(df["hasLift"].dtype, "boolean")
+        self.assertTrue(pd.isna(df.loc[2, "price"]))
+        self.assertEqual(df.loc[2, "detailedType"], {"typology": "flat"})
+        self.assertEqual(unmarshal_items(items, dtype_profile=False)["rooms"].dtype, "Int64")
+
+    @patch("functions.write_data_to_nosql.boto3")
+    def test_parallel_scan(self, mock_boto3):
+        """Every segment is scanned page by page on its own client, pages are yielded as dataframes"""
+        mock_client = MagicMock()
+        mock_boto3.session.Session.return_value.client.return_value = mock_client
+
+        def scan(**parameters):
+            # segment 0 has two pages, segment 1 has one page, segment 2 is empty
+            segment = parameters["Segment"]
+            if segment == 0 and "ExclusiveStartKey" not in parameters:
+                return {"Items": self.items[:3], "LastEvaluatedKey": {"propertyCode": {"S": "2"}}}
+            return {"Items": {0: self.items[3:5], 1: self.items[5:], 2: []}[segment]}
+
+        mock_client.scan.side_effect = scan
+
+        pages = list(
+            DynamoDB_Helper().iter_scan_NoSQL(total_segments=3, columns=["propertyCode", "size"])
+        )
+
+        self.assertEqual(sorted(len(page) for page in pages), [2, 3, 5])
+        self.assertEqual(mock_boto3.session.Session.return_value.client.call_count, 3)
+        parameters = mock_client.scan.call_args.kwargs
+        self.assertEqual(parameters["TotalSegments"], 3)
+        self.assertEqual(parameters["ProjectionExpression"], "#p0, #p1")
+        self.assertEqual(parameters["ExpressionAttributeNames"]["#p1"], "size")
+        df = DynamoDB_Helper().read_data_from_NoSQL(total_segments=3)
+        self.assertEqual(sorted(df["propertyCode"]), [str(code) for code in range(10)])
+
+    @patch("functions.write_data_to_nosql.boto3")
+    def test_query(self, mock_boto3):
+        """Listings are queried on the table, districts on the index, both with a date range"""
+        mock_client = MagicMock()
+        mock_boto3.session.Session.return_value.client.return_value = mock_client
+        mock_client.query.side_effect = [
+            {"Items": self.items[:1], "LastEvaluatedKey": {"propertyCode": {"S": "0"}}},
+            {"Items": self.items[1:2]},
+            {"Items": self.items[2:4]},
+        ]
+        helper = DynamoDB_Helper(key_schema="listing")
+
+        df = helper.read_data_from_NoSQL(propertyCode="0", min_insert_date="2024-01-01")
+        parameters = mock_client.query.call_args.kwargs
+        self.assertEqual(len(df), 2)
+        self.assertEqual(
+            parameters["KeyConditionExpression"],
+            "#propertyCode = :propertyCode AND #insert_date >= :min_insert_date",
+        )
+        self.assertEqual(parameters["ExclusiveStartKey"], {"propertyCode": {"S": "0"}})
+        self.assertNotIn("IndexName", parameters)
+
+        pages = list(
+            helper.iter_query_NoSQL(
+                district="Centro", min_insert_date="2024-01-01", max_insert_date="2024-01-31", as_arrow=True
+            )
+        )
+        parameters = mock_client.query.call_args.kwargs
+        self.assertEqual(pages[0].num_rows, 2)
+        self.assertEqual(parameters["IndexName"], "district-insert_date-index")
+        self.assertEqual(
+            parameters["KeyConditionExpression"],
+            "#district = :district AND #insert_date BETWEEN :min_insert_date AND :max_insert_date",
+        )
+        with self.assertRaises(ValueError):
+            list(helper.iter_query_NoSQL())
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,80 @@
+from functions.write_data_to_sqlite import SQLiteListingStore
+import unittest
+import os
+import numpy as np
+import pandas as pd
+
+from global_variables import TEST_DATA_DIRECTORY
+
+
+class TestSQLiteListingStore(unittest.TestCase):
+    def setUp(self):
+        self.db_file = os.path.join(TEST_DATA_DIRECTORY, "idealista_data_test.sqlite")
+        self.store = SQLiteListingStore(self.db_file)
+        self.df = pd.DataFrame(
+            {
+                "propertyCode": ["1", "2", "3"],
+                "price": [1500.0, 900.0, 1200.0],
+                "priceByArea": [21.0, 15.0, 12.0],
+                "district": pd.Categorical(["Centro", "Centro", "Retiro"]),
+                "neighborhood": ["Sol", "Sol", "Ibiza"],
+                "exterior": [True, False, True],
+                "parkingSpace": [np.nan, {"hasParkingSpace": True}, np.nan],
+                "insert_date": ["2024-01-01"] * 3,
+            }
+        )
+
+    def tearDown(self):
+        self.store.close()
+        for suffix in ["", "-wal", "-shm"]:
+            if os.path.exists(self.db_file + suffix):
+                os.remove(self.db_file + suffix)
+
+    def test_upsert(self):
+        """TestSQLiteListingStore 1: listings of the same day are updated, other days are added"""
+        self.assertEqual(self.store.upsert(self.df), 3)
+        df_update = pd.DataFrame(
+            {
+                "propertyCode": ["1", "1"],
+                "price": [1400.0, 1300.0],
+                "priceByArea": [20.0, 18.6],
+                "insert_date": ["2024-01-01", "2024-01-02"],
+                "hasLift": [True, None],
+            }
+        )
+        self.store.upsert(df_update)
+
+        self.assertEqual(len(self.store), 4)
+        df_history = self.store.price_history("1")
+        self.assertEqual(list(df_history["insert_date"]), ["2024-01-01", "2024-01-02"])
+        self.assertEqual(list(df_history["price"]), [1400.0, 1300.0])
+        df = self.store.query_listings(propertyCode="2")
+        self.assertEqual(df.loc[0, "parkingSpace"], '{"hasParkingSpace": true}')
+        self.assertEqual(df.loc[0, "exterior"], 0)
+        self.assertIsNone(df.loc[0, "hasLift"])
+        with self.assertRaises(ValueError):
+            self.store.upsert(self.df.drop(columns="insert_date"))
+
+    def test_query_listings(self):
+        """TestSQLiteListingStore 2: filters are combined, the cheapest listings come first"""
+        self.store.upsert(self.df)
+
+        df = self.store.cheap_listings(district="Centro", max_price_by_area=25.0)
+
+        self.assertEqual(list(df["propertyCode"]), ["2", "1"])
+        self.assertEqual(
+            sorted(self.store.query_listings(max_price_by_area=15.0, columns=["propertyCode"])["propertyCode"]),
+            ["2", "3"],
+        )
+        self.assertEqual(len(self.store.query_listings(neighborhood="Sol", min_insert_date="2024-01-02")), 0)
+        indexes = self.store.query("SELECT name FROM sqlite_master WHERE type = 'index'")["name"]
+        self.assertIn("idx_listings_district_neighborhood", list(indexes))
+        plan = self.store.query(
+            "EXPLAIN QUERY PLAN SELECT * FROM listings WHERE district = ? AND priceByArea <= ?",
+            ["Centro", 25.0],
+        )
+        self.assertIn("idx_listings_district_neighborhood", " ".join(plan["detail"]))
+
+
+if __name__ == "__main__":
+    unittest.main()